@@ -41,38 +41,42 @@ Scenarios:
       Then: Return COMPLIANT
 '''
 import json
-from time import sleep
 
 from rdklib import Evaluator, Evaluation, ConfigRule, ComplianceType
+# Deployed as a Lambda layer, see ../README.md
+import rule_runtime
 
 DEFAULT_RESOURCE_TYPE = 'AWS::ElasticLoadBalancingV2::LoadBalancer'
-DEFAULT_THROTTLE_PERIOD = 0.1
 CONFIG_PAGE_SIZE = 100
 ELB_PAGE_SIZE = 400
 
 class ALB_HTTP_TO_HTTPS_REDIRECTION_CHECK(ConfigRule):
     def evaluate_periodic(self, event, client_factory, valid_rule_parameters):
         evaluations = []
+        # The calls are paced by the adaptive rate limiters of the account instead of fixed sleeps between the pages.
+        client_factory = rule_runtime.RateLimitedClientFactory(client_factory, event.get('accountId'))
         alb_client = client_factory.build_client("elbv2")
         config_client = client_factory.build_client("config")
-        all_elbv2 = get_all_albs(config_client)
-        for elb in all_elbv2:
-            alb_all_listeners = get_all_listeners(alb_client, elb)
-            is_alb_compliant = all(is_listener_compliant(listener, alb_client) for listener in alb_all_listeners)
-            if is_alb_compliant:
-                evaluations.append(
-                    Evaluation(ComplianceType.COMPLIANT, elb, DEFAULT_RESOURCE_TYPE))
-            else:
-                evaluations.append(
-                    Evaluation(ComplianceType.NON_COMPLIANT, elb, DEFAULT_RESOURCE_TYPE,
-                               "HTTP listener rule must have HTTP to HTTPS redirection action configured"))
+        try:
+            all_elbv2 = get_all_albs(config_client)
+            for elb in all_elbv2:
+                alb_all_listeners = get_all_listeners(alb_client, elb)
+                is_alb_compliant = all(is_listener_compliant(listener, alb_client) for listener in alb_all_listeners)
+                if is_alb_compliant:
+                    evaluations.append(
+                        Evaluation(ComplianceType.COMPLIANT, elb, DEFAULT_RESOURCE_TYPE))
+                else:
+                    evaluations.append(
+                        Evaluation(ComplianceType.NON_COMPLIANT, elb, DEFAULT_RESOURCE_TYPE,
+                                   "HTTP listener rule must have HTTP to HTTPS redirection action configured"))
+        finally:
+            rule_runtime.log_rate_limiter_report()
         return evaluations
 
 def get_all_albs(config_client):
     albs, next_token = list_albs(config_client)
 
     while next_token:
-        sleep(DEFAULT_THROTTLE_PERIOD)
         more_albs, next_token = list_albs(config_client, next_token)
 
         albs += more_albs
@@ -102,8 +106,6 @@ def filter_to_only_albs(config_client, all_elbv2):
         items += [elb for elb in response['baseConfigurationItems'] if is_alb(elb)]
 
         resource_keys = response.get('unprocessedResourceKeys')
-        if resource_keys:
-            sleep(DEFAULT_THROTTLE_PERIOD)
 
     return items
 
@@ -119,7 +121,6 @@ def get_all_listeners(client, elbv2_arn):
         items += resp['Listeners']
 
         if 'NextMarker' in resp:
-            sleep(DEFAULT_THROTTLE_PERIOD)
             resp = client.describe_listeners(LoadBalancerArn=elbv2_arn, PageSize=ELB_PAGE_SIZE, Marker=resp['NextMarker'])
         else:
             resp = None
@@ -132,7 +133,6 @@ def get_all_listener_rules(client, listener_arn):
         items += resp['Rules']
 
         if 'NextMarker' in resp:
-            sleep(DEFAULT_THROTTLE_PERIOD)
             resp = client.describe_rules(ListenerArn=listener_arn, PageSize=ELB_PAGE_SIZE, Marker=resp['NextMarker'])
         else:
             resp = None
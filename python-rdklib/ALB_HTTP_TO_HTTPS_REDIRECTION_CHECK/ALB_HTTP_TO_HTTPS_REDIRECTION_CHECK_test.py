@@ -9,6 +9,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
+import os
+import sys
 import unittest
 from mock import patch, MagicMock, call
 from rdklib import Evaluation, ComplianceType
@@ -25,6 +27,8 @@ ELB_RESOURCE_TYPE = 'AWS::ElasticLoadBalancingV2::LoadBalancer'
 # Main Code #
 #############
 
+# rule_runtime is deployed as a Lambda layer, the tests use the copy of the repository (see ../README.md).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'python'))
 MODULE = __import__('ALB_HTTP_TO_HTTPS_REDIRECTION_CHECK')
 RULE = MODULE.ALB_HTTP_TO_HTTPS_REDIRECTION_CHECK()
 
@@ -54,6 +58,15 @@ class ComplianceTest(unittest.TestCase):
         response = RULE.evaluate_periodic(self.event, CLIENT_FACTORY, {})
         rdklibtest.assert_successful_evaluation(self, response, [], 0)
 
+    def test_clientsAreRateLimited(self):
+        CONFIG_CLIENT_MOCK.list_discovered_resources = MagicMock(return_value={
+            'resourceIdentifiers': []
+        })
+        RULE.evaluate_periodic(self.event, CLIENT_FACTORY, {})
+        for client_mock in [ELBV2_CLIENT_MOCK, CONFIG_CLIENT_MOCK]:
+            registered_events = [event_call[1][0] for event_call in client_mock.meta.events.register.mock_calls]
+            self.assertEqual(['before-send', 'needs-retry'], registered_events)
+
     def test_scenario1_noAlbsInAccount_returnsNotApplicable(self):
         CONFIG_CLIENT_MOCK.list_discovered_resources = MagicMock(return_value={
             'resourceIdentifiers': [{'resourceType': ELB_RESOURCE_TYPE, 'resourceId': 'arn1', 'resourceName': 'load-balancer'}]
@@ -230,7 +243,7 @@ class ComplianceTest(unittest.TestCase):
         ]
         rdklibtest.assert_successful_evaluation(self, response, resp_expected, 1)
 
-        self.assertEqual(ELBV2_CLIENT_MOCK.mock_calls, [
+        self.assertEqual(get_api_calls(ELBV2_CLIENT_MOCK), [
             call.describe_listeners(LoadBalancerArn='arn1',
                                     PageSize=400),
             call.describe_listeners(LoadBalancerArn='arn1',
@@ -270,7 +283,7 @@ class ComplianceTest(unittest.TestCase):
             Evaluation(ComplianceType.COMPLIANT, 'arn1', ELB_RESOURCE_TYPE)
         ]
         rdklibtest.assert_successful_evaluation(self, response, resp_expected, 1)
-        self.assertEqual(ELBV2_CLIENT_MOCK.mock_calls, [
+        self.assertEqual(get_api_calls(ELBV2_CLIENT_MOCK), [
             call.describe_listeners(LoadBalancerArn='arn1',
                                     PageSize=400),
             call.describe_rules(ListenerArn='listenerArn1',
@@ -280,6 +293,10 @@ class ComplianceTest(unittest.TestCase):
                                 Marker='ghi')
         ])
 
+def get_api_calls(client_mock):
+    # The registration of the rate limiter on client.meta.events is not an API call.
+    return [api_call for api_call in client_mock.mock_calls if not api_call[0].startswith('meta.')]
+
 def mock_albs_in_config(alb_arns):
     CONFIG_CLIENT_MOCK.list_discovered_resources = MagicMock(return_value={
         'resourceIdentifiers': [
@@ -36,6 +36,8 @@ Scenarios:
 '''
 import json
 from rdklib import ConfigRule, Evaluator, Evaluation, ComplianceType
+# Deployed as a Lambda layer, see ../README.md
+import rule_runtime
 
 APPLICABLE_RESOURCES = ['AWS::EC2::SecurityGroup', 'AWS::CodeBuild::Project']
 
@@ -57,7 +59,12 @@ class EC2_SECURITY_GROUP_ATTACHED_TO_ENI(ConfigRule):
             if relation['resourceId'][0:3] == 'eni':
                 return [Evaluation(ComplianceType.COMPLIANT)]
 
-        if is_security_group_attached_codebuild(client_factory, configuration_item['resourceId']):
+        client_factory = rule_runtime.RateLimitedClientFactory(client_factory, event.get('accountId'))
+        try:
+            is_attached_codebuild = is_security_group_attached_codebuild(client_factory, configuration_item['resourceId'])
+        finally:
+            rule_runtime.log_rate_limiter_report()
+        if is_attached_codebuild:
             return [Evaluation(ComplianceType.COMPLIANT, annotation='This Amazon EC2 security group is associated with at least one AWS CodeBuild project.')]
 
         return [Evaluation(ComplianceType.NON_COMPLIANT, annotation='This Amazon EC2 security group is not associated with an EC2 instance or an ENI.')]
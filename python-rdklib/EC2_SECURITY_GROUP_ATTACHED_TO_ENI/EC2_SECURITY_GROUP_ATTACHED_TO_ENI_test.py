@@ -1,3 +1,5 @@
+import os
+import sys
 import unittest
 from mock import patch, MagicMock
 import rdklibtest
@@ -20,6 +22,8 @@ CONFIG_CLIENT_MOCK = MagicMock()
 def mock_get_client(client_name, *args, **kwargs):
     return CONFIG_CLIENT_MOCK
 
+# rule_runtime is deployed as a Lambda layer, the tests use the copy of the repository (see ../README.md).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'python'))
 MODULE = __import__('EC2_SECURITY_GROUP_ATTACHED_TO_ENI')
 RULE = MODULE.EC2_SECURITY_GROUP_ATTACHED_TO_ENI()
 
@@ -104,3 +108,20 @@ class ComplianceTest(unittest.TestCase):
         response = RULE.evaluate_change({}, {}, config_item, {})
         resp_expected = [Evaluation(ComplianceType.COMPLIANT)]
         rdklibtest.assert_successful_evaluation(self, response, resp_expected)
+
+    def test_rate_limiter_report_is_logged_on_error(self):
+        config_item = {
+            "configuration": {
+                "groupName": "security-group-1"
+            },
+            "relationships": [],
+            "resourceType": "AWS::EC2::SecurityGroup",
+            "configurationItemCaptureTime": "2019-04-28T07:49:40.797Z",
+            "resourceId": "sg-0123456789abcdefg"
+        }
+        CONFIG_CLIENT_MOCK.select_resource_config.side_effect = Exception('Throttling')
+        with patch.object(MODULE.rule_runtime, 'log_rate_limiter_report') as log_rate_limiter_report:
+            with self.assertRaises(Exception):
+                RULE.evaluate_change({}, CLIENT_FACTORY, config_item, {})
+            log_rate_limiter_report.assert_called_once_with()
+        CONFIG_CLIENT_MOCK.select_resource_config.side_effect = None
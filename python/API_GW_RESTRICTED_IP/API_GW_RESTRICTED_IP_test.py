@@ -195,6 +195,25 @@ class TestsOnCompliance(unittest.TestCase):
         resp_expected.append(build_expected_response('NON_COMPLIANT', 'name-api-1-no-match-address', annotation='The attached policy allows more than the whitelist.'))
         resp_expected.append(build_expected_response('NON_COMPLIANT', 'name-api-2-no-match-network', annotation='The attached policy allows more than the whitelist.'))
         assert_successful_evaluation(self, response, resp_expected, 2)
+
+    valid_whitelist_split_networks = '{"WhitelistedIPs":"10.1.1.0/25,10.1.1.128/25,2001:db8::/32"}'
+
+    def test_whitelist_compiled_once_for_all_the_gateways(self):
+        policy = json.dumps({'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 'execute-api:Invoke', 'Resource': '*',
+                                                                     'Condition': {'IpAddress': {'aws:SourceIp': ['10.1.1.0/24', '2001:db8:1::/48']}}}]})
+        apigw_client_mock.get_rest_apis = MagicMock(return_value={'items': [
+            {'name': 'name-api-1', 'policy': policy, 'endpointConfiguration': {'types': ['EDGE']}},
+            {'name': 'name-api-2', 'policy': policy.replace('2001:db8:1::/48', '2001:db9::/48'), 'endpointConfiguration': {'types': ['REGIONAL']}}]})
+        rule.WHITELIST_NETWORKS_CACHE.clear()
+        with patch.object(rule.rule_runtime, 'IpNetworkSet', wraps=rule.rule_runtime.IpNetworkSet) as ip_network_set:
+            response = rule.lambda_handler(build_lambda_scheduled_event(rule_parameters=self.valid_whitelist_split_networks), {})
+            rule.lambda_handler(build_lambda_scheduled_event(rule_parameters=self.valid_whitelist_split_networks), {})
+        resp_expected = []
+        # 10.1.1.0/24 is included in the union of the whitelisted networks.
+        resp_expected.append(build_expected_response('COMPLIANT', 'name-api-1'))
+        resp_expected.append(build_expected_response('NON_COMPLIANT', 'name-api-2', annotation='The attached policy allows more than the whitelist.'))
+        assert_successful_evaluation(self, response, resp_expected, 2)
+        self.assertEqual(1, ip_network_set.call_count)
     
     
 
@@ -210,7 +229,7 @@ def build_lambda_configurationchange_event(invoking_event, rule_parameters=None)
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -225,7 +244,7 @@ def build_lambda_scheduled_event(rule_parameters=None):
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -1,9 +1,9 @@
 import sys
 import unittest
 try:
-    from unittest.mock import MagicMock
+    from unittest.mock import MagicMock, patch
 except ImportError:
-    from mock import MagicMock
+    from mock import MagicMock, patch
 import botocore
 
 ##############
@@ -96,6 +96,10 @@ class ComplianceTest(unittest.TestCase):
         }
     }]
 
+    def describe_cluster(self, ClusterId):
+        # The clusters are described concurrently, in any order.
+        return next(description for description in self.described_clusters if description["Cluster"]["Id"] == ClusterId)
+
     #Scenario 1: No RUNNING and WAITING clusters
     def test_1_no_clusters(self):
         no_clusters = {
@@ -113,12 +117,20 @@ class ComplianceTest(unittest.TestCase):
 
         security_groups_config_items = {
             "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-1111aaaa",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"0.0.0.0/0\"}],\"ipv6Ranges\": []}],\"groupId\": \"sg-1111aaaa\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-2222bbbb",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"1.1.1.1/32\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-2222bbbb\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-3333cccc",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-3333cccc\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-4444dddd",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"0.0.0.0/0\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-4444dddd\"}"
             }],
             "unprocessedResourceKeys": []
@@ -127,7 +139,7 @@ class ComplianceTest(unittest.TestCase):
         EMR_CLIENT_MOCK.configure_mock(**{
             "get_paginator.return_value": EMR_CLIENT_MOCK,
             "paginate.return_value": [self.cluster_list]})
-        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.described_clusters)
+        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.describe_cluster)
         CONFIG_CLIENT_MOCK.batch_get_resource_config = MagicMock(side_effect=[security_groups_config_items])
 
         resp_expected = [build_expected_response('NON_COMPLIANT', compliance_resource_id='j-AAAAA0AAAAA', annotation="This Amazon EMR cluster has one or more Security Groups open to the world."),
@@ -141,12 +153,20 @@ class ComplianceTest(unittest.TestCase):
 
         security_groups_config_items = {
             "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-1111aaaa",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"2.2.2.2/32\"}],\"ipv6Ranges\": []}],\"groupId\": \"sg-1111aaaa\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-2222bbbb",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"1.1.1.1/32\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"1111:1111::/128\"}]}],\"groupId\": \"sg-2222bbbb\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-3333cccc",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [],\"ipv6Ranges\": [{\"cidrIpv6\": \"2222:2222::/128\"}]}],\"groupId\": \"sg-3333cccc\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-4444dddd",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"2.2.2.2/32\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"222:2222::/128\"}]}],\"groupId\": \"sg-4444dddd\"}"
             }],
             "unprocessedResourceKeys": []
@@ -155,7 +175,7 @@ class ComplianceTest(unittest.TestCase):
         EMR_CLIENT_MOCK.configure_mock(**{
             "get_paginator.return_value": EMR_CLIENT_MOCK,
             "paginate.return_value": [self.cluster_list]})
-        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.described_clusters)
+        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.describe_cluster)
         CONFIG_CLIENT_MOCK.batch_get_resource_config = MagicMock(side_effect=[security_groups_config_items])
 
         resp_expected = [build_expected_response('COMPLIANT', compliance_resource_id='j-AAAAA0AAAAA'),
@@ -169,12 +189,20 @@ class ComplianceTest(unittest.TestCase):
 
         security_groups_config_items = {
             "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-1111aaaa",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"2.2.2.2/32\"}],\"ipv6Ranges\": []}],\"groupId\": \"sg-1111aaaa\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-2222bbbb",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"1.1.1.1/32\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"1111:1111::/128\"}]}],\"groupId\": \"sg-2222bbbb\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-3333cccc",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-3333cccc\"}"
             }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-4444dddd",
                 "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [{\"cidrIp\": \"0.0.0.0/0\"}],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-4444dddd\"}"
             }],
             "unprocessedResourceKeys": []
@@ -183,7 +211,7 @@ class ComplianceTest(unittest.TestCase):
         EMR_CLIENT_MOCK.configure_mock(**{
             "get_paginator.return_value": EMR_CLIENT_MOCK,
             "paginate.return_value": [self.cluster_list]})
-        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.described_clusters)
+        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.describe_cluster)
         CONFIG_CLIENT_MOCK.batch_get_resource_config = MagicMock(side_effect=[security_groups_config_items])
 
         resp_expected = [build_expected_response('COMPLIANT', compliance_resource_id='j-AAAAA0AAAAA'),
@@ -192,6 +220,82 @@ class ComplianceTest(unittest.TestCase):
         response = RULE.lambda_handler(build_lambda_scheduled_event(), {})
         assert_successful_evaluation(self, response, resp_expected, 3)
 
+    def test_unprocessed_security_groups_are_retried(self):
+        security_group_keys = [{"resourceType": "AWS::EC2::SecurityGroup", "resourceId": group_id} for group_id in ["sg-1111aaaa", "sg-2222bbbb", "sg-3333cccc", "sg-4444dddd"]]
+        first_response = {
+            "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-1111aaaa",
+                "configuration": "{\"ipPermissions\": [],\"groupId\": \"sg-1111aaaa\"}"
+            }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-2222bbbb",
+                "configuration": "{\"ipPermissions\": [],\"groupId\": \"sg-2222bbbb\"}"
+            }],
+            "unprocessedResourceKeys": security_group_keys[2:]
+        }
+        second_response = {
+            "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-3333cccc",
+                "configuration": "{\"ipPermissions\": [{\"ipv4Ranges\": [],\"ipv6Ranges\": [{\"cidrIpv6\": \"::/0\"}]}],\"groupId\": \"sg-3333cccc\"}"
+            }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-4444dddd",
+                "configuration": "{\"ipPermissions\": [],\"groupId\": \"sg-4444dddd\"}"
+            }],
+            "unprocessedResourceKeys": []
+        }
+
+        EMR_CLIENT_MOCK.configure_mock(**{
+            "get_paginator.return_value": EMR_CLIENT_MOCK,
+            "paginate.return_value": [self.cluster_list]})
+        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.describe_cluster)
+        CONFIG_CLIENT_MOCK.batch_get_resource_config = MagicMock(side_effect=[first_response, second_response])
+
+        resp_expected = [build_expected_response('COMPLIANT', compliance_resource_id='j-AAAAA0AAAAA'),
+                         build_expected_response('NON_COMPLIANT', compliance_resource_id='j-AAAAA000000', annotation="This Amazon EMR cluster has one or more Security Groups open to the world."),
+                         build_expected_response('NON_COMPLIANT', compliance_resource_id='j-AAAAA0BBBBB', annotation="This Amazon EMR cluster has one or more Security Groups open to the world.")]
+        with patch.object(RULE.rule_runtime.ConfigBatchFetcher, 'backoff'):
+            response = RULE.lambda_handler(build_lambda_scheduled_event(), {})
+        assert_successful_evaluation(self, response, resp_expected, 3)
+        # The groups shared by the clusters are read once, the unprocessed ones are sent again.
+        self.assertEqual(security_group_keys, CONFIG_CLIENT_MOCK.batch_get_resource_config.call_args_list[0][1]["resourceKeys"])
+        self.assertEqual(security_group_keys[2:], CONFIG_CLIENT_MOCK.batch_get_resource_config.call_args_list[1][1]["resourceKeys"])
+
+    def test_unprocessed_security_groups_fail_the_evaluation(self):
+        security_group_keys = [{"resourceType": "AWS::EC2::SecurityGroup", "resourceId": group_id} for group_id in ["sg-1111aaaa", "sg-2222bbbb", "sg-3333cccc", "sg-4444dddd"]]
+        first_response = {
+            "baseConfigurationItems": [{
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-1111aaaa",
+                "configuration": "{\"ipPermissions\": [],\"groupId\": \"sg-1111aaaa\"}"
+            }, {
+                "resourceType": "AWS::EC2::SecurityGroup",
+                "resourceId": "sg-2222bbbb",
+                "configuration": "{\"ipPermissions\": [],\"groupId\": \"sg-2222bbbb\"}"
+            }],
+            "unprocessedResourceKeys": security_group_keys[2:]
+        }
+        # The last attempt still leaves sg-3333cccc, open to the world, unprocessed.
+        retry_response = {
+            "baseConfigurationItems": [],
+            "unprocessedResourceKeys": security_group_keys[2:]
+        }
+
+        EMR_CLIENT_MOCK.configure_mock(**{
+            "get_paginator.return_value": EMR_CLIENT_MOCK,
+            "paginate.return_value": [self.cluster_list]})
+        EMR_CLIENT_MOCK.describe_cluster = MagicMock(side_effect=self.describe_cluster)
+        CONFIG_CLIENT_MOCK.batch_get_resource_config = MagicMock(side_effect=[first_response] + [retry_response] * (RULE.rule_runtime.config_batch.CONFIG_BATCH_MAX_ATTEMPTS - 1))
+        CONFIG_CLIENT_MOCK.put_evaluations = MagicMock()
+
+        with patch.object(RULE.rule_runtime.ConfigBatchFetcher, 'backoff'):
+            response = RULE.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual('2 AWS::EC2::SecurityGroup left unprocessed by batch_get_resource_config: sg-3333cccc, sg-4444dddd', response['internalErrorMessage'])
+        self.assertEqual(RULE.rule_runtime.config_batch.CONFIG_BATCH_MAX_ATTEMPTS, CONFIG_CLIENT_MOCK.batch_get_resource_config.call_count)
+        CONFIG_CLIENT_MOCK.put_evaluations.assert_not_called()
+
 ####################
 # Helper Functions #
 ####################
@@ -73,6 +73,7 @@ class ComplianceTest(unittest.TestCase):
     invoking_event_iam_role_sample = '{"configurationItem":{"relatedEvents":[],"relationships":[],"configuration":{},"tags":{},"configurationItemCaptureTime":"2018-07-02T03:37:52.418Z","awsAccountId":"123456789012","configurationItemStatus":"ResourceDiscovered","resourceType":"AWS::IAM::Role","resourceId":"some-resource-id","resourceName":"some-resource-name","ARN":"some-arn"},"notificationCreationTime":"2018-07-02T23:05:34.445Z","messageType":"ConfigurationItemChangeNotification"}'
 
     def setUp(self):
+        RULE.rule_runtime.reset_policy_document_cache()
         CONFIG_CLIENT_MOCK.reset_mock()
         IAM_CLIENT_MOCK.reset_mock()
 
@@ -177,6 +178,30 @@ class ComplianceTest(unittest.TestCase):
         resp_expected.append(build_expected_response("NON_COMPLIANT", self.user_not_whitelist['UserId'], annotation=f"IAM Policy includes more than maximum ip addresses: {RULE.DEFAULT_MAX_IP_NUMS+1}"))
         assert_successful_evaluation(self, response, resp_expected, 2)
 
+    def test_group_evaluated_once_for_its_users(self):
+        self.__mock_group_inline_policy_ip_denied()
+        IAM_CLIENT_MOCK.list_attached_group_policies = MagicMock(return_value={'AttachedPolicies': []})
+        response = RULE.lambda_handler(build_lambda_scheduled_event(), {})
+        resp_expected = []
+        resp_expected.append(build_expected_response("COMPLIANT", self.user_whitelist['UserId']))
+        resp_expected.append(build_expected_response("COMPLIANT", self.user_not_whitelist['UserId']))
+        assert_successful_evaluation(self, response, resp_expected, 2)
+        self.assertEqual(IAM_CLIENT_MOCK.list_groups_for_user.call_count, 2)
+        self.assertEqual(IAM_CLIENT_MOCK.list_group_policies.call_count, 1)
+        self.assertEqual(IAM_CLIENT_MOCK.get_group_policy.call_count, 1)
+        # The attached policies of the group are not listed once its inline policy is IP denied.
+        self.assertEqual(IAM_CLIENT_MOCK.list_attached_group_policies.call_count, 0)
+
+    def test_group_result_merged_in_user_state(self):
+        self.__mock_only_group_inline_policy_not_ip_allowed()
+        IAM_CLIENT_MOCK.list_attached_group_policies = MagicMock(return_value={'AttachedPolicies': []})
+        response = RULE.lambda_handler(build_lambda_scheduled_event(), {})
+        resp_expected = []
+        resp_expected.append(build_expected_response("NON_COMPLIANT", self.user_whitelist['UserId'], annotation=f"This user {self.user_whitelist['UserName']} is not IP restricted."))
+        resp_expected.append(build_expected_response("NON_COMPLIANT", self.user_not_whitelist['UserId'], annotation=f"This user {self.user_not_whitelist['UserName']} is not IP restricted."))
+        assert_successful_evaluation(self, response, resp_expected, 2)
+        self.assertEqual(IAM_CLIENT_MOCK.get_group_policy.call_count, 1)
+
     def __mock_only_user_inline_policy_not_ip_allowed(self):
         self.__mock_base()
         ip_allowed_policy = self.__ip_restricted_policy('Allow')
@@ -332,7 +357,7 @@ def build_lambda_configurationchange_event(invoking_event, rule_parameters=None)
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -347,7 +372,7 @@ def build_lambda_scheduled_event(rule_parameters=None):
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
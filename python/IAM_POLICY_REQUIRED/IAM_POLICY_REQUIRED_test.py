@@ -1,5 +1,7 @@
 import json
+import os
 import sys
+import time
 import unittest
 try:
     from unittest.mock import MagicMock, patch, ANY
@@ -151,6 +153,10 @@ class TestPolicyRequired(unittest.TestCase):
     invoking_event_iam_user_sample = json.dumps(build_user_configuration_item([
         'arn:aws:iam::aws:policy/AdministratorAccess'], {'group1': [{'PolicyArn':'arn:aws:iam::aws:policy/AdministratorAccess'}]}))
 
+    def setUp(self):
+        rule.reset_group_policy_cache()
+        rule.rule_runtime.reset_verdict_cache()
+
     def test_it_marks_service_roles_as_compliant(self):
         rule.ASSUME_ROLE_MODE = False
         response = rule.lambda_handler(build_lambda_configurationchange_event(
@@ -213,6 +219,56 @@ class TestPolicyRequired(unittest.TestCase):
         resp_expected = [build_expected_response('COMPLIANT', 'ABCDEFGHI12JKL4MNO5PQ', 'AWS::IAM::User', ANY)]
         assert_successful_evaluation(self, response, resp_expected)
 
+    def test_group_policies_read_once_for_its_users(self):
+        rule.ASSUME_ROLE_MODE = False
+        iam_client_mock.configure_mock(**{
+            "get_paginator.return_value": iam_client_mock,
+            "paginate.return_value": iam_client_mock,
+            "result_key_iters.return_value": [[{'PolicyArn': 'arn:aws:iam::aws:policy/AdministratorAccess'}]]
+        })
+        iam_client_mock.list_attached_group_policies.__name__ = 'list_attached_group_policies'
+        iam_client_mock.get_paginator.reset_mock()
+        for user_name in ['user-1', 'user-2']:
+            invoking_event = json.dumps(build_user_configuration_item([], {'group1': []}, user_name=user_name))
+            response = rule.lambda_handler(build_lambda_configurationchange_event(invoking_event, self.rule_parameters), {})
+            assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', ANY, 'AWS::IAM::User', ANY)])
+        iam_client_mock.get_paginator.assert_called_once_with('list_attached_group_policies')
+
+        # An expired entry is read again.
+        expires_at, policy_arns = rule.GROUP_POLICY_CACHE[('123456789012', 'group1')]
+        self.assertEqual(frozenset(['arn:aws:iam::aws:policy/AdministratorAccess']), policy_arns)
+        self.assertTrue(time.time() < expires_at <= time.time() + rule.GROUP_POLICY_CACHE_TTL_SECONDS)
+        rule.GROUP_POLICY_CACHE[('123456789012', 'group1')] = (0, policy_arns)
+        invoking_event = json.dumps(build_user_configuration_item([], {'group1': []}, user_name='user-3'))
+        rule.lambda_handler(build_lambda_configurationchange_event(invoking_event, self.rule_parameters), {})
+        self.assertEqual(2, iam_client_mock.get_paginator.call_count)
+
+    def test_group_policy_change_is_not_hidden_by_the_verdict_cache(self):
+        rule.ASSUME_ROLE_MODE = False
+        rule.cache_group_policies({'accountId': '123456789012'}, 'group1', frozenset(['arn:aws:iam::aws:policy/AdministratorAccess']))
+        invoking_event = build_user_configuration_item([], {'group1': []})
+        with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'memory'}):
+            response = rule.lambda_handler(build_lambda_configurationchange_event(json.dumps(invoking_event), self.rule_parameters), {})
+            assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', ANY, 'AWS::IAM::User', ANY)])
+            # The policy is detached from the group, then the tags of the user change.
+            rule.cache_group_policies({'accountId': '123456789012'}, 'group1', frozenset())
+            invoking_event['configurationItem']['tags'] = {'team': 'security'}
+            response = rule.lambda_handler(build_lambda_configurationchange_event(json.dumps(invoking_event), self.rule_parameters), {})
+        assert_successful_evaluation(self, response, [build_expected_response('NON_COMPLIANT', ANY, 'AWS::IAM::User', ANY)])
+
+    def test_it_requires_all_the_policies_across_groups(self):
+        rule_parameters = '{"policyArns":"arn:aws:iam::aws:policy/AdministratorAccess,arn:aws:iam::aws:policy/ReadOnlyAccess", "exceptionList": ""}'
+        rule.ASSUME_ROLE_MODE = False
+        rule.cache_group_policies({'accountId': '123456789012'}, 'group1', frozenset(['arn:aws:iam::aws:policy/ReadOnlyAccess']))
+        rule.cache_group_policies({'accountId': '123456789012'}, 'group2', frozenset())
+        invoking_event = json.dumps(build_user_configuration_item(['arn:aws:iam::aws:policy/AdministratorAccess'], {'group2': [], 'group1': []}))
+        response = rule.lambda_handler(build_lambda_configurationchange_event(invoking_event, rule_parameters), {})
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', ANY, 'AWS::IAM::User', ANY)])
+
+        invoking_event = json.dumps(build_user_configuration_item(['arn:aws:iam::aws:policy/AdministratorAccess'], {'group2': []}))
+        response = rule.lambda_handler(build_lambda_configurationchange_event(invoking_event, rule_parameters), {})
+        assert_successful_evaluation(self, response, [build_expected_response('NON_COMPLIANT', ANY, 'AWS::IAM::User', ANY)])
+
     def test_it_marks_users_without_policy_as_non_compliant(self):
         invoking_event = json.dumps(build_user_configuration_item([], {}))
         rule.ASSUME_ROLE_MODE = False
@@ -254,6 +310,54 @@ class TestPolicyRequired(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
 
+class TestScheduledPolicyRequired(unittest.TestCase):
+
+    rule_parameters = '{"policyArns":"arn:aws:iam::aws:policy/AdministratorAccess", "exceptionList": "users:[ignored-user]"}'
+    admin_policy = {'PolicyName': 'AdministratorAccess', 'PolicyArn': 'arn:aws:iam::aws:policy/AdministratorAccess'}
+    authorization_details_pages = [
+        {'UserDetailList': [
+            {'UserName': 'user-direct', 'UserId': 'AIDA1', 'Arn': 'arn:aws:iam::123456789012:user/user-direct', 'GroupList': [], 'AttachedManagedPolicies': [admin_policy]},
+            {'UserName': 'user-group', 'UserId': 'AIDA2', 'Arn': 'arn:aws:iam::123456789012:user/user-group', 'GroupList': ['admins'], 'AttachedManagedPolicies': []}],
+         'GroupDetailList': [
+             {'GroupName': 'admins', 'GroupId': 'AGPA1', 'Arn': 'arn:aws:iam::123456789012:group/admins', 'AttachedManagedPolicies': [admin_policy]},
+             {'GroupName': 'readers', 'GroupId': 'AGPA2', 'Arn': 'arn:aws:iam::123456789012:group/readers', 'AttachedManagedPolicies': []}],
+         'RoleDetailList': [
+             {'RoleName': 'role-admin', 'RoleId': 'AROA1', 'Arn': 'arn:aws:iam::123456789012:role/role-admin', 'AttachedManagedPolicies': [admin_policy]}],
+         'IsTruncated': True, 'Marker': 'page-2'},
+        {'UserDetailList': [
+            {'UserName': 'user-reader', 'UserId': 'AIDA3', 'Arn': 'arn:aws:iam::123456789012:user/user-reader', 'GroupList': ['readers'], 'AttachedManagedPolicies': []},
+            {'UserName': 'ignored-user', 'UserId': 'AIDA4', 'Arn': 'arn:aws:iam::123456789012:user/ignored-user', 'GroupList': [], 'AttachedManagedPolicies': []}],
+         'RoleDetailList': [
+             {'RoleName': 'role-none', 'RoleId': 'AROA2', 'Arn': 'arn:aws:iam::123456789012:role/role-none', 'AttachedManagedPolicies': []},
+             {'RoleName': 'AWSServiceRoleForSupport', 'RoleId': 'AROA3', 'Arn': 'arn:aws:iam::123456789012:role/aws-service-role/support.amazonaws.com/AWSServiceRoleForSupport',
+              'AttachedManagedPolicies': []}],
+         'IsTruncated': False}]
+
+    def setUp(self):
+        rule.reset_group_policy_cache()
+        rule.ASSUME_ROLE_MODE = False
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': []})
+        iam_client_mock.get_account_authorization_details = MagicMock(side_effect=self.authorization_details_pages)
+        iam_client_mock.get_paginator = MagicMock()
+
+    def test_scheduled_all_users_and_roles_from_one_snapshot(self):
+        response = rule.lambda_handler(build_lambda_scheduled_event(self.rule_parameters), {})
+        resp_expected = [
+            build_expected_response('COMPLIANT', 'AROA1', 'AWS::IAM::Role', 'All expected policies attached'),
+            build_expected_response('NON_COMPLIANT', 'AROA2', 'AWS::IAM::Role', 'IAM entity missing policies'),
+            build_expected_response('COMPLIANT', 'AROA3', 'AWS::IAM::Role', 'Ignored IAM entity'),
+            build_expected_response('COMPLIANT', 'AIDA1', 'AWS::IAM::User', 'All expected policies attached'),
+            build_expected_response('COMPLIANT', 'AIDA2', 'AWS::IAM::User', 'All expected policies attached'),
+            build_expected_response('NON_COMPLIANT', 'AIDA3', 'AWS::IAM::User', 'IAM entity missing policies'),
+            build_expected_response('COMPLIANT', 'AIDA4', 'AWS::IAM::User', 'Ignored IAM entity')]
+        assert_successful_evaluation(self, response, resp_expected, evaluations_count=7)
+        # Only the entities are read, the attached ARNs being enough.
+        self.assertEqual(['User', 'Group', 'Role'], iam_client_mock.get_account_authorization_details.call_args_list[0][1]['Filter'])
+        iam_client_mock.get_paginator.assert_not_called()
+        # The groups of the snapshot are reused by the next configuration change notifications.
+        self.assertEqual(frozenset(['arn:aws:iam::aws:policy/AdministratorAccess']), rule.get_group_policies({'accountId': '123456789012'}, 'admins'))
+        iam_client_mock.get_paginator.assert_not_called()
+
 ####################
 # Helper Functions #
 ####################
@@ -266,7 +370,7 @@ def build_lambda_configurationchange_event(invoking_event, rule_parameters=None)
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -281,7 +385,7 @@ def build_lambda_scheduled_event(rule_parameters=None):
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -4,6 +4,8 @@
 # Created with the Rule Development Kit: https://github.com/awslabs/aws-config-rdk
 # Can be used stand-alone or with the Rule Compliance Engine: https://github.com/awslabs/aws-config-engine-for-compliance-as-code
 #
+import json
+import os
 import sys
 import unittest
 try:
@@ -56,6 +58,10 @@ class ComplianceTest(unittest.TestCase):
     get_managed_policy_doc_allow = {"PolicyVersion": {"Document": {"Statement": [{"Effect": "Allow", "Action": "*"}]}}}
     get_managed_policy_doc_deny = {"PolicyVersion": {"Document": {"Statement": [{"Effect": "Deny", "Action": "*"}]}}}
 
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+        rule.rule_runtime.reset_verdict_cache()
+
     def test_non_compliant_inline(self):
         iam_client_mock.list_role_policies = MagicMock(return_value=self.list_role_policy_names)
         iam_client_mock.get_role_policy = MagicMock(return_value=self.get_role_policy_doc)
@@ -76,6 +82,20 @@ class ComplianceTest(unittest.TestCase):
         resp_expected.append(build_expected_response('NON_COMPLIANT', 'AIDAICVB3PKAQMPEGDW2C', annotation='A managed policy with name "policyname1" attached to the role "somerolename" has full star allow permissions.'))
         assert_successful_evaluation(self, response, resp_expected)
 
+    def test_tag_change_reuses_the_verdict(self):
+        iam_client_mock.list_role_policies = MagicMock(return_value=self.list_role_policy_names)
+        iam_client_mock.get_role_policy = MagicMock(return_value=self.get_role_policy_doc)
+        tagged_invoking_event = json.loads(self.invoking_event)
+        tagged_invoking_event['configurationItem']['tags'] = {'team': 'security'}
+        with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'memory'}):
+            rule.lambda_handler(build_lambda_configurationchange_event(invoking_event=self.invoking_event), {})
+            response = rule.lambda_handler(build_lambda_configurationchange_event(invoking_event=json.dumps(tagged_invoking_event)), {})
+        resp_expected = []
+        resp_expected.append(build_expected_response('NON_COMPLIANT', 'AIDAICVB3PKAQMPEGDW2C', annotation='An inline policy "policyname1" attached to the role "somerolename" has full star allow permissions.'))
+        assert_successful_evaluation(self, response, resp_expected)
+        self.assertEqual(1, iam_client_mock.list_role_policies.call_count)
+        self.assertEqual(1, iam_client_mock.get_role_policy.call_count)
+
     def test_compliant_managed(self):
         iam_client_mock.list_role_policies = MagicMock(return_value=self.no_list_role_policy_names)
         iam_client_mock.list_attached_role_policies = MagicMock(return_value=self.list_attached_policy_arn)
@@ -87,6 +107,52 @@ class ComplianceTest(unittest.TestCase):
         resp_expected.append(build_expected_response('COMPLIANT', 'AIDAICVB3PKAQMPEGDW2C'))
         assert_successful_evaluation(self, response, resp_expected)
 
+class ScheduledComplianceTest(unittest.TestCase):
+
+    full_star_document = {'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}
+    read_only_document = {'Statement': {'Effect': 'Allow', 'Action': ['s3:Get*'], 'Resource': '*'}}
+    authorization_details_pages = [
+        {'RoleDetailList': [
+            {'RoleName': 'role-inline', 'RoleId': 'AROA1', 'RolePolicyList': [{'PolicyName': 'inline-star', 'PolicyDocument': full_star_document}],
+             'AttachedManagedPolicies': []},
+            {'RoleName': 'role-admin', 'RoleId': 'AROA2', 'RolePolicyList': [],
+             'AttachedManagedPolicies': [{'PolicyName': 'ReadOnly', 'PolicyArn': 'arn:read-only'}, {'PolicyName': 'Admin', 'PolicyArn': 'arn:admin'}]}],
+         'Policies': [
+             {'Arn': 'arn:admin', 'DefaultVersionId': 'v2', 'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': False, 'Document': read_only_document},
+                                                                                {'VersionId': 'v2', 'IsDefaultVersion': True, 'Document': full_star_document}]},
+             {'Arn': 'arn:read-only', 'DefaultVersionId': 'v1', 'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': True, 'Document': read_only_document}]}],
+         'IsTruncated': True, 'Marker': 'page-2'},
+        {'RoleDetailList': [
+            {'RoleName': 'role-other-admin', 'RoleId': 'AROA3', 'RolePolicyList': [], 'AttachedManagedPolicies': [{'PolicyName': 'Admin', 'PolicyArn': 'arn:admin'}]},
+            {'RoleName': 'role-read-only', 'RoleId': 'AROA4', 'RolePolicyList': [{'PolicyName': 'inline-read-only', 'PolicyDocument': read_only_document}],
+             'AttachedManagedPolicies': [{'PolicyName': 'ReadOnly', 'PolicyArn': 'arn:read-only'}, {'PolicyName': 'Attached-since', 'PolicyArn': 'arn:new'}]},
+            {'RoleName': 'role-no-policy', 'RoleId': 'AROA5', 'RolePolicyList': [], 'AttachedManagedPolicies': []}],
+         'Policies': [], 'IsTruncated': False}]
+
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': []})
+        iam_client_mock.get_account_authorization_details = MagicMock(side_effect=self.authorization_details_pages)
+        iam_client_mock.list_role_policies = MagicMock()
+        iam_client_mock.list_attached_role_policies = MagicMock()
+        iam_client_mock.get_policy = MagicMock(return_value={'Policy': {'DefaultVersionId': 'v1'}})
+        iam_client_mock.get_policy_version = MagicMock(return_value={'PolicyVersion': {'Document': self.read_only_document}})
+
+    def test_scheduled_all_roles_from_one_snapshot(self):
+        response = rule.lambda_handler(build_lambda_scheduled_event(), {})
+        resp_expected = [
+            build_expected_response('NON_COMPLIANT', 'AROA1', annotation='An inline policy "inline-star" attached to the role "role-inline" has full star allow permissions.'),
+            build_expected_response('NON_COMPLIANT', 'AROA2', annotation='A managed policy with name "Admin" attached to the role "role-admin" has full star allow permissions.'),
+            build_expected_response('NON_COMPLIANT', 'AROA3', annotation='A managed policy with name "Admin" attached to the role "role-other-admin" has full star allow permissions.'),
+            build_expected_response('COMPLIANT', 'AROA4'),
+            build_expected_response('COMPLIANT', 'AROA5')]
+        assert_successful_evaluation(self, response, resp_expected, evaluations_count=5)
+        self.assertEqual('page-2', iam_client_mock.get_account_authorization_details.call_args_list[1][1]['Marker'])
+        iam_client_mock.list_role_policies.assert_not_called()
+        iam_client_mock.list_attached_role_policies.assert_not_called()
+        # Only the policy missing from the snapshot is read with the per-policy APIs.
+        iam_client_mock.get_policy.assert_called_once_with(PolicyArn='arn:new')
+
 ####################
 # Helper Functions #
 ####################
@@ -99,7 +165,7 @@ def build_lambda_configurationchange_event(invoking_event, rule_parameters=None)
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -114,7 +180,7 @@ def build_lambda_scheduled_event(rule_parameters=None):
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -56,6 +56,9 @@ class ComplianceTest(unittest.TestCase):
     get_managed_policy_doc_allow = {"PolicyVersion": {"Document": {"Statement": [{"Effect": "Allow", "Action": "*"}]}}}
     get_managed_policy_doc_deny = {"PolicyVersion": {"Document": {"Statement": [{"Effect": "Deny", "Action": "*"}]}}}
 
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+
     def test_non_compliant_inline(self):
         iam_client_mock.list_user_policies = MagicMock(return_value=self.list_user_policy_names)
         iam_client_mock.get_user_policy = MagicMock(return_value=self.get_user_policy_doc)
@@ -87,6 +90,52 @@ class ComplianceTest(unittest.TestCase):
         resp_expected.append(build_expected_response('COMPLIANT', 'AIDAICVB3PKAQMPEGDW2C'))
         assert_successful_evaluation(self, response, resp_expected)
 
+class ScheduledComplianceTest(unittest.TestCase):
+
+    full_star_document = {'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}
+    read_only_document = {'Statement': {'Effect': 'Allow', 'Action': ['s3:Get*'], 'Resource': '*'}}
+    authorization_details_pages = [
+        {'UserDetailList': [
+            {'UserName': 'user-inline', 'UserId': 'AIDA1', 'UserPolicyList': [{'PolicyName': 'inline-star', 'PolicyDocument': full_star_document}],
+             'AttachedManagedPolicies': []},
+            {'UserName': 'user-admin', 'UserId': 'AIDA2', 'UserPolicyList': [],
+             'AttachedManagedPolicies': [{'PolicyName': 'ReadOnly', 'PolicyArn': 'arn:read-only'}, {'PolicyName': 'Admin', 'PolicyArn': 'arn:admin'}]}],
+         'Policies': [
+             {'Arn': 'arn:admin', 'DefaultVersionId': 'v2', 'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': False, 'Document': read_only_document},
+                                                                                {'VersionId': 'v2', 'IsDefaultVersion': True, 'Document': full_star_document}]},
+             {'Arn': 'arn:read-only', 'DefaultVersionId': 'v1', 'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': True, 'Document': read_only_document}]}],
+         'IsTruncated': True, 'Marker': 'page-2'},
+        {'UserDetailList': [
+            {'UserName': 'user-other-admin', 'UserId': 'AIDA3', 'UserPolicyList': [], 'AttachedManagedPolicies': [{'PolicyName': 'Admin', 'PolicyArn': 'arn:admin'}]},
+            {'UserName': 'user-read-only', 'UserId': 'AIDA4', 'UserPolicyList': [{'PolicyName': 'inline-read-only', 'PolicyDocument': read_only_document}],
+             'AttachedManagedPolicies': [{'PolicyName': 'ReadOnly', 'PolicyArn': 'arn:read-only'}, {'PolicyName': 'Attached-since', 'PolicyArn': 'arn:new'}]},
+            {'UserName': 'user-no-policy', 'UserId': 'AIDA5', 'UserPolicyList': [], 'AttachedManagedPolicies': []}],
+         'Policies': [], 'IsTruncated': False}]
+
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': []})
+        iam_client_mock.get_account_authorization_details = MagicMock(side_effect=self.authorization_details_pages)
+        iam_client_mock.list_user_policies = MagicMock()
+        iam_client_mock.list_attached_user_policies = MagicMock()
+        iam_client_mock.get_policy = MagicMock(return_value={'Policy': {'DefaultVersionId': 'v1'}})
+        iam_client_mock.get_policy_version = MagicMock(return_value={'PolicyVersion': {'Document': self.read_only_document}})
+
+    def test_scheduled_all_users_from_one_snapshot(self):
+        response = rule.lambda_handler(build_lambda_scheduled_event(), {})
+        resp_expected = [
+            build_expected_response('NON_COMPLIANT', 'AIDA1', annotation='The inline policy "inline-star" attached to the user "user-inline" has full star allow permissions.'),
+            build_expected_response('NON_COMPLIANT', 'AIDA2', annotation='The managed policy "Admin" attached to the user "user-admin" has full star allow permissions.'),
+            build_expected_response('NON_COMPLIANT', 'AIDA3', annotation='The managed policy "Admin" attached to the user "user-other-admin" has full star allow permissions.'),
+            build_expected_response('COMPLIANT', 'AIDA4'),
+            build_expected_response('COMPLIANT', 'AIDA5')]
+        assert_successful_evaluation(self, response, resp_expected, evaluations_count=5)
+        self.assertEqual('page-2', iam_client_mock.get_account_authorization_details.call_args_list[1][1]['Marker'])
+        iam_client_mock.list_user_policies.assert_not_called()
+        iam_client_mock.list_attached_user_policies.assert_not_called()
+        # Only the policy missing from the snapshot is read with the per-policy APIs.
+        iam_client_mock.get_policy.assert_called_once_with(PolicyArn='arn:new')
+
 ####################
 # Helper Functions #
 ####################
@@ -99,7 +148,7 @@ def build_lambda_configurationchange_event(invoking_event, rule_parameters=None)
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
@@ -114,7 +163,7 @@ def build_lambda_scheduled_event(rule_parameters=None):
         'invokingEvent': invoking_event,
         'accountId': '123456789012',
         'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
-        'resultToken':'token'
+        'resultToken':'TESTMODE'
     }
     if rule_parameters:
         event_to_return['ruleParameters'] = rule_parameters
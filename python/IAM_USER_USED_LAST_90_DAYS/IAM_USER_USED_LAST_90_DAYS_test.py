@@ -292,6 +292,46 @@ class TestScheduledNotification(unittest.TestCase):
         print(resp_expected)
         assert_successful_evaluation(self, response, resp_expected, ressourcetype='AWS::::Account') 
 
+class TestScheduledCredentialReport(unittest.TestCase):
+
+    users_list = TestScheduledNotification.users_list
+
+    def build_report(self, rows):
+        header = 'user,arn,user_creation_time,password_last_used,access_key_1_active,access_key_1_last_used_date,access_key_2_active,access_key_2_last_used_date'
+        return {'Content': '\n'.join([header] + rows).encode('utf-8'), 'GeneratedTime': constructDateTime(0)}
+
+    def test_scheduled_keys_used_recently_in_the_report(self):
+        report = self.build_report([
+            'some-user-1,arn,2015-01-01T00:00:00+00:00,N/A,true,{},false,N/A'.format(constructDateTime(10).isoformat()),
+            'some-user-2,arn,2015-01-01T00:00:00+00:00,N/A,false,{},true,N/A'.format(constructDateTime(100).isoformat())])
+        # some-user-3 is created after the report, without cool down.
+        users_list = {'Users': self.users_list['Users'][:2] + [dict(self.users_list['Users'][2], CreateDate=datetime.datetime.now(tz=tzutc()) - timedelta(hours=1))]}
+        iam_client_mock.list_users = MagicMock(return_value=users_list)
+        iam_client_mock.list_access_keys = MagicMock(return_value={'AccessKeyMetadata':[{'AccessKeyId':'access_key_1'}]})
+        iam_client_mock.get_access_key_last_used = MagicMock(return_value=get_user_access_key_day(93))
+        with patch.object(iam_client_mock, 'generate_credential_report', MagicMock(return_value={'State': 'COMPLETE'})), \
+             patch.object(iam_client_mock, 'get_credential_report', MagicMock(return_value=report)):
+            response = rule.lambda_handler(buildLambdaEvent(ruleParameters={'NewUserCooldownInDays': '0'}, scheduled=True), {})
+        resp_expected = [
+            build_expected_response('COMPLIANT', 'AIDAABCD12345ABCDE123'),
+            build_expected_response('NON_COMPLIANT', 'AIDAJYPPIFB65RV8YYLDU'),
+            build_expected_response('NON_COMPLIANT', 'AIDA12345ABCDE12345AB')]
+        assert_successful_evaluation(self, response, resp_expected, evaluations_count=3)
+        # some-user-1 used a key recently in the report, the others are checked per user.
+        self.assertEqual(['some-user-2', 'some-user-3'], [call[1]['UserName'] for call in iam_client_mock.list_access_keys.call_args_list])
+
+    def test_scheduled_keys_used_since_the_report(self):
+        report = self.build_report([
+            'some-user-1,arn,2015-01-01T00:00:00+00:00,N/A,true,{},false,N/A'.format(constructDateTime(100).isoformat())])
+        iam_client_mock.list_users = MagicMock(return_value={'Users': self.users_list['Users'][:1]})
+        iam_client_mock.list_access_keys = MagicMock(return_value={'AccessKeyMetadata':[{'AccessKeyId':'access_key_1'}]})
+        iam_client_mock.get_access_key_last_used = MagicMock(return_value=get_user_access_key_day(0))
+        with patch.object(iam_client_mock, 'generate_credential_report', MagicMock(return_value={'State': 'COMPLETE'})), \
+             patch.object(iam_client_mock, 'get_credential_report', MagicMock(return_value=report)):
+            response = rule.lambda_handler(buildLambdaEvent(scheduled=True), {})
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', 'AIDAABCD12345ABCDE123')])
+        iam_client_mock.get_access_key_last_used.assert_called_once_with(AccessKeyId='access_key_1')
+
 def assert_successful_evaluation(testClass, response, resp_expected, ressourcetype='AWS::IAM::User', evaluations_count=1):
     testClass.assertEquals(evaluations_count, len(response))
     for r, value in enumerate(response):
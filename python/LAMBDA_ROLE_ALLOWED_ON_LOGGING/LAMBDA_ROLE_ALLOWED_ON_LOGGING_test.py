@@ -171,6 +171,9 @@ class TestScenario3NoPolicyOnRole(unittest.TestCase):
   
 class TestScenario4ActionStar(unittest.TestCase):
 
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+
     def test_COMPLIANT_action_star_allow_string_inline(self):
         get_pl = gen_policy_api()
         list_attached_role_pl = {"AttachedPolicies": []}
@@ -272,9 +275,12 @@ class TestScenario4ActionStar(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
 class TestScenario5LogStar(unittest.TestCase):
-    
+
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+
     def test_COMPLIANT_action_logstar_allow_string_inline(self):
-        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="log:*")))
+        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="logs:*")))
         list_attached_role_pl = {"AttachedPolicies": []}
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
@@ -285,7 +291,7 @@ class TestScenario5LogStar(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_COMPLIANT_action_logstar_allow_list_inline(self):
-        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action=["some-action","log:*"])))
+        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action=["some-action","logs:*"])))
         list_attached_role_pl = {"AttachedPolicies": []}
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
@@ -296,7 +302,7 @@ class TestScenario5LogStar(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
         
     def test_NON_COMPLIANT_action_logstar_deny_inline(self):
-        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="log:*",effect="Deny")))
+        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="logs:*",effect="Deny")))
         list_attached_role_pl = {"AttachedPolicies": []}
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
@@ -307,7 +313,7 @@ class TestScenario5LogStar(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_NON_COMPLIANT_action_logstar_other_resource_string_inline(self):
-        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="log:*", resource="something_else")))
+        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="logs:*", resource="something_else")))
         list_attached_role_pl = {"AttachedPolicies": []}
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
@@ -318,7 +324,7 @@ class TestScenario5LogStar(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_COMPLIANT_action_logstar_resource_list_inline(self):
-        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="log:*", resource=["something_else","*"])))
+        get_pl = gen_policy_api(statement_list=gen_statement_list(gen_statement(action="logs:*", resource=["something_else","*"])))
         list_attached_role_pl = {"AttachedPolicies": []}
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
@@ -331,7 +337,7 @@ class TestScenario5LogStar(unittest.TestCase):
     def test_COMPLIANT_action_logstar_allow_managed(self):
         list_attached_role_pl = gen_policy_api(type="list_attached")
         get_pl = gen_policy_api(type="get_policy")
-        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="log:*")))
+        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="logs:*")))
 
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.get_policy = MagicMock(return_value=get_pl)
@@ -346,7 +352,7 @@ class TestScenario5LogStar(unittest.TestCase):
     def test_NON_COMPLIANT_action_logstar_deny_managed(self):
         list_attached_role_pl = gen_policy_api(type="list_attached")
         get_pl = gen_policy_api(type="get_policy")
-        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="log:*",effect="Deny")))
+        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="logs:*",effect="Deny")))
 
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.get_policy = MagicMock(return_value=get_pl)
@@ -361,7 +367,7 @@ class TestScenario5LogStar(unittest.TestCase):
     def test_COMPLIANT_action_logstar_resource_ok_managed(self):
         list_attached_role_pl = gen_policy_api(type="list_attached")
         get_pl = gen_policy_api(type="get_policy")
-        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="log:*",resource="arn:aws:logs:*")))
+        get_pl_version = gen_policy_api(type="get_policy_version",statement_list=gen_statement_list(gen_statement(action="logs:*",resource="arn:aws:logs:*")))
 
         IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value=list_attached_role_pl)
         IAM_CLIENT_MOCK.get_policy = MagicMock(return_value=get_pl)
@@ -384,6 +390,9 @@ class TestScenario6LogExactActions(unittest.TestCase):
     statement_list_all_in_three_with_deny = gen_statement_list(CreateLogGroup, CreateLogStream, PutLogEventsDeny)
     statement_list_all_in_three_with_bad_resource = gen_statement_list(CreateLogGroup, CreateLogStream, PutLogEventsBadResource)
 
+    def setUp(self):
+        rule.rule_runtime.reset_policy_document_cache()
+
     def test_COMPLIANT_action_logexactaction_inline(self):
         for state in [self.statement_list_all_in_one, self.statement_list_all_in_three]:
             get_pl = gen_policy_api(statement_list=state)
@@ -439,3 +448,16 @@ class TestScenario6LogExactActions(unittest.TestCase):
             response = rule.lambda_handler(lambdaEvent, {})
             resp_expected = "NON_COMPLIANT"
             assert_successful_evaluation(self, response, resp_expected)
+
+    def test_log_group_of_the_function(self):
+        log_group = "arn:aws:logs:us-east-1:823362693882:log-group:/aws/lambda/{}:*"
+        for resource, resp_expected in [(log_group.format("test-function"), "COMPLIANT"), (log_group.format("other-function"), "NON_COMPLIANT")]:
+            rule.rule_runtime.reset_policy_document_cache()
+            # The policy of the execution role created by the console.
+            state = gen_statement_list(gen_statement(action="logs:CreateLogGroup", resource="arn:aws:logs:us-east-1:823362693882:*"),
+                                       gen_statement(action=["logs:CreateLogStream", "logs:PutLogEvents"], resource=[resource]))
+            IAM_CLIENT_MOCK.list_attached_role_policies = MagicMock(return_value={"AttachedPolicies": []})
+            IAM_CLIENT_MOCK.list_role_policies = MagicMock(return_value={"PolicyNames": ["some-inline-name-policy"]})
+            IAM_CLIENT_MOCK.get_role_policy = MagicMock(return_value=gen_policy_api(statement_list=state))
+            response = rule.lambda_handler(build_lambda_event(), {})
+            assert_successful_evaluation(self, response, resp_expected)
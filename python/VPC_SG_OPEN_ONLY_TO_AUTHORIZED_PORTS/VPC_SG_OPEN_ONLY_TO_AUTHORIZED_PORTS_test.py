@@ -9,6 +9,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
+import json
 import sys
 import unittest
 from unittest.mock import MagicMock
@@ -115,10 +116,48 @@ class ComplianceTest(unittest.TestCase):
         resp_expected.append(build_expected_response('COMPLIANT', resource_id))
         assert_successful_evaluation(self, response, resp_expected)
 
+    def test_tcp_open_across_adjacent_authorized_ranges(self):
+        invoking_event = json.dumps(build_configuration_item([{"fromPort": 15000, "ipProtocol": "tcp", "toPort": 25000, "ipv4Ranges": [{"cidrIp": "0.0.0.0/0"}]}]))
+        rule_parameters = '{"authorizedTcpPorts": "443, 20001-30000,10000-20000"}'
+        response = RULE.lambda_handler(build_lambda_configurationchange_event(invoking_event, rule_parameters), context={})
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', 'sg-01')])
+
+        invoking_event = json.dumps(build_configuration_item([{"fromPort": 15000, "ipProtocol": "tcp", "toPort": 25000, "ipv4Ranges": [{"cidrIp": "0.0.0.0/0"}]}]))
+        rule_parameters = '{"authorizedTcpPorts": "443,20002-30000,10000-20000"}'
+        response = RULE.lambda_handler(build_lambda_configurationchange_event(invoking_event, rule_parameters), context={})
+        assert_successful_evaluation(self, response, [build_expected_response(
+            'NON_COMPLIANT', 'sg-01', annotation='One or more TCP ports (15000-25000) are not in range of the authorizedTcpPorts parameter (443,20002-30000,10000-20000).')])
+
+class EvaluateParametersTest(unittest.TestCase):
+
+    def test_parsed_ports_are_reused(self):
+        authorized_ports = RULE.evaluate_parameters({'authorizedTcpPorts': '443,1020-1025'})['authorizedTcpPorts']
+        self.assertEqual('443,1020-1025', authorized_ports.description)
+        self.assertIs(authorized_ports, RULE.evaluate_parameters({'authorizedTcpPorts': '443,1020-1025'})['authorizedTcpPorts'])
+
+    def test_invalid_ports(self):
+        for ports in ['80-90-100', 'http', '90-80', '70000']:
+            with self.assertRaises(ValueError):
+                RULE.evaluate_port(ports)
+            self.assertNotIn(ports, RULE.AUTHORIZED_PORTS_CACHE)
+
 ####################
 # Helper Functions #
 ####################
 
+def build_configuration_item(ip_permissions):
+    return {
+        "configurationItem": {
+            "configuration": {"groupId": "sg-01", "ipPermissions": ip_permissions},
+            "configurationItemCaptureTime": "2018-09-07T05:26:45.866Z",
+            "awsAccountId": "970012433126",
+            "configurationItemStatus": "OK",
+            "resourceType": "AWS::EC2::SecurityGroup",
+            "resourceId": "sg-01",
+            "ARN": "arn:aws:ec2:ap-south-1:970012433126:security-group/sg-01"},
+        "notificationCreationTime": "2018-09-07T09:52:39.472Z",
+        "messageType": "ConfigurationItemChangeNotification"}
+
 def build_lambda_configurationchange_event(invoking_event, rule_parameters=None):
     event_to_return = {
         'configRuleName':'myrule',
@@ -0,0 +1,98 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of VPC_SG_OPEN_ONLY_TO_AUTHORIZED_PORTS on security groups with hundreds of rules open to 0.0.0.0/0,
+against thousands of authorized port ranges, with the former scan of the authorized ranges for every rule or the
+merged intervals of rule_runtime.PortIntervals.
+
+The authorized ranges are disjoint and not adjacent, so that both give the same compliance; most of the rules
+are authorized, i.e. every rule of a compliant group is checked. Each invocation parses the parameters again in
+the former evaluation, the intervals are built once per warm container.
+
+Usage:
+  python authorized_ports_benchmark.py [AUTHORIZED_RANGES] [SECURITY_GROUPS] [RULES_PER_GROUP]
+'''
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+DEFAULT_AUTHORIZED_RANGE_COUNT = 5000
+DEFAULT_SECURITY_GROUP_COUNT = 200
+DEFAULT_RULES_PER_GROUP = 300
+# One group in NON_COMPLIANT_GROUP_RATE also opens a port outside of the authorized ranges.
+NON_COMPLIANT_GROUP_RATE = 10
+PORT_STEP = 13
+
+def build_authorized_ports(range_count):
+    # Ranges of 1 to 5 ports every PORT_STEP ports, i.e. a gap of at least 8 ports between two ranges.
+    ranges = []
+    for index in range(range_count):
+        begin = (index * PORT_STEP) % (65536 - PORT_STEP)
+        width = index % 5
+        ranges.append(str(begin) if not width else '{}-{}'.format(begin, begin + width))
+    return ','.join(ranges)
+
+def build_configuration_items(group_count, rules_per_group, range_count):
+    generator = random.Random(42)
+    configuration_items = []
+    for group_index in range(group_count):
+        ip_permissions = []
+        for _ in range(rules_per_group):
+            begin = generator.randrange(range_count) * PORT_STEP % (65536 - PORT_STEP)
+            ip_permissions.append({'ipProtocol': 'tcp', 'fromPort': begin, 'toPort': begin, 'ipv4Ranges': [{'cidrIp': '0.0.0.0/0'}]})
+        if group_index % NON_COMPLIANT_GROUP_RATE == 0:
+            # In the gap after a range, at the end of the group so that all its rules are checked first.
+            ip_permissions.append({'ipProtocol': 'tcp', 'fromPort': PORT_STEP - 1, 'toPort': PORT_STEP - 1, 'ipv4Ranges': [{'cidrIp': '0.0.0.0/0'}]})
+        configuration_items.append({'resourceType': 'AWS::EC2::SecurityGroup', 'resourceId': 'sg-{:08d}'.format(group_index),
+                                    'configuration': {'ipPermissions': ip_permissions}})
+    return configuration_items
+
+def evaluate_scan(rule, configuration_items, parameters):
+    # The former evaluation: the parameter is parsed for every invocation and each rule scans the authorized ranges.
+    compliance = {}
+    for configuration_item in configuration_items:
+        port_ranges = rule.parse_port_ranges(parameters['authorizedTcpPorts'])
+        compliance[configuration_item['resourceId']] = 'COMPLIANT'
+        for permission in configuration_item['configuration']['ipPermissions']:
+            begin, end = permission['fromPort'], permission['toPort']
+            if not any(port_range.begin <= begin <= port_range.end and port_range.begin <= end <= port_range.end for port_range in port_ranges):
+                compliance[configuration_item['resourceId']] = 'NON_COMPLIANT'
+                break
+    return compliance
+
+def evaluate_intervals(rule, configuration_items, parameters):
+    rule.build_evaluation_from_config_item = lambda configuration_item, compliance_type, annotation=None: compliance_type
+    compliance = {}
+    for configuration_item in configuration_items:
+        valid_rule_parameters = rule.evaluate_parameters(parameters)
+        compliance[configuration_item['resourceId']] = rule.evaluate_compliance({}, configuration_item, valid_rule_parameters)
+    return compliance
+
+def main(argv):
+    range_count = int(argv[0]) if argv else DEFAULT_AUTHORIZED_RANGE_COUNT
+    group_count = int(argv[1]) if len(argv) > 1 else DEFAULT_SECURITY_GROUP_COUNT
+    rules_per_group = int(argv[2]) if len(argv) > 2 else DEFAULT_RULES_PER_GROUP
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'VPC_SG_OPEN_ONLY_TO_AUTHORIZED_PORTS'))
+    sys.path.insert(0, root)
+    import VPC_SG_OPEN_ONLY_TO_AUTHORIZED_PORTS as rule
+
+    parameters = {'authorizedTcpPorts': build_authorized_ports(range_count), 'authorizedUdpPorts': '53'}
+    configuration_items = build_configuration_items(group_count, rules_per_group, range_count)
+    print('{} authorized TCP ranges, {} security groups of {} rules open to 0.0.0.0/0'.format(range_count, group_count, rules_per_group))
+    print('{:>12} {:>10} {:>14} {:>14}'.format('', 'seconds', 'ms per group', 'NON_COMPLIANT'))
+    results = []
+    for name, evaluate in [('scan', evaluate_scan), ('intervals', evaluate_intervals)]:
+        rule.AUTHORIZED_PORTS_CACHE.clear()
+        start = time.perf_counter()
+        compliance = evaluate(rule, configuration_items, parameters)
+        elapsed = time.perf_counter() - start
+        print('{:>12} {:>10.3f} {:>14.3f} {:>14}'.format(name, elapsed, 1000.0 * elapsed / group_count, Counter(compliance.values())['NON_COMPLIANT']))
+        results.append(compliance)
+    print('same compliance: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Microbenchmark of build_evaluation() for a periodic rule emitting many evaluations.
+
+It compares the per-evaluation cost of parsing the invokingEvent on every call (the former
+build_evaluation() body) with the EvaluationFactory bound to the invocation, for a small
+ScheduledNotification and for an invokingEvent carrying a large configuration item.
+
+Usage:
+  python build_evaluation_benchmark.py [RULE_NAME] [COUNT]
+'''
+import json
+import os
+import sys
+import time
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+DEFAULT_RULE = 'IAM_ACCESS_KEY_ROTATED'
+DEFAULT_COUNT = 10000
+
+class Boto3Mock():
+    def client(self, client_name, *args, **kwargs):
+        return MagicMock()
+
+def load_rule(rule_name):
+    sys.modules['boto3'] = Boto3Mock()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, rule_name))
+    return __import__(rule_name)
+
+def build_events():
+    scheduled = {'invokingEvent': json.dumps({
+        'awsAccountId': '123456789012',
+        'notificationCreationTime': '2019-01-01T00:00:00.000Z',
+        'messageType': 'ScheduledNotification',
+        'recordVersion': '1.0'})}
+    tags = {'tag-{}'.format(i): 'value-{}'.format(i) for i in range(500)}
+    large = {'invokingEvent': json.dumps({
+        'configurationItem': {'configuration': {'tags': tags}, 'relationships': [{'resourceId': 'r-{}'.format(i)} for i in range(500)]},
+        'notificationCreationTime': '2019-01-01T00:00:00.000Z',
+        'messageType': 'ConfigurationItemChangeNotification'})}
+    return [('scheduled', scheduled), ('large event', large)]
+
+def legacy_build_evaluation(resource_id, compliance_type, event, resource_type, annotation=None):
+    eval_cc = {}
+    if annotation:
+        eval_cc['Annotation'] = annotation
+    eval_cc['ComplianceResourceType'] = resource_type
+    eval_cc['ComplianceResourceId'] = resource_id
+    eval_cc['ComplianceType'] = compliance_type
+    eval_cc['OrderingTimestamp'] = str(json.loads(event['invokingEvent'])['notificationCreationTime'])
+    return eval_cc
+
+def time_per_evaluation(build, event, resource_type, count):
+    start = time.perf_counter()
+    for i in range(count):
+        build('resource-{}'.format(i), 'COMPLIANT', event, resource_type)
+    return (time.perf_counter() - start) * 1000000 / count
+
+def main(argv):
+    rule_name = argv[0] if argv and not argv[0].isdigit() else DEFAULT_RULE
+    count = ([int(arg) for arg in argv if arg.isdigit()] or [DEFAULT_COUNT])[0]
+    rule = load_rule(rule_name)
+    print('{} evaluations'.format(count))
+    print('{:>12} {:>22} {:>22}'.format('event', 'us/eval json.loads', 'us/eval factory'))
+    for name, event in build_events():
+        legacy = time_per_evaluation(legacy_build_evaluation, event, rule.DEFAULT_RESOURCE_TYPE, count)
+        factory = time_per_evaluation(rule.build_evaluation, event, rule.DEFAULT_RESOURCE_TYPE, count)
+        print('{:>12} {:>22.2f} {:>22.2f}'.format(name, legacy, factory))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
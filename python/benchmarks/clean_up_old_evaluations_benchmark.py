@@ -0,0 +1,84 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of clean_up_old_evaluations() on a large periodic rule.
+
+The rule module is loaded with a stubbed boto3 (the same way the *_test.py files do it), and the
+Config client returns the previous evaluation results in pages of 100. Half of the old resources
+are still reported by the latest run, the other half must be cleaned up as NOT_APPLICABLE.
+
+Usage:
+  python clean_up_old_evaluations_benchmark.py [RULE_NAME] [SIZE ...]
+'''
+import json
+import os
+import sys
+import time
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+DEFAULT_RULE = 'IAM_ACCESS_KEY_ROTATED'
+DEFAULT_SIZES = [1000, 10000, 100000]
+PAGE_SIZE = 100
+
+CONFIG_CLIENT_MOCK = MagicMock()
+
+class Boto3Mock():
+    def client(self, client_name, *args, **kwargs):
+        return CONFIG_CLIENT_MOCK
+
+def load_rule(rule_name):
+    sys.modules['boto3'] = Boto3Mock()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, rule_name))
+    rule = __import__(rule_name)
+    rule.RUNTIME.config_client = CONFIG_CLIENT_MOCK
+    return rule
+
+def build_old_evaluation_pages(rule, size):
+    pages = []
+    for start in range(0, size, PAGE_SIZE):
+        page = {'EvaluationResults': []}
+        for i in range(start, min(start + PAGE_SIZE, size)):
+            page['EvaluationResults'].append({'EvaluationResultIdentifier': {'EvaluationResultQualifier': {
+                'ConfigRuleName': 'benchmark',
+                'ResourceType': rule.DEFAULT_RESOURCE_TYPE,
+                'ResourceId': 'resource-{}'.format(i)}}})
+        if start + PAGE_SIZE < size:
+            page['NextToken'] = str(start + PAGE_SIZE)
+        pages.append(page)
+    return pages
+
+def build_latest_evaluations(rule, size, event):
+    latest_evaluations = []
+    for i in range(0, size, 2):
+        latest_evaluations.append(rule.build_evaluation('resource-{}'.format(i), 'COMPLIANT', event))
+    return latest_evaluations
+
+def run(rule, size):
+    event = {
+        'configRuleName': 'benchmark',
+        'invokingEvent': json.dumps({'messageType': 'ScheduledNotification', 'notificationCreationTime': '2019-01-01T00:00:00.000Z'})}
+    latest_evaluations = build_latest_evaluations(rule, size, event)
+    CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule = MagicMock(side_effect=build_old_evaluation_pages(rule, size))
+    start = time.perf_counter()
+    evaluations = rule.RUNTIME.clean_up_old_evaluations(latest_evaluations, event)
+    elapsed = time.perf_counter() - start
+    stale_count = len(evaluations) - len(latest_evaluations)
+    if stale_count != size - len(latest_evaluations):
+        raise Exception('Unexpected number of NOT_APPLICABLE evaluations: {}'.format(stale_count))
+    return elapsed
+
+def main(argv):
+    rule_name = argv[0] if argv and not argv[0].isdigit() else DEFAULT_RULE
+    sizes = [int(arg) for arg in argv if arg.isdigit()] or DEFAULT_SIZES
+    rule = load_rule(rule_name)
+    print('{:>10} {:>12} {:>18}'.format('old evals', 'seconds', 'us per old eval'))
+    for size in sizes:
+        elapsed = run(rule, size)
+        print('{:>10} {:>12.4f} {:>18.2f}'.format(size, elapsed, elapsed * 1000000 / size))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of get_client() in ASSUME_ROLE_MODE on cold and warm Lambda invocations.
+
+A local stub STS endpoint answers AssumeRole after a configurable delay (simulating the round trip to
+STS), and real boto3 clients are pointed at it through AWS_ENDPOINT_URL_STS. Each invocation builds
+the config and iam clients, as most rules do. A cold invocation starts from an empty cache, a warm
+invocation reuses the clients and the credentials cached by the previous one (the cache counters
+restart on every cold start).
+
+Usage:
+  python client_cache_benchmark.py [INVOCATIONS] [STS_DELAY_MS]
+'''
+import datetime
+import os
+import sys
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_INVOCATIONS = 50
+DEFAULT_STS_DELAY_MS = 20
+SERVICES = ['config', 'iam']
+
+ASSUME_ROLE_RESPONSE = '''<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <Credentials>
+      <AccessKeyId>ASIASTUBACCESSKEY</AccessKeyId>
+      <SecretAccessKey>stub-secret-access-key</SecretAccessKey>
+      <SessionToken>stub-session-token</SessionToken>
+      <Expiration>{}</Expiration>
+    </Credentials>
+    <AssumedRoleUser>
+      <AssumedRoleId>AROASTUB:configLambdaExecution</AssumedRoleId>
+      <Arn>arn:aws:sts::123456789012:assumed-role/config-role/configLambdaExecution</Arn>
+    </AssumedRoleUser>
+  </AssumeRoleResult>
+  <ResponseMetadata><RequestId>stub</RequestId></ResponseMetadata>
+</AssumeRoleResponse>'''
+
+class StubStsHandler(BaseHTTPRequestHandler):
+    delay = DEFAULT_STS_DELAY_MS / 1000.0
+    request_count = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        StubStsHandler.request_count += 1
+        time.sleep(self.delay)
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        body = ASSUME_ROLE_RESPONSE.format(expiration.strftime('%Y-%m-%dT%H:%M:%SZ')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_sts(delay_ms):
+    StubStsHandler.delay = delay_ms / 1000.0
+    server = HTTPServer(('127.0.0.1', 0), StubStsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def load_runtime(sts_endpoint):
+    os.environ['AWS_ENDPOINT_URL_STS'] = sts_endpoint
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    import rule_runtime
+    return rule_runtime
+
+def invoke(rule_runtime, event):
+    for service in SERVICES:
+        rule_runtime.get_client(service, event, assume_role_mode=True)
+
+def run(rule_runtime, invocations, cold):
+    event = {'executionRoleArn': 'arn:aws:iam::123456789012:role/config-role'}
+    rule_runtime.reset_client_cache()
+    StubStsHandler.request_count = 0
+    start = time.perf_counter()
+    for _ in range(invocations):
+        if cold:
+            rule_runtime.reset_client_cache()
+        invoke(rule_runtime, event)
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000 / invocations, StubStsHandler.request_count, rule_runtime.get_cache_stats()
+
+def main(argv):
+    invocations = int(argv[0]) if argv else DEFAULT_INVOCATIONS
+    delay_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_STS_DELAY_MS
+    server = start_stub_sts(delay_ms)
+    rule_runtime = load_runtime('http://127.0.0.1:{}'.format(server.server_port))
+    print('{} invocations building {} clients, stub STS delay {} ms'.format(invocations, '/'.join(SERVICES), delay_ms))
+    print('{:>6} {:>18} {:>14} {:>30}'.format('start', 'ms per invocation', 'AssumeRole', 'client hits/misses'))
+    for name, cold in [('cold', True), ('warm', False)]:
+        latency, sts_requests, stats = run(rule_runtime, invocations, cold)
+        print('{:>6} {:>18.2f} {:>14} {:>30}'.format(name, latency, sts_requests, '{}/{}'.format(stats['client_hits'], stats['client_misses'])))
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
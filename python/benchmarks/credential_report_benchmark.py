@@ -0,0 +1,134 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the scheduled evaluation of IAM_USER_USED_LAST_90_DAYS on a large account, with the
+last use of the access keys read from the credential report or from the per-user APIs.
+
+The stub IAM client holds synthetic users with 2 access keys each: a share of them used their keys
+recently, a share used their password recently and the others are stale. Every call answers after a
+fixed latency. The number of API calls, the time and the peak of the memory traced by tracemalloc are
+compared, as well as the compliance of the users (which must be the same). The time is measured on a run
+without tracemalloc, which slows down the parsing of the report much more than the stub calls.
+
+Usage:
+  python credential_report_benchmark.py [COUNT] [LATENCY_MS]
+'''
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+DEFAULT_COUNT = 5000
+DEFAULT_LATENCY_MS = 1
+PROJECTED_LATENCY_MS = 20
+LIST_USERS_PAGE_SIZE = 1000
+
+class StubIamClient():
+    def __init__(self, count, latency_ms, with_report):
+        self.latency = latency_ms / 1000.0
+        self.with_report = with_report
+        self.calls = Counter()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.users = []
+        self.key_last_used = {}
+        for i in range(count):
+            user = {'UserName': 'user-{:06d}'.format(i), 'UserId': 'AIDA{:017d}'.format(i),
+                    'CreateDate': datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)}
+            if i % 5 == 0:
+                user['PasswordLastUsed'] = now - datetime.timedelta(days=3)
+            # 60% of the users used a key in the last 90 days, the others 120 days ago.
+            days = 10 + i % 50 if i % 10 < 6 else 120
+            self.key_last_used['{}-1'.format(user['UserName'])] = now - datetime.timedelta(days=200)
+            self.key_last_used['{}-2'.format(user['UserName'])] = now - datetime.timedelta(days=days)
+            self.users.append(user)
+        # The report is built once, outside of the measures.
+        lines = ['user,arn,user_creation_time,password_enabled,password_last_used,access_key_1_active,access_key_1_last_used_date,'
+                 'access_key_2_active,access_key_2_last_used_date']
+        for user in self.users:
+            lines.append('{0},arn:aws:iam::123456789012:user/{0},2015-01-01T00:00:00+00:00,false,N/A,true,{1},true,{2}'.format(
+                user['UserName'], self.key_last_used[user['UserName'] + '-1'].isoformat(timespec='seconds'),
+                self.key_last_used[user['UserName'] + '-2'].isoformat(timespec='seconds')))
+        self.report = '\n'.join(lines).encode('utf-8')
+
+    def call(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_users(self, Marker=None):
+        self.call('list_users')
+        start = int(Marker) if Marker else 0
+        response = {'Users': self.users[start:start + LIST_USERS_PAGE_SIZE], 'IsTruncated': start + LIST_USERS_PAGE_SIZE < len(self.users)}
+        if response['IsTruncated']:
+            response['Marker'] = str(start + LIST_USERS_PAGE_SIZE)
+        return response
+
+    def list_access_keys(self, UserName):
+        self.call('list_access_keys')
+        return {'AccessKeyMetadata': [{'AccessKeyId': '{}-1'.format(UserName)}, {'AccessKeyId': '{}-2'.format(UserName)}]}
+
+    def get_access_key_last_used(self, AccessKeyId):
+        self.call('get_access_key_last_used')
+        return {'AccessKeyLastUsed': {'LastUsedDate': self.key_last_used[AccessKeyId]}}
+
+    def generate_credential_report(self):
+        self.call('generate_credential_report')
+        return {'State': 'COMPLETE' if self.with_report else 'FAILED'}
+
+    def get_credential_report(self):
+        self.call('get_credential_report')
+        return {'Content': self.report, 'GeneratedTime': datetime.datetime.now(datetime.timezone.utc)}
+
+def build_event():
+    return {
+        'configRuleName': 'benchmark-rule',
+        'executionRoleArn': 'arn:aws:iam::123456789012:role/config-role',
+        'eventLeftScope': False,
+        'invokingEvent': '{"messageType": "ScheduledNotification", "notificationCreationTime": "2019-01-01T00:00:00.000Z"}',
+        'ruleParameters': '{}',
+        'accountId': '123456789012',
+        'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-benchmark',
+        'resultToken': 'token'
+    }
+
+def evaluate(rule, iam_client):
+    rule.get_client = lambda service, event, region=None: iam_client
+    return {evaluation['ComplianceResourceId']: evaluation['ComplianceType']
+            for evaluation in rule.evaluate_scheduled_compliance(build_event(), None, rule.evaluate_parameters({}))}
+
+def run(rule, iam_client, traced_iam_client):
+    start = time.perf_counter()
+    compliance = evaluate(rule, iam_client)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    evaluate(rule, traced_iam_client)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return compliance, elapsed, peak
+
+def main(argv):
+    count = int(argv[0]) if argv else DEFAULT_COUNT
+    latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LATENCY_MS
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'IAM_USER_USED_LAST_90_DAYS'))
+    sys.path.insert(0, root)
+    import IAM_USER_USED_LAST_90_DAYS as rule
+
+    print('{} users, {} ms per call'.format(count, latency_ms))
+    print('{:>12} {:>10} {:>10} {:>12} {:>16} {:>14}'.format('', 'calls', 'seconds', 'peak MiB', 'API s at {} ms'.format(PROJECTED_LATENCY_MS), 'NON_COMPLIANT'))
+    results = []
+    for name, with_report in [('per-user', False), ('report', True)]:
+        iam_client = StubIamClient(count, latency_ms, with_report)
+        compliance, elapsed, peak = run(rule, iam_client, StubIamClient(count, 0, with_report))
+        calls = sum(iam_client.calls.values())
+        print('{:>12} {:>10} {:>10.2f} {:>12.1f} {:>16.1f} {:>14}'.format(
+            name, calls, elapsed, peak / 1024.0 / 1024.0, calls * PROJECTED_LATENCY_MS / 1000.0, Counter(compliance.values())['NON_COMPLIANT']))
+        print('{:>12} {}'.format('', dict(iam_client.calls)))
+        results.append(compliance)
+    print('same compliance: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
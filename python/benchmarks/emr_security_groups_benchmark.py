@@ -0,0 +1,125 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of EMR_SECURITY_GROUPS_RESTRICTED on an account with hundreds of clusters, with the former
+describe_cluster calls and batch_get_resource_config slices made one after another or the concurrent calls of
+rule_runtime.map_entities() and rule_runtime.ConfigBatchFetcher.
+
+Each cluster has its two managed security groups and shares the groups of its team with the other clusters of
+the team. Every call answers after a fixed latency, and Config leaves the last UNPROCESSED_RATE keys of every
+first attempt unprocessed. The open groups must be the same.
+
+Usage:
+  python emr_security_groups_benchmark.py [CLUSTERS] [LATENCY_MS]
+'''
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_CLUSTER_COUNT = 300
+DEFAULT_LATENCY_MS = 20
+CLUSTERS_PER_TEAM = 10
+UNPROCESSED_RATE = 0.2
+
+class StubClient():
+    def __init__(self, cluster_count, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.clusters = {}
+        for index in range(cluster_count):
+            team_group = 'sg-team{:04d}'.format(index // CLUSTERS_PER_TEAM)
+            self.clusters['j-{:06d}'.format(index)] = {'Cluster': {'Id': 'j-{:06d}'.format(index), 'Ec2InstanceAttributes': {
+                'EmrManagedMasterSecurityGroup': 'sg-master{:04d}'.format(index), 'EmrManagedSlaveSecurityGroup': 'sg-slave{:04d}'.format(index),
+                'AdditionalMasterSecurityGroups': [team_group], 'AdditionalSlaveSecurityGroups': [team_group]}}}
+        self.calls = 0
+        self.attempted_keys = set()
+        self.lock = threading.Lock()
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def describe_cluster(self, ClusterId):
+        self.call()
+        return self.clusters[ClusterId]
+
+    def batch_get_resource_config(self, resourceKeys):
+        self.call()
+        with self.lock:
+            first_attempts = [key for key in resourceKeys if key['resourceId'] not in self.attempted_keys]
+            self.attempted_keys.update(key['resourceId'] for key in resourceKeys)
+        unprocessed = first_attempts[len(first_attempts) - int(len(first_attempts) * UNPROCESSED_RATE):] if first_attempts else []
+        unprocessed_ids = set(key['resourceId'] for key in unprocessed)
+        items = []
+        for key in resourceKeys:
+            if key['resourceId'] not in unprocessed_ids:
+                # One master group in seven is open to the world.
+                cidr = '0.0.0.0/0' if key['resourceId'].startswith('sg-master') and int(key['resourceId'][-4:]) % 7 == 0 else '10.0.0.0/8'
+                configuration = {'groupId': key['resourceId'], 'ipPermissions': [{'ipProtocol': 'tcp', 'fromPort': 22, 'toPort': 22,
+                                                                                   'ipv4Ranges': [{'cidrIp': cidr}], 'ipv6Ranges': []}]}
+                items.append(dict(key, configuration=json.dumps(configuration)))
+        return {'baseConfigurationItems': items, 'unprocessedResourceKeys': unprocessed}
+
+def get_sg_cluster_mapping_sequential(cluster_list, emr_client):
+    # The former mapping: one describe_cluster after another.
+    sg_cluster_map = {}
+    for cluster in cluster_list:
+        attributes = emr_client.describe_cluster(ClusterId=cluster['Id'])['Cluster']['Ec2InstanceAttributes']
+        sg_list = set([attributes['EmrManagedSlaveSecurityGroup'], attributes['EmrManagedMasterSecurityGroup']])
+        sg_list.update(attributes['AdditionalSlaveSecurityGroups'])
+        sg_list.update(attributes['AdditionalMasterSecurityGroups'])
+        for security_group in sg_list:
+            sg_cluster_map.setdefault(security_group, []).append(cluster['Id'])
+    return sg_cluster_map, set(sg_cluster_map)
+
+def get_config_items_sequential(config_client, resource_list, resource_type):
+    # The former fetch: sequential slices of 100 keys, the unprocessed keys sent again at once.
+    resource_keys = [{'resourceType': resource_type, 'resourceId': resource} for resource in resource_list]
+    configuration_items = []
+    while resource_keys:
+        res = config_client.batch_get_resource_config(resourceKeys=resource_keys[:100])
+        configuration_items.extend(res['baseConfigurationItems'])
+        while res['unprocessedResourceKeys']:
+            res = config_client.batch_get_resource_config(resourceKeys=res['unprocessedResourceKeys'])
+            configuration_items.extend(res['baseConfigurationItems'])
+        del resource_keys[:100]
+    return configuration_items
+
+def get_open_security_groups_sequential(rule, sg_list, config_client):
+    exposure_index = rule.rule_runtime.SecurityGroupExposureIndex()
+    for item in get_config_items_sequential(config_client, sg_list, 'AWS::EC2::SecurityGroup'):
+        exposure_index.add(item['configuration'])
+    return set(group.group_id for group in exposure_index if group.is_open_to_world())
+
+def evaluate(rule, client, get_sg_cluster_mapping, get_open_security_groups):
+    cluster_list = [{'Id': cluster_id} for cluster_id in sorted(client.clusters)]
+    sg_cluster_map, sg_list = get_sg_cluster_mapping(cluster_list, client)
+    return get_open_security_groups(sg_list, client), len(sg_cluster_map)
+
+def main(argv):
+    cluster_count = int(argv[0]) if argv else DEFAULT_CLUSTER_COUNT
+    latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LATENCY_MS
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'EMR_SECURITY_GROUPS_RESTRICTED'))
+    sys.path.insert(0, root)
+    import EMR_SECURITY_GROUPS_RESTRICTED as rule
+
+    print('{} clusters, {} ms per call, {:.0%} of the keys unprocessed on their first attempt'.format(cluster_count, latency_ms, UNPROCESSED_RATE))
+    print('{:>12} {:>10} {:>8} {:>8} {:>12}'.format('', 'seconds', 'calls', 'groups', 'open groups'))
+    results = []
+    for name, get_sg_cluster_mapping, get_open_security_groups in [
+            ('sequential', get_sg_cluster_mapping_sequential, lambda sg_list, client: get_open_security_groups_sequential(rule, sg_list, client)),
+            ('concurrent', rule.get_sg_cluster_mapping, rule.get_open_security_groups)]:
+        client = StubClient(cluster_count, latency_ms)
+        start = time.perf_counter()
+        open_groups, group_count = evaluate(rule, client, get_sg_cluster_mapping, get_open_security_groups)
+        elapsed = time.perf_counter() - start
+        print('{:>12} {:>10.3f} {:>8} {:>8} {:>12}'.format(name, elapsed, client.calls, group_count, len(open_groups)))
+        results.append(open_groups)
+    print('same open groups: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the scheduled evaluation of IAM_USER_MFA_ENABLED with the list_mfa_devices calls made one after
+another or by the bounded pool of rule_runtime.map_entities(), for several concurrencies.
+
+The stub IAM client holds synthetic users, half of them with an MFA device. Every call answers after a fixed
+latency and first takes a token from an AdaptiveRateLimiter, as the clients of get_client() do, so that the wall
+time stops dropping once the concurrency reaches RATE calls per second. The evaluations must be the same, in the
+same order, whatever the concurrency.
+
+Usage:
+  python entity_fan_out_benchmark.py [USERS] [LATENCY_MS] [RATE]
+'''
+import os
+import sys
+import threading
+import time
+
+DEFAULT_USER_COUNT = 1000
+DEFAULT_LATENCY_MS = 20
+DEFAULT_RATE = 400
+CONCURRENCIES = [1, 2, 4, 8, 16, 32]
+LIST_USERS_PAGE_SIZE = 1000
+
+class StubIamClient():
+    def __init__(self, user_count, latency_ms, rate_limiter):
+        self.latency = latency_ms / 1000.0
+        self.rate_limiter = rate_limiter
+        self.users = [{'UserName': 'user-{:06d}'.format(i), 'UserId': 'AIDA{:017d}'.format(i)} for i in range(user_count)]
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def call(self):
+        self.rate_limiter.acquire()
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def list_users(self, Marker=None):
+        self.call()
+        start = int(Marker) if Marker else 0
+        response = {'Users': self.users[start:start + LIST_USERS_PAGE_SIZE], 'IsTruncated': start + LIST_USERS_PAGE_SIZE < len(self.users)}
+        if response['IsTruncated']:
+            response['Marker'] = str(start + LIST_USERS_PAGE_SIZE)
+        return response
+
+    def list_mfa_devices(self, UserName):
+        self.call()
+        return {'MFADevices': [{'SerialNumber': 'arn:aws:iam::123456789012:mfa/' + UserName}] if int(UserName.split('-')[1]) % 2 else []}
+
+def main(argv):
+    user_count = int(argv[0]) if argv else DEFAULT_USER_COUNT
+    latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LATENCY_MS
+    rate = float(argv[2]) if len(argv) > 2 else DEFAULT_RATE
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'IAM_USER_MFA_ENABLED'))
+    sys.path.insert(0, root)
+    import IAM_USER_MFA_ENABLED as rule
+
+    rule.build_evaluation = lambda resource_id, compliance_type, event, annotation=None: (resource_id, compliance_type)
+    print('{} users, {} ms per call, rate limited to {} calls/s'.format(user_count, latency_ms, rate))
+    print('{:>12} {:>10} {:>10} {:>10}'.format('concurrency', 'calls', 'seconds', 'speedup'))
+    reference = None
+    for concurrency in CONCURRENCIES:
+        rate_limiter = rule.rule_runtime.AdaptiveRateLimiter('iam@benchmark', rate=rate, max_rate=rate)
+        iam_client = StubIamClient(user_count, latency_ms, rate_limiter)
+        rule.get_client = lambda service, event, region=None, iam_client=iam_client: iam_client
+        os.environ['RULE_RUNTIME_ENTITY_CONCURRENCY'] = str(concurrency)
+        start = time.perf_counter()
+        evaluations = list(rule.evaluate_compliance({}, None, {}))
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = (evaluations, elapsed)
+        print('{:>12} {:>10} {:>10.2f} {:>9.1f}x{}'.format(concurrency, iam_client.calls, elapsed, reference[1] / elapsed,
+                                                            '' if evaluations == reference[0] else '  DIFFERENT EVALUATIONS'))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the internet gateway paths of ec2_no_internet_access.py for every instance of a large VPC, with the
+former walk of the relationships one get_resource_config_history call at a time or the batches of
+rule_runtime.ConfigResourceGraph.
+
+The VPC has SUBNETS subnets; the even ones are associated with a route table with a route to an internet
+gateway, the odd ones use the main route table, without one. Each instance has a network interface in one of the
+subnets. Every Config call answers after a fixed latency. The compliance must be the same.
+
+Usage:
+  python internet_path_benchmark.py [INSTANCES] [LATENCY_MS]
+'''
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INSTANCE_COUNT = 5000
+DEFAULT_LATENCY_MS = 1
+SUBNETS = 20
+LIST_DISCOVERED_RESOURCES_PAGE_SIZE = 100
+
+class StubConfigClient():
+    def __init__(self, instance_count, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.items = {}
+        self.add('AWS::EC2::RouteTable', 'rtb-main', {'vpcId': 'vpc-1', 'associations': [{'main': True}], 'routes': [{'gatewayId': 'local'}]}, [])
+        for subnet in range(SUBNETS):
+            subnet_id = 'subnet-{:02d}'.format(subnet)
+            relationships = []
+            if subnet % 2 == 0:
+                route_table_id = 'rtb-{:02d}'.format(subnet)
+                self.add('AWS::EC2::RouteTable', route_table_id, {'vpcId': 'vpc-1', 'associations': [{'main': False, 'subnetId': subnet_id}],
+                                                                  'routes': [{'gatewayId': 'local'}, {'gatewayId': 'igw-1'}]}, [])
+                relationships.append({'resourceType': 'AWS::EC2::RouteTable', 'resourceId': route_table_id})
+            self.add('AWS::EC2::Subnet', subnet_id, {'vpcId': 'vpc-1', 'mapPublicIpOnLaunch': False}, relationships)
+        for index in range(instance_count):
+            subnet_id = 'subnet-{:02d}'.format(index % SUBNETS)
+            eni_id = 'eni-{:06d}'.format(index)
+            self.add('AWS::EC2::NetworkInterface', eni_id, {'subnetId': subnet_id, 'privateIpAddresses': [{'association': None}]},
+                     [{'resourceType': 'AWS::EC2::Subnet', 'resourceId': subnet_id}])
+            self.add('AWS::EC2::Instance', 'i-{:06d}'.format(index), {'publicIpAddress': None, 'subnetId': subnet_id,
+                                                                     'networkInterfaces': [{'networkInterfaceId': eni_id, 'subnetId': subnet_id}]},
+                     [{'resourceType': 'AWS::EC2::NetworkInterface', 'resourceId': eni_id}])
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, resource_type, resource_id, configuration, relationships):
+        self.items[(resource_type, resource_id)] = {'resourceType': resource_type, 'resourceId': resource_id,
+                                                    'configuration': json.dumps(configuration), 'relationships': relationships}
+
+    def call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        time.sleep(self.latency)
+
+    def get_resource_config_history(self, resourceType, resourceId, limit):
+        self.call('GetResourceConfigHistory')
+        return {'configurationItems': [dict(self.items[(resourceType, resourceId)])]}
+
+    def batch_get_resource_config(self, resourceKeys):
+        self.call('BatchGetResourceConfig')
+        # The base configuration items have no relationships.
+        return {'baseConfigurationItems': [{field: value for field, value in self.items[(key['resourceType'], key['resourceId'])].items() if field != 'relationships'}
+                                           for key in resourceKeys if (key['resourceType'], key['resourceId']) in self.items],
+                'unprocessedResourceKeys': []}
+
+    def list_discovered_resources(self, resourceType, nextToken=None):
+        self.call('ListDiscoveredResources')
+        resource_ids = sorted(resource_id for item_type, resource_id in self.items if item_type == resourceType)
+        start = int(nextToken) if nextToken else 0
+        response = {'resourceIdentifiers': [{'resourceType': resourceType, 'resourceId': resource_id}
+                                            for resource_id in resource_ids[start:start + LIST_DISCOVERED_RESOURCES_PAGE_SIZE]]}
+        if start + LIST_DISCOVERED_RESOURCES_PAGE_SIZE < len(resource_ids):
+            response['nextToken'] = str(start + LIST_DISCOVERED_RESOURCES_PAGE_SIZE)
+        return response
+
+def get_related(client, relationship):
+    item = client.get_resource_config_history(resourceType=relationship['resourceType'], resourceId=relationship['resourceId'], limit=1)['configurationItems'][0]
+    item['configuration'] = json.loads(item['configuration'])
+    return item
+
+def evaluate_hop_by_hop(client, instance_ids):
+    # The former walk: every relationship of every instance is read with its own call.
+    compliance = {}
+    for instance_id in instance_ids:
+        instance = get_related(client, {'resourceType': 'AWS::EC2::Instance', 'resourceId': instance_id})
+        compliance[instance_id] = 'COMPLIANT'
+        for eni_relationship in instance['relationships']:
+            subnet = get_related(client, get_related(client, eni_relationship)['relationships'][0])
+            route_tables = [relationship for relationship in subnet['relationships'] if relationship['resourceType'] == 'AWS::EC2::RouteTable']
+            route_table = get_related(client, route_tables[0] if route_tables else {'resourceType': 'AWS::EC2::RouteTable', 'resourceId': 'rtb-main'})
+            if any(route['gatewayId'].startswith('igw-') for route in route_table['configuration']['routes']):
+                compliance[instance_id] = 'NON_COMPLIANT'
+    return compliance
+
+def evaluate_graph(rule, client):
+    resolver = rule.InternetPathResolver(rule.rule_runtime.ConfigResourceGraph(client), account_wide=True)
+    return resolver.evaluate_instances(resolver.graph.get_items_of_type('AWS::EC2::Instance'))
+
+def main(argv):
+    instance_count = int(argv[0]) if argv else DEFAULT_INSTANCE_COUNT
+    latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LATENCY_MS
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, root)
+    sys.modules.setdefault('boto3', type(sys)('boto3')).client = lambda service, *args, **kwargs: None
+    import ec2_no_internet_access as rule
+
+    print('{} instances in {} subnets of a VPC, {} ms per Config call'.format(instance_count, SUBNETS, latency_ms))
+    print('{:>14} {:>10} {:>8} {:>14}'.format('', 'seconds', 'calls', 'NON_COMPLIANT'))
+    results = []
+    for name in ['hop by hop', 'graph']:
+        client = StubConfigClient(instance_count, latency_ms)
+        start = time.perf_counter()
+        if name == 'graph':
+            compliance = evaluate_graph(rule, client)
+        else:
+            compliance = evaluate_hop_by_hop(client, ['i-{:06d}'.format(index) for index in range(instance_count)])
+        elapsed = time.perf_counter() - start
+        print('{:>14} {:>10.3f} {:>8} {:>14}   {}'.format(name, elapsed, sum(client.calls.values()), Counter(compliance.values())['NON_COMPLIANT'],
+                                                           ', '.join('{} {}'.format(count, operation) for operation, count in sorted(client.calls.items()))))
+        results.append(compliance)
+    print('same compliance: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,130 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the scheduled evaluation of IAM_IP_RESTRICTION on an account whose users share a few groups, with
+the verdict of the groups evaluated for every user or once per run.
+
+The stub IAM client holds synthetic users, each in GROUPS_PER_USER of the groups, with an inline and an attached
+policy each. A share of the groups deny the requests from outside of a network, the others only allow some
+actions. Every call answers after a fixed latency. The number of API calls and the time are compared, as well as
+the compliance of the users (which must be the same).
+
+Usage:
+  python ip_restriction_group_benchmark.py [USERS] [GROUPS] [LATENCY_MS]
+'''
+import os
+import sys
+import time
+from collections import Counter
+
+DEFAULT_USER_COUNT = 2000
+DEFAULT_GROUP_COUNT = 20
+DEFAULT_LATENCY_MS = 0
+PROJECTED_LATENCY_MS = 20
+GROUPS_PER_USER = 3
+LIST_USERS_PAGE_SIZE = 1000
+
+ALLOW_POLICY = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': ['s3:GetObject', 's3:ListBucket'], 'Resource': '*'}]}
+IP_DENY_POLICY = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Deny', 'Action': '*', 'Resource': '*',
+                                                          'Condition': {'NotIpAddress': {'aws:SourceIp': ['10.0.0.0/30']}}}]}
+
+class StubIamClient():
+    def __init__(self, user_count, group_count, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.calls = Counter()
+        self.users = [{'UserName': 'user-{:06d}'.format(i), 'UserId': 'AIDA{:017d}'.format(i)} for i in range(user_count)]
+        self.group_count = group_count
+
+    def call(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_users(self, Marker=None):
+        self.call('list_users')
+        start = int(Marker) if Marker else 0
+        response = {'Users': self.users[start:start + LIST_USERS_PAGE_SIZE], 'IsTruncated': start + LIST_USERS_PAGE_SIZE < len(self.users)}
+        if response['IsTruncated']:
+            response['Marker'] = str(start + LIST_USERS_PAGE_SIZE)
+        return response
+
+    def list_groups_for_user(self, UserName):
+        self.call('list_groups_for_user')
+        index = int(UserName.split('-')[1])
+        return {'Groups': [{'GroupName': 'group-{:03d}'.format((index + offset) % self.group_count)} for offset in range(GROUPS_PER_USER)]}
+
+    def list_user_policies(self, UserName):
+        self.call('list_user_policies')
+        return {'PolicyNames': ['user-policy']}
+
+    def get_user_policy(self, UserName, PolicyName):
+        self.call('get_user_policy')
+        return {'PolicyDocument': ALLOW_POLICY}
+
+    def list_attached_user_policies(self, UserName):
+        self.call('list_attached_user_policies')
+        return {'AttachedPolicies': [{'PolicyArn': 'arn:aws:iam::123456789012:policy/user-policy'}]}
+
+    def list_group_policies(self, GroupName):
+        self.call('list_group_policies')
+        return {'PolicyNames': ['group-policy']}
+
+    def get_group_policy(self, GroupName, PolicyName):
+        self.call('get_group_policy')
+        # One group in 4 is IP restricted.
+        return {'PolicyDocument': IP_DENY_POLICY if int(GroupName.split('-')[1]) % 4 == 0 else ALLOW_POLICY}
+
+    def list_attached_group_policies(self, GroupName):
+        self.call('list_attached_group_policies')
+        return {'AttachedPolicies': [{'PolicyArn': 'arn:aws:iam::123456789012:policy/{}'.format(GroupName)}]}
+
+    def get_policy(self, PolicyArn):
+        self.call('get_policy')
+        return {'Policy': {'DefaultVersionId': 'v1'}}
+
+    def get_policy_version(self, PolicyArn, VersionId):
+        self.call('get_policy_version')
+        return {'PolicyVersion': {'Document': ALLOW_POLICY}}
+
+def evaluate_per_user(rule, iam_client, max_ip_nums):
+    # The former evaluation: the groups are evaluated again for each of their users.
+    compliance = {}
+    for user in rule.rule_runtime.paginate(iam_client.list_users, 'Users', 'Marker'):
+        compliance[user['UserId']] = rule.ComplianceEvaluater(iam_client, user['UserName'], max_ip_nums).check_compliant()
+    return compliance
+
+def evaluate_memoized(rule, iam_client, max_ip_nums):
+    event = {'accountId': '123456789012'}
+    rule.get_client = lambda service, event, region=None: iam_client
+    rule.build_evaluation = lambda resource_id, compliance_type, event, annotation=None: (resource_id, compliance_type)
+    return dict(rule.evaluate_compliance(event, None, {'WhitelistedUserNames': [], 'maxIpNums': max_ip_nums}))
+
+def main(argv):
+    user_count = int(argv[0]) if argv else DEFAULT_USER_COUNT
+    group_count = int(argv[1]) if len(argv) > 1 else DEFAULT_GROUP_COUNT
+    latency_ms = float(argv[2]) if len(argv) > 2 else DEFAULT_LATENCY_MS
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'IAM_IP_RESTRICTION'))
+    sys.path.insert(0, root)
+    import IAM_IP_RESTRICTION as rule
+
+    print('{} users in {} groups ({} groups per user), {} ms per call'.format(user_count, group_count, GROUPS_PER_USER, latency_ms))
+    print('{:>12} {:>10} {:>10} {:>16} {:>14}'.format('', 'calls', 'seconds', 'API s at {} ms'.format(PROJECTED_LATENCY_MS), 'NON_COMPLIANT'))
+    results = []
+    for name, evaluate in [('per-user', evaluate_per_user), ('memoized', evaluate_memoized)]:
+        # The managed policies are cached across invocations, both runs start cold.
+        rule.rule_runtime.reset_policy_document_cache()
+        iam_client = StubIamClient(user_count, group_count, latency_ms)
+        start = time.perf_counter()
+        compliance = evaluate(rule, iam_client, rule.DEFAULT_MAX_IP_NUMS)
+        elapsed = time.perf_counter() - start
+        calls = sum(iam_client.calls.values())
+        print('{:>12} {:>10} {:>10.2f} {:>16.1f} {:>14}'.format(
+            name, calls, elapsed, calls * PROJECTED_LATENCY_MS / 1000.0, Counter(compliance.values())['NON_COMPLIANT']))
+        print('{:>12} {}'.format('', dict(iam_client.calls)))
+        results.append(compliance)
+    print('same compliance: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
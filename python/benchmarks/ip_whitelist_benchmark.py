@@ -0,0 +1,98 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of API_GW_RESTRICTED_IP on an account with hundreds of REST APIs and a large corporate whitelist, with the
+former comparison of every network of the policies with every whitelisted network or the IpNetworkSet of the
+whitelist compiled once.
+
+The whitelist holds disjoint /24 networks, the resource policy of each REST API allows some /26 networks and
+addresses in them and, for one API in NON_COMPLIANT_API_RATE, a network outside of them. The compliance must be the
+same.
+
+Usage:
+  python ip_whitelist_benchmark.py [WHITELISTED_NETWORKS] [REST_APIS] [SOURCE_IPS_PER_POLICY]
+'''
+import ipaddress
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+DEFAULT_WHITELIST_SIZE = 1000
+DEFAULT_REST_API_COUNT = 200
+DEFAULT_SOURCE_IPS_PER_POLICY = 20
+NON_COMPLIANT_API_RATE = 10
+
+def build_whitelist(size):
+    # Every other /24 of 10.0.0.0/8, so that no two of them collapse.
+    return ['10.{}.{}.0/24'.format(index * 2 // 256, index * 2 % 256) for index in range(size)]
+
+def build_gateways(api_count, source_ip_count, whitelist):
+    generator = random.Random(42)
+    gateways = []
+    for api_index in range(api_count):
+        source_ips = []
+        for _ in range(source_ip_count):
+            network = ipaddress.ip_network(generator.choice(whitelist))
+            source_ips.append(str(list(network.subnets(new_prefix=26))[generator.randrange(4)]) if generator.random() < 0.5
+                              else str(network[generator.randrange(256)]))
+        if api_index % NON_COMPLIANT_API_RATE == 0:
+            source_ips.append('10.0.1.0/24')
+        policy = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 'execute-api:Invoke', 'Resource': '*',
+                                                          'Condition': {'IpAddress': {'aws:SourceIp': source_ips}}}]}
+        gateways.append({'name': 'api-{:05d}'.format(api_index), 'policy': json.dumps(policy), 'endpointConfiguration': {'types': ['REGIONAL']}})
+    return gateways
+
+def is_ip_in_whitelist_nested(rule, ip_list_or_str, whitelist):
+    # The former check: every network of the policy against every whitelisted network, both parsed for every call.
+    all_network_in_ip_list = rule.get_all_ip_networks(ip_list_or_str)
+    all_network_in_whitelist = rule.get_all_ip_networks(whitelist)
+    for net in all_network_in_ip_list:
+        is_network_included = False
+        for net_whitelisted in all_network_in_whitelist:
+            try:
+                list(net_whitelisted.address_exclude(net))
+                is_network_included = True
+            except:
+                continue
+        if not is_network_included:
+            return False
+    return True
+
+def evaluate(rule, gateways, whitelist):
+    rule.get_client = lambda service, event, region=None: None
+    rule.iter_api_gateways = lambda client: gateways
+    rule.build_evaluation = lambda resource_id, compliance_type, event, annotation=None: (resource_id, compliance_type)
+    return dict(rule.evaluate_compliance({}, None, whitelist))
+
+def main(argv):
+    whitelist_size = int(argv[0]) if argv else DEFAULT_WHITELIST_SIZE
+    api_count = int(argv[1]) if len(argv) > 1 else DEFAULT_REST_API_COUNT
+    source_ip_count = int(argv[2]) if len(argv) > 2 else DEFAULT_SOURCE_IPS_PER_POLICY
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    sys.path.insert(0, os.path.join(root, 'API_GW_RESTRICTED_IP'))
+    sys.path.insert(0, root)
+    import API_GW_RESTRICTED_IP as rule
+
+    whitelist = build_whitelist(whitelist_size)
+    gateways = build_gateways(api_count, source_ip_count, whitelist)
+    compiled_is_ip_in_whitelist = rule.is_ip_in_whitelist
+    print('{} whitelisted networks, {} REST APIs with {} source IPs each'.format(whitelist_size, api_count, source_ip_count))
+    print('{:>12} {:>10} {:>12} {:>14}'.format('', 'seconds', 'ms per API', 'NON_COMPLIANT'))
+    results = []
+    for name, is_ip_in_whitelist in [('nested', lambda ip_list, whitelist: is_ip_in_whitelist_nested(rule, ip_list, whitelist)),
+                                     ('compiled', compiled_is_ip_in_whitelist)]:
+        rule.WHITELIST_NETWORKS_CACHE.clear()
+        rule.is_ip_in_whitelist = is_ip_in_whitelist
+        start = time.perf_counter()
+        compliance = evaluate(rule, gateways, whitelist)
+        elapsed = time.perf_counter() - start
+        print('{:>12} {:>10.3f} {:>12.3f} {:>14}'.format(name, elapsed, 1000.0 * elapsed / api_count, Counter(compliance.values())['NON_COMPLIANT']))
+        results.append(compliance)
+    print('same compliance: {}'.format(results[0] == results[1]))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,152 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the checks of the IAM rules on the raw policy documents and on the compiled policies.
+
+Synthetic policies shaped like the AWS and customer managed ones are generated: read-only policies with hundreds
+of actions, service policies with wildcards and resource lists, IP restricted policies with conditions, policies
+with a single statement dictionary and administrator policies. Every policy is checked as many times as it is
+attached to entities (ATTACHMENTS), with the full star, logging and source IP checks of the rules:
+
+  raw       the former functions, walking and normalizing the JSON on every check
+  compiled  compile_policy() once per policy (as cached by version), then the checks on the compiled statements
+
+Usage:
+  python policy_compiler_benchmark.py [POLICIES] [ATTACHMENTS]
+'''
+import os
+import random
+import sys
+import time
+
+DEFAULT_POLICY_COUNT = 5000
+DEFAULT_ATTACHMENTS = 20
+SERVICES = ['s3', 'ec2', 'iam', 'lambda', 'logs', 'dynamodb', 'sqs', 'sns', 'kms', 'cloudwatch', 'rds', 'sts']
+VERBS = ['Get', 'List', 'Describe', 'Put', 'Create', 'Delete', 'Update', 'Tag']
+
+def build_actions(rng, count):
+    return ['{}:{}{}'.format(rng.choice(SERVICES), rng.choice(VERBS), 'Resource{}'.format(rng.randint(0, 300))) for _ in range(count)]
+
+def build_policy(rng, index):
+    shape = index % 5
+    if shape == 0:
+        # e.g. ReadOnlyAccess: one statement with hundreds of actions.
+        return {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': build_actions(rng, 400), 'Resource': '*'}]}
+    if shape == 1:
+        # A service policy with wildcards and resource lists.
+        return {'Version': '2012-10-17', 'Statement': [
+            {'Sid': 'S{}'.format(statement), 'Effect': 'Allow', 'Action': ['{}:*'.format(rng.choice(SERVICES)), '{}:Get*'.format(rng.choice(SERVICES))],
+             'Resource': ['arn:aws:s3:::bucket-{}/*'.format(rng.randint(0, 1000)), 'arn:aws:logs:*:*:*']} for statement in range(8)]}
+    if shape == 2:
+        # An IP restricted policy.
+        return {'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': build_actions(rng, 20), 'Resource': '*', 'Condition': {'IpAddress': {'aws:SourceIp': ['10.0.0.0/16', '192.168.1.0/24']}}},
+            {'Effect': 'Deny', 'Action': '*', 'Resource': '*', 'Condition': {'NotIpAddress': {'aws:SourceIp': ['10.0.0.0/16', '192.168.1.0/24']}}}]}
+    if shape == 3:
+        # A single statement dictionary, e.g. the logging permissions of a Lambda function.
+        return {'Version': '2012-10-17', 'Statement': {'Effect': 'Allow', 'Action': ['logs:CreateLogGroup', 'logs:CreateLogStream', 'logs:PutLogEvents'],
+                                                       'Resource': 'arn:aws:logs:*:*:*'}}
+    return {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': build_actions(rng, 30), 'Resource': '*'},
+                                                    {'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}
+
+# The former checks of IAM_*_NO_POLICY_FULL_STAR, LAMBDA_ROLE_ALLOWED_ON_LOGGING and IAM_IP_RESTRICTION, on the raw documents.
+# The logging check reads logs:* instead of the log:* of the former rule, for the results to be comparable.
+
+def raw_full_star(statements):
+    statement_list = [statements] if isinstance(statements, dict) else statements
+    for statement in statement_list:
+        if statement['Effect'] == 'Deny' or 'Action' not in statement:
+            continue
+        actions = statement['Action'] if isinstance(statement['Action'], list) else [statement['Action']]
+        if '*' in actions:
+            return True
+    return False
+
+def raw_logging(statements):
+    statement_list = [statements] if isinstance(statements, dict) else statements
+    present = set()
+    for statement in statement_list:
+        if statement['Effect'] != 'Allow':
+            continue
+        actions = statement['Action'] if isinstance(statement['Action'], list) else [statement['Action']]
+        for action in actions:
+            if action in ('*', 'logs:*'):
+                return True
+            if action in ('logs:CreateLogGroup', 'logs:CreateLogStream', 'logs:PutLogEvents'):
+                present.add(action)
+    return len(present) == 3
+
+def raw_source_ips(statements):
+    statement_list = [statements] if isinstance(statements, dict) else statements
+    ips = []
+    for statement in statement_list:
+        try:
+            condition = statement['Condition']
+            if statement['Effect'] == 'Deny' and 'NotIpAddress' in condition:
+                ips.append(condition['NotIpAddress']['aws:SourceIp'])
+            elif statement['Effect'] == 'Allow' and 'IpAddress' in condition:
+                ips.append(condition['IpAddress']['aws:SourceIp'])
+        except KeyError:
+            pass
+    return ips
+
+def check_raw(documents, attachments):
+    results = []
+    for document in documents:
+        for _ in range(attachments):
+            results.append((raw_full_star(document['Statement']), raw_logging(document['Statement']), len(raw_source_ips(document['Statement']))))
+    return results
+
+LOGGING_ACTIONS = ('logs:CreateLogGroup', 'logs:CreateLogStream', 'logs:PutLogEvents')
+LOG_GROUP_ARN = 'arn:aws:logs:us-east-1:123456789012:log-group:/aws/lambda/function:*'
+
+def compiled_logging(policy):
+    return all(policy.allows_action(action, LOG_GROUP_ARN) for action in LOGGING_ACTIONS)
+
+def compiled_source_ips(policy):
+    ips = []
+    for statement in policy.statements:
+        allow_ips = statement.get_source_ips('NotIpAddress') if statement.is_deny() else None
+        if allow_ips is None and statement.is_allow():
+            allow_ips = statement.get_source_ips('IpAddress')
+        if allow_ips is not None:
+            ips.append(allow_ips)
+    return ips
+
+def check_compiled(rule_runtime, documents, attachments):
+    results = []
+    for document in documents:
+        policy = rule_runtime.compile_policy(document)
+        for _ in range(attachments):
+            results.append((policy.has_full_star_allow(), compiled_logging(policy), len(compiled_source_ips(policy))))
+    return results
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main(argv):
+    count = int(argv[0]) if argv else DEFAULT_POLICY_COUNT
+    attachments = int(argv[1]) if len(argv) > 1 else DEFAULT_ATTACHMENTS
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    import rule_runtime
+
+    rng = random.Random(0)
+    documents = [build_policy(rng, index) for index in range(count)]
+    print('{} policies, each checked {} times'.format(count, attachments))
+    raw_results, raw_seconds = measure(check_raw, documents, attachments)
+    compiled_results, compiled_seconds = measure(check_compiled, rule_runtime, documents, attachments)
+    _, compile_seconds = measure(lambda: [rule_runtime.compile_policy(document) for document in documents])
+    policies = [rule_runtime.compile_policy(document) for document in documents]
+    _, action_seconds = measure(lambda: [policy.allows_action('s3:GetObject', 'arn:aws:s3:::bucket-1/key') for policy in policies for _ in range(attachments)])
+    print('{:>28} {:>10}'.format('', 'seconds'))
+    print('{:>28} {:>10.3f}'.format('raw checks', raw_seconds))
+    print('{:>28} {:>10.3f}'.format('compile once + checks', compiled_seconds))
+    print('{:>28} {:>10.3f}'.format('of which compile', compile_seconds))
+    print('{:>28} {:>10.3f}'.format('allows_action (compiled)', action_seconds))
+    print('same results: {}'.format(raw_results == compiled_results))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of the reporting of a large periodic rule run with put_evaluations.
+
+It compares the former serial loop (slices of 100 removed with del evaluation_copy[:100]) with the
+EvaluationFlusher of the rule_runtime, against a stub Config client answering after a fixed latency
+and throttling a fraction of the calls.
+
+Usage:
+  python put_evaluations_benchmark.py [COUNT] [LATENCY_MS] [THROTTLING_RATE]
+'''
+import os
+import random
+import sys
+import threading
+import time
+import botocore.exceptions
+
+DEFAULT_COUNT = 50000
+DEFAULT_LATENCY_MS = 30
+DEFAULT_THROTTLING_RATE = 0.05
+
+class StubConfigClient():
+    def __init__(self, latency_ms, throttling_rate):
+        self.latency = latency_ms / 1000.0
+        self.throttling_rate = throttling_rate
+        self.calls = 0
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def put_evaluations(self, Evaluations, ResultToken, TestMode):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if random.random() < self.throttling_rate:
+                raise botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'PutEvaluations')
+            self.received += len(Evaluations)
+        return {'FailedEvaluations': []}
+
+def legacy_put_evaluations(config_client, evaluations):
+    evaluation_copy = []
+    evaluation_copy = evaluations[:]
+    while evaluation_copy:
+        try:
+            config_client.put_evaluations(Evaluations=evaluation_copy[:100], ResultToken='token', TestMode=False)
+        except botocore.exceptions.ClientError:
+            # The former loop let the Lambda fail on throttling: count the batch as lost and move on.
+            pass
+        del evaluation_copy[:100]
+
+def build_evaluations(count):
+    return [{'ComplianceResourceType': 'AWS::IAM::User', 'ComplianceResourceId': 'AIDA{:016d}'.format(i),
+             'ComplianceType': 'COMPLIANT', 'OrderingTimestamp': '2019-01-01T00:00:00.000Z'} for i in range(count)]
+
+def main(argv):
+    count = int(argv[0]) if argv else DEFAULT_COUNT
+    latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LATENCY_MS
+    throttling_rate = float(argv[2]) if len(argv) > 2 else DEFAULT_THROTTLING_RATE
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    import rule_runtime
+
+    evaluations = build_evaluations(count)
+    print('{} evaluations, {} ms per call, {:.0%} of the calls throttled'.format(count, latency_ms, throttling_rate))
+    print('{:>10} {:>10} {:>8} {:>10}'.format('', 'seconds', 'calls', 'reported'))
+
+    config_client = StubConfigClient(latency_ms, throttling_rate)
+    start = time.perf_counter()
+    legacy_put_evaluations(config_client, evaluations)
+    print('{:>10} {:>10.2f} {:>8} {:>10}'.format('serial', time.perf_counter() - start, config_client.calls, config_client.received))
+
+    config_client = StubConfigClient(latency_ms, throttling_rate)
+    start = time.perf_counter()
+    report = rule_runtime.EvaluationFlusher(config_client, 'token').flush(evaluations)
+    print('{:>10} {:>10.2f} {:>8} {:>10}'.format('flusher', time.perf_counter() - start, config_client.calls, config_client.received))
+    print('flusher totals: {}'.format({key: value for key, value in report.items() if key != 'failed_evaluations'}))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Benchmark of a large periodic rule run, with evaluate_compliance() returning a list or yielding its evaluations.
+
+The fake rule lists its resources by pages of 50 from a stub client answering after a fixed latency, as
+describe_log_groups or list_topics would, and the stub Config client answers put_evaluations after a fixed
+latency. The time to the first accepted put_evaluations, the total time and the peak of the memory traced
+by tracemalloc are compared.
+
+Usage:
+  python streaming_benchmark.py [COUNT] [LIST_LATENCY_MS] [PUT_LATENCY_MS]
+'''
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+DEFAULT_COUNT = 50000
+DEFAULT_LIST_LATENCY_MS = 5
+DEFAULT_PUT_LATENCY_MS = 30
+PAGE_SIZE = 50
+
+class StubConfigClient():
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.received = 0
+        self.first_put = None
+        self.lock = threading.Lock()
+
+    def put_evaluations(self, Evaluations, ResultToken, TestMode):
+        time.sleep(self.latency)
+        with self.lock:
+            self.received += len(Evaluations)
+            if self.first_put is None:
+                self.first_put = time.perf_counter()
+        return {'FailedEvaluations': []}
+
+    def get_compliance_details_by_config_rule(self, **kwargs):
+        return {'EvaluationResults': []}
+
+def iter_pages(count, latency_ms):
+    for start in range(0, count, PAGE_SIZE):
+        time.sleep(latency_ms / 1000.0)
+        yield [{'logGroupName': 'log-group-{:08d}'.format(i), 'kmsKeyId': 'arn:aws:kms:us-east-1:123456789012:key/{:08d}'.format(i)}
+               for i in range(start, min(start + PAGE_SIZE, count))]
+
+def build_rule(rule_runtime, count, list_latency_ms, streaming):
+    rule = types.ModuleType('BENCHMARK_RULE')
+    rule.DEFAULT_RESOURCE_TYPE = 'AWS::Logs::LogGroup'
+    rule.ASSUME_ROLE_MODE = False
+    rule.evaluate_parameters = lambda rule_parameters: rule_parameters
+
+    def evaluate_compliance_list(event, configuration_item, valid_rule_parameters):
+        evaluations = []
+        for page in iter_pages(count, list_latency_ms):
+            for log_group in page:
+                evaluations.append(getattr(rule, 'RUNTIME').build_evaluation(log_group['logGroupName'], 'COMPLIANT', event))
+        return evaluations
+
+    def evaluate_compliance_stream(event, configuration_item, valid_rule_parameters):
+        for page in iter_pages(count, list_latency_ms):
+            for log_group in page:
+                yield getattr(rule, 'RUNTIME').build_evaluation(log_group['logGroupName'], 'COMPLIANT', event)
+
+    rule.evaluate_compliance = evaluate_compliance_stream if streaming else evaluate_compliance_list
+    rule.RUNTIME = rule_runtime.RuleRuntime(rule)
+    return rule
+
+def build_event():
+    return {
+        'configRuleName': 'benchmark-rule',
+        'executionRoleArn': 'arn:aws:iam::123456789012:role/config-role',
+        'eventLeftScope': False,
+        'invokingEvent': '{"messageType": "ScheduledNotification", "notificationCreationTime": "2019-01-01T00:00:00.000Z"}',
+        'ruleParameters': '{}',
+        'accountId': '123456789012',
+        'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-benchmark',
+        'resultToken': 'token'
+    }
+
+def run(rule_runtime, count, list_latency_ms, put_latency_ms, streaming):
+    rule = build_rule(rule_runtime, count, list_latency_ms, streaming)
+    config_client = StubConfigClient(put_latency_ms)
+    getattr(rule, 'RUNTIME').get_client = lambda service, event, region=None: config_client
+    tracemalloc.start()
+    start = time.perf_counter()
+    getattr(rule, 'RUNTIME').lambda_handler(build_event(), {})
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return config_client.first_put - start, elapsed, peak, config_client.received
+
+def main(argv):
+    count = int(argv[0]) if argv else DEFAULT_COUNT
+    list_latency_ms = float(argv[1]) if len(argv) > 1 else DEFAULT_LIST_LATENCY_MS
+    put_latency_ms = float(argv[2]) if len(argv) > 2 else DEFAULT_PUT_LATENCY_MS
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    import rule_runtime
+
+    print('{} resources listed by pages of {} in {} ms, {} ms per put_evaluations'.format(count, PAGE_SIZE, list_latency_ms, put_latency_ms))
+    print('{:>10} {:>14} {:>10} {:>12} {:>10}'.format('', 'first result', 'seconds', 'peak MiB', 'reported'))
+    for name, streaming in [('list', False), ('generator', True)]:
+        first_result_seconds, elapsed, peak, received = run(rule_runtime, count, list_latency_ms, put_latency_ms, streaming)
+        print('{:>10} {:>14.2f} {:>10.2f} {:>12.1f} {:>10}'.format(name, first_result_seconds, elapsed, peak / 1024.0 / 1024.0, received))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,10 +8,14 @@
 # Scope of Changes: EC2:Instance
 # Accepted Parameters: examplePort1, exampleRange1, examplePort2, ...
 # Example Values: 8080, 1-1024, 2375, ...
+# Requires: the rule_runtime layer (python/rule_runtime). The security groups
+#           of the region are described once and shared by the invocations
+#           for RULE_RUNTIME_SG_INDEX_TTL seconds.
 
 
 import json
 import boto3
+import rule_runtime
 
 
 APPLICABLE_RESOURCES = ["AWS::EC2::Instance"]
@@ -19,33 +23,25 @@ APPLICABLE_RESOURCES = ["AWS::EC2::Instance"]
 
 def expand_range(ports):
     if "-" in ports:
-        return range(int(ports.split("-")[0]), int(ports.split("-")[1])+1)
+        return rule_runtime.PortRange(int(ports.split("-")[0]), int(ports.split("-")[1]))
     else:
-        return [int(ports)]
+        return rule_runtime.PortRange(int(ports))
 
 
-def find_exposed_ports(ip_permissions):
-    exposed_ports = []
-    for permission in ip_permissions:
-        if next((r for r in permission["IpRanges"]
-                if "0.0.0.0/0" in r["CidrIp"]), None):
-                    exposed_ports.extend(range(permission["FromPort"],
-                                               permission["ToPort"]+1))
-    return exposed_ports
-
-
-def find_violation(ip_permissions, forbidden_ports):
-    exposed_ports = find_exposed_ports(ip_permissions)
+def find_violation(security_group, forbidden_ports):
+    exposed_ports = security_group.get_ports_open_to_world(ip_versions=(4,))
     for forbidden in forbidden_ports:
-        ports = expand_range(forbidden_ports[forbidden])
-        for port in ports:
-            if port in exposed_ports:
-                return "A forbidden port is exposed to the internet."
+        if exposed_ports.overlaps(expand_range(forbidden_ports[forbidden])):
+            return "A forbidden port is exposed to the internet."
 
     return None
 
 
-def evaluate_compliance(configuration_item, rule_parameters):
+def get_client(service, event, region=None):
+    return rule_runtime.get_client(service, event, region=region)
+
+
+def evaluate_compliance(event, configuration_item, rule_parameters):
     if configuration_item["resourceType"] not in APPLICABLE_RESOURCES:
         return {
             "compliance_type": "NOT_APPLICABLE",
@@ -67,14 +63,11 @@ def evaluate_compliance(configuration_item, rule_parameters):
             "annotation": "The instance doesn't pertain to any security groups."
         }
 
-    ec2 = boto3.resource("ec2")
-    for security_group in security_groups:
-        ip_permissions = ec2.SecurityGroup(
-                                           security_group["groupId"]
-                                          ).ip_permissions
-
+    exposure_index = rule_runtime.get_security_group_exposure_index(get_client, event)
+    group_ids = [security_group["groupId"] for security_group in security_groups]
+    for security_group in exposure_index.get_groups(group_ids, get_client("ec2", event)):
         violation = find_violation(
-            ip_permissions,
+            security_group,
             rule_parameters
         )
 
@@ -100,7 +93,7 @@ def lambda_handler(event, context):
     if "resultToken" in event:
         result_token = event["resultToken"]
 
-    evaluation = evaluate_compliance(configuration_item, rule_parameters)
+    evaluation = evaluate_compliance(event, configuration_item, rule_parameters)
 
     config = boto3.client("config")
     config.put_evaluations(
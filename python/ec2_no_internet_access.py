@@ -4,17 +4,19 @@
 # Ensures that there is no internet connectivity
 # Description: checks the given resource on potential internet access
 #
-# Trigger Type: Change Triggered
+# Trigger Type: Change Triggered, and Periodic to evaluate all the instances at once
 # Scope of Changes: EC2:Instance, EC2:VPC, EC2:RouteTable, EC2:Subnet, EC2:NetworkInterface
 # Optional Parameter: None
 # Example Value: N/A
 #
-# Requires additional AWS Config permissions for GetResourceConfigHistory
+# Requires additional AWS Config permissions for BatchGetResourceConfig, GetResourceConfigHistory and ListDiscoveredResources
+# Requires: the rule_runtime layer (python/rule_runtime), for loading the related resources by batches.
 
 from __future__ import print_function
 
 import json
 import boto3
+import rule_runtime
 
 aws_config = boto3.client('config')
 aws_ec2 = boto3.client('ec2')
@@ -23,9 +25,11 @@ aws_ec2 = boto3.client('ec2')
 class ConfigRule:
   """Base class for implementing a custom config rule in AWS Lambda"""
   
-  def __init__(self, configurationItem):
+  def __init__(self, configurationItem, graph=None):
     self.configurationItem = configurationItem
     self.relationships = configurationItem['relationships']
+    # the related configuration items, read by batches and kept for the run
+    self.graph = graph or rule_runtime.ConfigResourceGraph(aws_config)
    
   def evaluate_compliance(self, configurationItem=None):
     """Actual evaluation logic will be implemented here"""
@@ -48,16 +52,7 @@ class ConfigRule:
     return result  
     
   def get_related_configuration_item(self, relationship):
-    result = aws_config.get_resource_config_history(
-      resourceType=relationship['resourceType'],
-      resourceId=relationship['resourceId'],
-      limit=1,
-    )
-    item = result['configurationItems'][0]
-    
-    if item.has_key('configuration'):
-      item['configuration'] = json.loads(item['configuration'])
-    return item
+    return self.graph.get(relationship['resourceType'], relationship['resourceId'])
     
   def put_evaluations(self, compliance, resultToken):
     aws_config.put_evaluations(
@@ -73,6 +68,102 @@ class ConfigRule:
     )
 
 
+class InternetPathResolver:
+  """
+    Finds the paths from EC2 resources to an internet gateway:
+    instance -> network interface -> subnet -> route table with a route to an IGW
+
+    The route table of a subnet is read from the associations of the route tables of
+    its VPC; a subnet without an explicit association uses the main route table of its
+    VPC. With account_wide, all the route tables of the account are listed once per
+    run, for evaluating every instance at once; otherwise only the route tables of the
+    VPCs met are read, from the relationships of the VPC.
+  """
+  def __init__(self, graph, account_wide=False):
+    self.graph = graph
+    self.account_wide = account_wide
+    self.subnet_route_tables = {}
+    self.main_route_tables = {}
+    # the VPCs whose route tables are indexed, None once all those of the account are
+    self.loaded_vpc_ids = set()
+
+  def get_vpc_route_table_keys(self, vpc_id):
+    # the base items of batch_get_resource_config have no relationships, the ones of the history do
+    result = self.graph.config_client.get_resource_config_history(resourceType='AWS::EC2::VPC', resourceId=vpc_id, limit=1)
+    if not result['configurationItems']:
+      return []
+    return [('AWS::EC2::RouteTable', i['resourceId']) for i in result['configurationItems'][0]['relationships'] if i['resourceType'] == 'AWS::EC2::RouteTable']
+
+  def load_route_tables(self, vpc_id):
+    if self.loaded_vpc_ids is None or vpc_id in self.loaded_vpc_ids:
+      return
+    if self.account_wide:
+      route_tables = self.graph.get_items_of_type('AWS::EC2::RouteTable')
+      route_table_keys = [('AWS::EC2::RouteTable', i) for i in self.graph.resource_ids_of_type['AWS::EC2::RouteTable']]
+    else:
+      route_table_keys = self.get_vpc_route_table_keys(vpc_id) if vpc_id else []
+      route_tables = self.graph.get_items(route_table_keys)
+    # a subnet whose route table is left unprocessed would wrongly fall back to the main route table
+    if any(key in self.graph.unprocessed_keys for key in route_table_keys):
+      raise ValueError('Route tables left unprocessed by batch_get_resource_config')
+    if self.account_wide:
+      self.loaded_vpc_ids = None
+    else:
+      self.loaded_vpc_ids.add(vpc_id)
+    for route_table in route_tables:
+      for association in route_table['configuration'].get('associations') or []:
+        if association.get('main'):
+          self.main_route_tables[route_table['configuration']['vpcId']] = route_table['resourceId']
+        elif association.get('subnetId'):
+          self.subnet_route_tables[association['subnetId']] = route_table['resourceId']
+
+  def get_route_table_id(self, subnet):
+    self.load_route_tables(subnet['configuration'].get('vpcId'))
+    if subnet['resourceId'] in self.subnet_route_tables:
+      return self.subnet_route_tables[subnet['resourceId']]
+    return self.main_route_tables.get(subnet['configuration'].get('vpcId'))
+
+  def get_neighbour_keys(self, graph, item):
+    configuration = item['configuration']
+    if item['resourceType'] == 'AWS::EC2::Instance':
+      interfaces = configuration.get('networkInterfaces') or []
+      if interfaces:
+        return [('AWS::EC2::NetworkInterface', i['networkInterfaceId']) for i in interfaces]
+      if configuration.get('subnetId'):
+        return [('AWS::EC2::Subnet', configuration['subnetId'])]
+    if item['resourceType'] == 'AWS::EC2::NetworkInterface' and configuration.get('subnetId'):
+      return [('AWS::EC2::Subnet', configuration['subnetId'])]
+    if item['resourceType'] == 'AWS::EC2::Subnet':
+      route_table_id = self.get_route_table_id(item)
+      if route_table_id:
+        return [('AWS::EC2::RouteTable', route_table_id)]
+    return []
+
+  def is_internet_gateway_route_table(self, item):
+    # the gateway is identified by its id in the route, so that unrecorded IGWs count too
+    if item['resourceType'] != 'AWS::EC2::RouteTable':
+      return False
+    return any(route.get('gatewayId') and route['gatewayId'].startswith('igw-') for route in item['configuration']['routes'])
+
+  def find_internet_gateway_paths(self, items):
+    """returns {(resourceType, resourceId): path to a route table with an IGW route, or None}"""
+    return self.graph.find_paths(items, self.get_neighbour_keys, self.is_internet_gateway_route_table)
+
+  def evaluate_instances(self, instances):
+    """returns {instance id: compliance}, the paths of all the instances being resolved together, without the
+    instances whose path could not be resolved because Config left some related resources unprocessed"""
+    compliance = {}
+    private_instances = []
+    for instance in instances:
+      if instance['configuration'].get('publicIpAddress'):
+        compliance[instance['resourceId']] = 'NON_COMPLIANT'
+      else:
+        private_instances.append(instance)
+    for (_, instance_id), path in self.find_internet_gateway_paths(private_instances).items():
+      compliance[instance_id] = 'NON_COMPLIANT' if path else 'COMPLIANT'
+    return compliance
+
+
 class RaiseInternetConnectivity(ConfigRule):
   """
     Class for checking given resources for potential internet access.
@@ -84,9 +175,13 @@ class RaiseInternetConnectivity(ConfigRule):
     VPC: Check for attached IGW
     RouteTable: Check for route to an IGW
     Subnet: check if public ip address mapping is enabled, check if assigned route table has a route to an IGW
-    Instance: check if instance has a public ip assigned
+    Instance: check if instance has a public ip assigned, check if the subnet of one of its interfaces has a route to an IGW
     NetworkInterface: check if interface has a public ip assigned
   """
+  def __init__(self, configurationItem, graph=None):
+    ConfigRule.__init__(self, configurationItem, graph)
+    self.resolver = InternetPathResolver(self.graph)
+
   def evaluate_compliance(self, configurationItem=None):
     if not configurationItem:
       configurationItem = self.configurationItem
@@ -113,28 +208,25 @@ class RaiseInternetConnectivity(ConfigRule):
         return 'NON_COMPLIANT'
         
       # check if subnet has a route to an internet gateway
-      try: 
-        route_table = self.get_related_configuration_item(self.find_relationships_by_type('AWS::EC2::RouteTable').pop())
-      except:
+      route_tables = self.find_relationships_by_type('AWS::EC2::RouteTable')
+      if route_tables:
+        route_table = self.get_related_configuration_item(route_tables.pop())
+      else:
         # no routing table associated, get main routing table of VPC
-        vpc = self.get_related_configuration_item(self.find_relationships_by_type('AWS::EC2::VPC').pop())
-        route_tables = self.find_relationships_by_type('AWS::EC2::RouteTable', vpc['relationships'])
-        for i in route_tables:
-          r = self.get_related_configuration_item(i)
-          if r['configuration']['associations'][0]['main']:
-            route_table = r
-            break
-        else:
-          raise Exception('Main route table not found', vpc)
-         
+        route_table_id = self.resolver.get_route_table_id(configurationItem)
+        route_table = self.graph.get('AWS::EC2::RouteTable', route_table_id) if route_table_id else None
+      if not route_table:
+        raise Exception('Main route table not found', configurationItem['configuration'].get('vpcId'))
+
       # check if assigned route table has a rule with an internet gateway
       return self.evaluate_route_table(route_table)
     
-    # check if the instance has a public ip assigned
+    # check if the instance has a public ip assigned, or a route to an internet gateway
     if configurationItem['resourceType'] == 'AWS::EC2::Instance':
-      if configurationItem['configuration']['publicIpAddress']:
-        return 'NON_COMPLIANT'
-      return 'COMPLIANT'
+      compliance = self.resolver.evaluate_instances([configurationItem])
+      if configurationItem['resourceId'] not in compliance:
+        raise Exception('Related resources left unprocessed', configurationItem['resourceId'])
+      return compliance[configurationItem['resourceId']]
       
     # check if network interface has a public ip associated
     if configurationItem['resourceType'] == 'AWS::EC2::NetworkInterface':
@@ -146,15 +238,44 @@ class RaiseInternetConnectivity(ConfigRule):
     return 'NOT_APPLICABLE'
   
   def evaluate_route_table(self, route_table):
-    for route in route_table['configuration']['routes']:
-      if route['gatewayId'] and route['gatewayId'].startswith('igw-'):
-        return 'NON_COMPLIANT'
+    if self.resolver.is_internet_gateway_route_table(route_table):
+      return 'NON_COMPLIANT'
     return 'COMPLIANT'  
 
 
+def evaluate_all_instances(invokingEvent, resultToken):
+  # evaluate every instance of the account, with the related resources read once for all of them
+  resolver = InternetPathResolver(rule_runtime.ConfigResourceGraph(aws_config), account_wide=True)
+  instances = resolver.graph.get_items_of_type('AWS::EC2::Instance')
+  compliance = resolver.evaluate_instances(instances)
+
+  print('Compliance evaluation for %d instances: %d NON_COMPLIANT' % (len(compliance), list(compliance.values()).count('NON_COMPLIANT')))
+  # the instances left unprocessed, or whose path was, are evaluated again by the next run
+  skipped_count = len(resolver.graph.resource_ids_of_type['AWS::EC2::Instance']) - len(compliance)
+  if skipped_count:
+    print('%d instances not evaluated, related resources left unprocessed by batch_get_resource_config' % skipped_count)
+
+  evaluations = []
+  for instance_id in sorted(compliance):
+    evaluations.append({
+      'ComplianceResourceType': 'AWS::EC2::Instance',
+      'ComplianceResourceId': instance_id,
+      'ComplianceType': compliance[instance_id],
+      'OrderingTimestamp': invokingEvent['notificationCreationTime']
+    })
+  rule_runtime.EvaluationFlusher(aws_config, resultToken).flush(evaluations)
+
+
 def lambda_handler(event, context):
   try:
     invokingEvent = json.loads(event['invokingEvent'])
+  except:
+    raise Exception('Could not load configuration item', event)
+
+  if invokingEvent.get('messageType') == 'ScheduledNotification':
+    return evaluate_all_instances(invokingEvent, event['resultToken'])
+
+  try:
     configurationItem = invokingEvent['configurationItem']
   except:
     raise Exception('Could not load configuration item', event)
@@ -6,6 +6,7 @@
 # Trigger Type: Change Triggered
 # Scope of Changes: EC2:SecurityGroup
 # Accepted Parameters: None
+# Requires: the rule_runtime layer (python/rule_runtime), for parsing the inbound rules.
 # Your Lambda function execution role will need to have a policy that provides
 # the appropriate permissions. Here is a policy that you can consider.
 # You should validate this for your own environment.
@@ -35,6 +36,7 @@
 
 import boto3
 import json
+import rule_runtime
 
 
 APPLICABLE_RESOURCES = ["AWS::EC2::SecurityGroup"]
@@ -58,13 +60,11 @@ def evaluate_compliance(configuration_item):
                      + configuration_item["resourceType"] + "."
 
     else:
-        # Iterate over IP permissions
-        for i in configuration_item['configuration']['ipPermissions']:
-            # inbound rules with no "fromPort" have a value of "All"
-            if "fromPort" not in i:
-                compliance_type = 'NON_COMPLIANT'
-                annotation = 'Security group is not compliant.'
-                break
+        # inbound rules with no "fromPort" have a value of "All"
+        exposure = rule_runtime.SecurityGroupExposure.from_configuration(configuration_item['configuration'])
+        if exposure.has_all_ports_rule():
+            compliance_type = 'NON_COMPLIANT'
+            annotation = 'Security group is not compliant.'
 
     return {
         "compliance_type": compliance_type,
@@ -6,6 +6,7 @@
 # Trigger Type: Change Triggered
 # Scope of Changes: EC2:SecurityGroup
 # Accepted Parameters: None
+# Requires: the rule_runtime layer (python/rule_runtime), for parsing the inbound rules.
 # Your Lambda function execution role will need to have a policy that provides
 # the appropriate permissions. Here is a policy that you can consider.
 # You should validate this for your own environment.
@@ -35,6 +36,7 @@
 
 import boto3
 import json
+import rule_runtime
 
 
 APPLICABLE_RESOURCES = ["AWS::EC2::SecurityGroup"]
@@ -58,12 +60,10 @@ def evaluate_compliance(configuration_item):
                      + configuration_item["resourceType"] + "."
 
     else:
-        # Iterate over IP permissions
-        for ip in configuration_item['configuration']['ipPermissions']:
-            if ip['ipProtocol'] == "-1":
-                compliance_type = 'NON_COMPLIANT'
-                annotation = 'Security group is not compliant.'
-                break
+        exposure = rule_runtime.SecurityGroupExposure.from_configuration(configuration_item['configuration'])
+        if exposure.has_all_protocols_rule():
+            compliance_type = 'NON_COMPLIANT'
+            annotation = 'Security group is not compliant.'
 
     return {
         "compliance_type": compliance_type,
@@ -0,0 +1,38 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Shared runtime of the RDK rules.
+
+A rule module only supplies evaluate_compliance() and evaluate_parameters(), binds a RuleRuntime to
+itself and exposes its lambda_handler. See README.md for the packaging as a Lambda layer.
+'''
+from rule_runtime.authorization_details import AuthorizationDetails
+from rule_runtime.clients import (get_assume_role_credentials, get_cache_stats, get_client, get_execution_role_arn,
+                                  reset_client_cache)
+from rule_runtime.config_batch import (ConfigBatchFetcher, batch_get_configuration_items, build_resource_key,
+                                       dedupe_resource_keys)
+from rule_runtime.configuration import convert_api_configuration, get_configuration_item, is_applicable
+from rule_runtime.credential_report import (get_access_key_last_used_dates, get_active_access_key_dates, get_credential_report,
+                                             iter_credential_report, parse_report_date)
+from rule_runtime.evaluations import EvaluationFactory, build_annotation, clean_up_old_evaluations
+from rule_runtime.fan_out import get_entity_concurrency, map_entities
+from rule_runtime.flusher import EvaluationFlusher
+from rule_runtime.handler import (RuleRuntime, build_error_response, build_internal_error_response,
+                                  build_parameters_value_error_response, is_internal_error)
+from rule_runtime.instrumentation import ApiCallRecorder, install_instrumentation, start_recording, stop_recording
+from rule_runtime.ip_networks import IpNetworkSet
+from rule_runtime.leader_region import FileResultStore, LeaderRegionMode, S3ResultStore, get_leader_region_mode
+from rule_runtime.pagination import iter_pages, paginate
+from rule_runtime.policy_compiler import CompiledPolicy, CompiledStatement, compile_policy
+from rule_runtime.policy_documents import (PolicyDocumentCache, get_compiled_policy, get_policy_document, log_policy_cache_report,
+                                            reset_policy_document_cache)
+from rule_runtime.port_ranges import PortIntervals, PortRange
+from rule_runtime.profiling import EvaluationProfiler, get_profile_mode
+from rule_runtime.rate_limiter import (AdaptiveRateLimiter, RateLimitedClientFactory, get_rate_limiter, install_rate_limiter,
+                                       log_rate_limiter_report, pop_rate_limiter_stats, reset_rate_limiters)
+from rule_runtime.resource_graph import ConfigResourceGraph
+from rule_runtime.security_group_exposure import (ExposureRule, SecurityGroupExposure, SecurityGroupExposureIndex,
+                                                    get_security_group_exposure_index, reset_security_group_exposure_index)
+from rule_runtime.verdict_cache import (DynamoDBVerdictBackend, FileVerdictBackend, MemoryVerdictBackend, get_configuration_fingerprint,
+                                         log_verdict_cache_report, reset_verdict_cache)
@@ -0,0 +1,86 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+A snapshot of the IAM users, groups, roles and managed policies of the account, from get_account_authorization_details.
+
+A periodic rule evaluating every entity reads their inline and attached policies from a few pages of one API
+instead of the list_*_policies, get_*_policy, list_attached_*_policies, get_policy and get_policy_version calls
+per entity and per policy. The default version of every managed policy is kept once, whatever the number of
+entities attaching it.
+'''
+import json
+import urllib.parse
+
+from rule_runtime.pagination import iter_pages
+from rule_runtime.policy_documents import get_policy_document, get_policy_document_cache
+
+# The Filter value, the response list and the name, id and inline policies fields of every entity type.
+ENTITY_TYPES = {
+    'AWS::IAM::User': ('User', 'UserDetailList', 'UserName', 'UserId', 'UserPolicyList'),
+    'AWS::IAM::Group': ('Group', 'GroupDetailList', 'GroupName', 'GroupId', 'GroupPolicyList'),
+    'AWS::IAM::Role': ('Role', 'RoleDetailList', 'RoleName', 'RoleId', 'RolePolicyList')
+}
+
+MANAGED_POLICY_FILTERS = ['LocalManagedPolicy', 'AWSManagedPolicy']
+
+def load_policy_document(document):
+    # botocore decodes the policy documents of the IAM responses, they are only URL-encoded JSON without it.
+    if isinstance(document, str):
+        return json.loads(urllib.parse.unquote(document))
+    return document
+
+class AuthorizationDetails():
+    """The entities of the requested types and the default version of the managed policies, read page by page.
+
+    Keyword arguments:
+    iam_client -- the IAM boto client
+    resource_types -- the entity types to read, keys of ENTITY_TYPES (default all of them)
+    managed_policies -- False to skip the documents of the managed policies, when only the attached ARNs are
+                        evaluated (default True). They are then read with get_policy_document() on demand.
+    """
+    def __init__(self, iam_client, resource_types=None, managed_policies=True):
+        self.iam_client = iam_client
+        self.resource_types = list(resource_types or ENTITY_TYPES)
+        self.entities = {resource_type: [] for resource_type in self.resource_types}
+        self.policy_documents = {}
+        filters = [ENTITY_TYPES[resource_type][0] for resource_type in self.resource_types]
+        if managed_policies:
+            filters += MANAGED_POLICY_FILTERS
+        for page in iter_pages(iam_client.get_account_authorization_details, 'Marker', Filter=filters, MaxItems=1000):
+            for resource_type in self.resource_types:
+                self.entities[resource_type].extend(page.get(ENTITY_TYPES[resource_type][1], []))
+            for policy in page.get('Policies', []):
+                self.add_policy(policy)
+
+    def add_policy(self, policy):
+        # Only the default version is kept, the others are never evaluated. It also feeds the policy document cache.
+        for version in policy.get('PolicyVersionList', []):
+            if version.get('IsDefaultVersion') or version.get('VersionId') == policy.get('DefaultVersionId'):
+                self.policy_documents[policy['Arn']] = load_policy_document(version['Document'])
+                get_policy_document_cache().put(policy['Arn'], version['VersionId'], self.policy_documents[policy['Arn']])
+                return
+
+    def iter_entities(self, resource_type):
+        """Yield (id, name, detail) for every entity of resource_type, e.g. 'AWS::IAM::Role'."""
+        _, _, name_field, id_field, _ = ENTITY_TYPES[resource_type]
+        for entity in self.entities[resource_type]:
+            yield entity[id_field], entity[name_field], entity
+
+    @staticmethod
+    def get_inline_policies(resource_type, entity):
+        """Return the (name, document) of the inline policies of an entity."""
+        return [(policy['PolicyName'], load_policy_document(policy['PolicyDocument']))
+                for policy in entity.get(ENTITY_TYPES[resource_type][4], [])]
+
+    def get_managed_policies(self, entity):
+        """Return the (arn, name, document) of the managed policies attached to an entity."""
+        return [(policy['PolicyArn'], policy['PolicyName'], self.get_policy_document(policy['PolicyArn']))
+                for policy in entity.get('AttachedManagedPolicies', [])]
+
+    def get_policy_document(self, policy_arn):
+        """Return the default version of a managed policy, read with rule_runtime.get_policy_document() when it is
+        missing from the snapshot (e.g. attached since)."""
+        if policy_arn not in self.policy_documents:
+            self.policy_documents[policy_arn] = load_policy_document(get_policy_document(self.iam_client, policy_arn))
+        return self.policy_documents[policy_arn]
@@ -0,0 +1,172 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+boto3 clients of the rules, optionally built after assuming the role attached to the Config rule.
+'''
+import datetime
+import importlib
+import json
+import sys
+import botocore
+import botocore.exceptions
+
+from rule_runtime.instrumentation import install_instrumentation
+from rule_runtime.rate_limiter import get_rate_limiter, install_rate_limiter
+
+try:
+    import liblogging
+except ImportError:
+    pass
+
+# Duration of the credentials obtained when assuming the Config rule role.
+CONFIG_ROLE_TIMEOUT_SECONDS = 900
+
+# Cached credentials are renewed when they expire in less than this duration.
+CREDENTIALS_REFRESH_SECONDS = 300
+
+# The clients and the assumed role credentials are kept for the lifetime of the Lambda container,
+# so that warm invocations neither build the clients again nor call sts.assume_role.
+CLIENT_CACHE = {}
+CREDENTIALS_CACHE = {}
+CACHE_STATS = {'client_hits': 0, 'client_misses': 0, 'credentials_hits': 0, 'credentials_misses': 0}
+CACHED_BOTO3 = None
+
+def get_boto3():
+    """Return the boto3 module currently registered in sys.modules.
+
+    boto3 is resolved on every call rather than bound at import time, so that the *_test.py files
+    replacing sys.modules['boto3'] by a mock keep driving the runtime, whichever rule imported it first.
+    """
+    return importlib.import_module('boto3')
+
+def get_cache_stats():
+    """Return a copy of the hit/miss counters of the client and credentials caches."""
+    return dict(CACHE_STATS)
+
+def reset_client_cache():
+    """Forget the cached clients and credentials, and reset the counters (i.e. back to a cold start)."""
+    CLIENT_CACHE.clear()
+    CREDENTIALS_CACHE.clear()
+    for key in CACHE_STATS:
+        CACHE_STATS[key] = 0
+
+def get_cached_boto3():
+    # Drop the caches when boto3 is replaced (e.g. by the mock of another *_test.py in the same process).
+    global CACHED_BOTO3
+    boto3 = get_boto3()
+    if CACHED_BOTO3 is not boto3:
+        CLIENT_CACHE.clear()
+        CREDENTIALS_CACHE.clear()
+        CACHED_BOTO3 = boto3
+    return boto3
+
+def is_fresh(expiration):
+    if not isinstance(expiration, datetime.datetime):
+        return False
+    now = datetime.datetime.now(expiration.tzinfo)
+    return expiration - now > datetime.timedelta(seconds=CREDENTIALS_REFRESH_SECONDS)
+
+# This gets the client after assuming the Config service role
+# either in the same AWS account or cross-account.
+def get_client(service, event, assume_role_mode=False, region=None):
+    """Return the service boto client. It should be used instead of directly calling the client.
+
+    The client is cached per (service, role ARN, region) and reused by the next invocations,
+    as long as the credentials it was built with are not about to expire. Its calls are paced by the
+    adaptive rate limiter of the service in the account.
+
+    Keyword arguments:
+    service -- the service name used for calling the boto.client()
+    event -- the event variable given in the lambda handler
+    assume_role_mode -- True to assume the role attached on the Config rule (default False)
+    region -- the region where the client will be called (default None)
+    """
+    boto3 = get_cached_boto3()
+    role_arn = get_execution_role_arn(event) if assume_role_mode else None
+    cache_key = (service, role_arn, region)
+    cached_client = CLIENT_CACHE.get(cache_key)
+    if cached_client and (not role_arn or is_fresh(cached_client[1])):
+        CACHE_STATS['client_hits'] += 1
+        return cached_client[0]
+    CACHE_STATS['client_misses'] += 1
+
+    if not role_arn:
+        client = boto3.client(service, region)
+        install_rate_limiter(client, get_client_rate_limiter(client, service, event, role_arn))
+        install_instrumentation(client)
+        CLIENT_CACHE[cache_key] = (client, None)
+        return client
+
+    credentials = get_assume_role_credentials(role_arn, region)
+    client = boto3.client(service, aws_access_key_id=credentials['AccessKeyId'],
+                          aws_secret_access_key=credentials['SecretAccessKey'],
+                          aws_session_token=credentials['SessionToken'],
+                          region_name=region
+                         )
+    install_rate_limiter(client, get_client_rate_limiter(client, service, event, role_arn))
+    install_instrumentation(client)
+    # Credentials without a known expiration cannot be safely reused.
+    if is_fresh(credentials.get('Expiration')):
+        CLIENT_CACHE[cache_key] = (client, credentials['Expiration'])
+    return client
+
+def get_client_rate_limiter(client, service, event, role_arn=None):
+    # The limiter is shared by the clients of the service in the account and the region of the client, whatever the role.
+    arn_parts = role_arn.split(':') if role_arn else []
+    account_id = arn_parts[4] if len(arn_parts) > 4 else event.get('accountId')
+    return get_rate_limiter(service, account_id, client.meta.region_name)
+
+def get_execution_role_arn(event):
+    """Return the ARN of the role to assume, honouring the optional ExecutionRoleName rule parameter.
+
+    Keyword arguments:
+    event -- the event variable given in the lambda handler
+    """
+    role_arn = None
+    if 'ruleParameters' in event:
+        rule_params = json.loads(event['ruleParameters'])
+        role_name = rule_params.get("ExecutionRoleName")
+        if role_name:
+            execution_role_prefix = event["executionRoleArn"].split("/")[0]
+            role_arn = "{}/{}".format(execution_role_prefix, role_name)
+
+    if not role_arn:
+        role_arn = event['executionRoleArn']
+
+    return role_arn
+
+def get_assume_role_credentials(role_arn, region=None):
+    """Return the credentials of the assumed role, from the cache while they are not about to expire.
+
+    Keyword arguments:
+    role_arn -- the ARN of the role to assume
+    region -- the region of the STS endpoint (default None)
+    """
+    cache_key = (role_arn, region)
+    credentials = CREDENTIALS_CACHE.get(cache_key)
+    if credentials and is_fresh(credentials.get('Expiration')):
+        CACHE_STATS['credentials_hits'] += 1
+        return credentials
+    CACHE_STATS['credentials_misses'] += 1
+
+    sts_client = get_cached_boto3().client('sts', region)
+    try:
+        assume_role_response = sts_client.assume_role(RoleArn=role_arn,
+                                                      RoleSessionName="configLambdaExecution",
+                                                      DurationSeconds=CONFIG_ROLE_TIMEOUT_SECONDS)
+        if 'liblogging' in sys.modules:
+            liblogging.logSession(role_arn, assume_role_response)
+        credentials = assume_role_response['Credentials']
+        if is_fresh(credentials.get('Expiration')):
+            CREDENTIALS_CACHE[cache_key] = credentials
+        return credentials
+    except botocore.exceptions.ClientError as ex:
+        # Scrub error message for any internal account info leaks
+        print(str(ex))
+        if 'AccessDenied' in ex.response['Error']['Code']:
+            ex.response['Error']['Message'] = "AWS Config does not have permission to assume the IAM role."
+        else:
+            ex.response['Error']['Message'] = "InternalError"
+            ex.response['Error']['Code'] = "InternalError"
+        raise ex
@@ -0,0 +1,134 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Fetch many configuration items by key with concurrent batch_get_resource_config calls.
+
+A rule reading the configuration items of many resources (e.g. the security groups of all the EMR clusters)
+sends the keys by batches of 100, the maximum accepted by batch_get_resource_config. The keys are deduplicated
+first, so that a resource shared by several parents (e.g. a group attached to many clusters) is only read once,
+and the batches are sent with the bounded pool of rule_runtime.map_entities(), i.e. RULE_RUNTIME_ENTITY_CONCURRENCY
+calls in flight sharing the rate limiter of Config.
+
+Config may leave some keys in unprocessedResourceKeys: only those keys are sent again, as well as the whole batch
+of a throttled call, after a jittered exponential backoff. The keys still unprocessed after CONFIG_BATCH_MAX_ATTEMPTS
+are logged, left out of the result of fetch() and listed in the unprocessed_keys of its stats. They are not deleted
+resources: batch_get_configuration_items() raises a ValueError for them, so that a rule does not evaluate without them.
+'''
+import random
+import threading
+import time
+import botocore
+import botocore.exceptions
+
+from rule_runtime.fan_out import map_entities
+from rule_runtime.flusher import is_throttling_error, iter_batches
+
+# Maximum number of keys accepted by a batch_get_resource_config call.
+BATCH_GET_RESOURCE_CONFIG_SIZE = 100
+
+# Number of attempts for a batch, after which its unprocessed keys are given up.
+CONFIG_BATCH_MAX_ATTEMPTS = 6
+
+# The backoff before the nth retry is drawn between 0 and min(CONFIG_BATCH_MAX_DELAY_SECONDS, CONFIG_BATCH_BASE_DELAY_SECONDS * 2 ** n).
+CONFIG_BATCH_BASE_DELAY_SECONDS = 0.1
+CONFIG_BATCH_MAX_DELAY_SECONDS = 5
+
+def build_resource_key(resource_type, resource_id):
+    return {'resourceType': resource_type, 'resourceId': resource_id}
+
+def get_key_tuple(resource_key):
+    return (resource_key['resourceType'], resource_key['resourceId'])
+
+def dedupe_resource_keys(resource_keys):
+    """Return the resource keys without duplicates, in the order of their first occurrence."""
+    unique_keys = {}
+    for resource_key in resource_keys:
+        unique_keys.setdefault(get_key_tuple(resource_key), resource_key)
+    return list(unique_keys.values())
+
+class ConfigBatchFetcher():
+    """Read configuration items by key, by batches of 100 sent concurrently.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    max_workers -- the number of batch_get_resource_config calls in flight (default get_entity_concurrency())
+    max_attempts -- the number of attempts for a batch (default CONFIG_BATCH_MAX_ATTEMPTS)
+    base_delay -- the base of the backoff, in seconds (default CONFIG_BATCH_BASE_DELAY_SECONDS)
+    """
+    def __init__(self, config_client, max_workers=None, max_attempts=CONFIG_BATCH_MAX_ATTEMPTS, base_delay=CONFIG_BATCH_BASE_DELAY_SECONDS):
+        self.config_client = config_client
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.lock = threading.Lock()
+        self.stats = {'keys': 0, 'calls': 0, 'retried': 0, 'throttled': 0, 'unprocessed_keys': []}
+
+    def backoff(self, attempt):
+        time.sleep(random.uniform(0, min(CONFIG_BATCH_MAX_DELAY_SECONDS, self.base_delay * 2 ** attempt)))
+
+    def add_stats(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def fetch_batch(self, batch):
+        """Return the base configuration items of a batch of at most 100 keys, retrying its unprocessed keys."""
+        configuration_items = []
+        pending = batch
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.add_stats(retried=len(pending))
+                self.backoff(attempt)
+            self.add_stats(calls=1)
+            try:
+                response = self.config_client.batch_get_resource_config(resourceKeys=pending)
+            except botocore.exceptions.ClientError as ex:
+                if not is_throttling_error(ex):
+                    raise
+                self.add_stats(throttled=1)
+                continue
+            configuration_items.extend(response.get('baseConfigurationItems', []))
+            pending = response.get('unprocessedResourceKeys') or []
+            if not pending:
+                return configuration_items
+        print('{} resource keys left unprocessed by batch_get_resource_config after {} attempts.'.format(len(pending), self.max_attempts))
+        self.add_stats(unprocessed_keys=list(pending))
+        return configuration_items
+
+    def fetch(self, resource_keys):
+        """Return the base configuration items of the resource keys, per (resourceType, resourceId).
+
+        Keyword arguments:
+        resource_keys -- an iterable of {'resourceType': ..., 'resourceId': ...}, possibly with duplicates
+        """
+        unique_keys = dedupe_resource_keys(resource_keys)
+        self.add_stats(keys=len(unique_keys))
+        configuration_items = {}
+        for _, batch_items in map_entities(self.fetch_batch, iter_batches(unique_keys, BATCH_GET_RESOURCE_CONFIG_SIZE), self.max_workers):
+            for configuration_item in batch_items:
+                configuration_items[get_key_tuple(configuration_item)] = configuration_item
+        return configuration_items
+
+def batch_get_configuration_items(config_client, resource_type, resource_ids, max_workers=None):
+    """Return the base configuration items of the resources of a type, in the order of their ids, without the
+    resources Config did not return (e.g. deleted). Raise a ValueError when Config still left some of them unprocessed.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    resource_type -- the type of the resources, e.g. 'AWS::EC2::SecurityGroup'
+    resource_ids -- an iterable of resource ids, possibly with duplicates
+    max_workers -- the number of batch_get_resource_config calls in flight (default get_entity_concurrency())
+    """
+    resource_ids = list(resource_ids)
+    fetcher = ConfigBatchFetcher(config_client, max_workers)
+    configuration_items = fetcher.fetch(build_resource_key(resource_type, resource_id) for resource_id in resource_ids)
+    if fetcher.stats['unprocessed_keys']:
+        raise ValueError('{} {} left unprocessed by batch_get_resource_config: {}'.format(
+            len(fetcher.stats['unprocessed_keys']), resource_type, ', '.join(sorted(key['resourceId'] for key in fetcher.stats['unprocessed_keys']))))
+    ordered_items = []
+    for resource_id in dict.fromkeys(resource_ids):
+        configuration_item = configuration_items.get((resource_type, resource_id))
+        if configuration_item is not None:
+            ordered_items.append(configuration_item)
+    return ordered_items
@@ -0,0 +1,108 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+The IAM credential report: the passwords, access keys and MFA of every user of the account in one CSV.
+
+A rule reading it makes 2 or 3 API calls instead of one or more calls per user. IAM generates a new report
+only when the last one is older than 4 hours, so the rules must tolerate that lag (e.g. by checking the
+non-compliant users with the per-user APIs), and fall back on the per-user APIs when no report is available.
+'''
+import csv
+import datetime
+import io
+import time
+import botocore
+import botocore.exceptions
+import dateutil.parser
+
+# A report older than this is considered stale, IAM regenerates it after 4 hours.
+CREDENTIAL_REPORT_MAX_AGE = datetime.timedelta(hours=4)
+
+# How long to wait for IAM to generate the report, and how often to check.
+CREDENTIAL_REPORT_TIMEOUT_SECONDS = 60
+CREDENTIAL_REPORT_POLL_SECONDS = 2
+
+# Values of the date columns which are not dates.
+CREDENTIAL_REPORT_NO_DATE = ('N/A', 'no_information', 'not_supported', '')
+
+def generate_credential_report(iam_client, timeout_seconds=CREDENTIAL_REPORT_TIMEOUT_SECONDS):
+    """Ask IAM for a fresh report and wait until it is generated. Return False if it is not ready in time."""
+    deadline = time.time() + timeout_seconds
+    while True:
+        state = iam_client.generate_credential_report().get('State')
+        if state == 'COMPLETE':
+            return True
+        if state not in ('STARTED', 'INPROGRESS') or time.time() + CREDENTIAL_REPORT_POLL_SECONDS > deadline:
+            return False
+        time.sleep(CREDENTIAL_REPORT_POLL_SECONDS)
+
+def get_credential_report(iam_client, max_age=CREDENTIAL_REPORT_MAX_AGE, timeout_seconds=CREDENTIAL_REPORT_TIMEOUT_SECONDS):
+    """Return the content of the credential report (the CSV as bytes), or None if no fresh report is available.
+
+    The report is unavailable when the role is not allowed to generate or read it (e.g. the
+    iam:GenerateCredentialReport permission is missing), when IAM does not generate it in time, or
+    when it is older than max_age.
+
+    Keyword arguments:
+    iam_client -- the IAM boto client
+    max_age -- the maximum age of the report, a timedelta (default CREDENTIAL_REPORT_MAX_AGE)
+    timeout_seconds -- how long to wait for the generation of the report (default CREDENTIAL_REPORT_TIMEOUT_SECONDS)
+    """
+    try:
+        if not generate_credential_report(iam_client, timeout_seconds):
+            print('The credential report was not generated in time.')
+            return None
+        response = iam_client.get_credential_report()
+    except botocore.exceptions.ClientError as ex:
+        print('The credential report is unavailable: {}'.format(ex))
+        return None
+    generated_time = response.get('GeneratedTime')
+    if not isinstance(generated_time, datetime.datetime) or not isinstance(response.get('Content'), bytes):
+        return None
+    if datetime.datetime.now(generated_time.tzinfo) - generated_time > max_age:
+        print('The credential report generated on {} is stale.'.format(generated_time))
+        return None
+    return response['Content']
+
+def iter_credential_report(content):
+    """Yield the rows of the credential report, one dictionary per user, keyed by the CSV header.
+
+    The CSV is decoded and parsed line by line, without a decoded copy of the report nor the list of the
+    rows. The root account is the row of the '<root_account>' user.
+
+    Keyword arguments:
+    content -- the bytes returned by get_credential_report()
+    """
+    for row in csv.DictReader(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8', newline='')):
+        yield row
+
+def parse_report_date(value):
+    """Return the datetime of a date column of the report, or None for N/A, no_information and not_supported."""
+    if value in CREDENTIAL_REPORT_NO_DATE:
+        return None
+    # The report uses ISO 8601 (e.g. 2019-01-01T00:00:00+00:00), which fromisoformat() parses much faster than
+    # dateutil. It is missing before Python 3.7.
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (AttributeError, ValueError):
+        return dateutil.parser.parse(value)
+
+def get_active_access_key_dates(row):
+    """Return the last rotation dates of the active access keys of a report row, i.e. the creation dates of the keys."""
+    dates = []
+    for key in ('access_key_1', 'access_key_2'):
+        if row.get(key + '_active') == 'true':
+            last_rotated = parse_report_date(row.get(key + '_last_rotated', 'N/A'))
+            if last_rotated:
+                dates.append(last_rotated)
+    return dates
+
+def get_access_key_last_used_dates(row):
+    """Return the last use dates of the access keys of a report row, whether the keys are active or not."""
+    dates = []
+    for key in ('access_key_1', 'access_key_2'):
+        last_used = parse_report_date(row.get(key + '_last_used_date', 'N/A'))
+        if last_used:
+            dates.append(last_used)
+    return dates
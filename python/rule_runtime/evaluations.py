@@ -0,0 +1,104 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Evaluations reported to Config Rules, and the clean-up of the evaluations from previous runs.
+'''
+import json
+from rule_runtime.pagination import paginate
+
+# AWS Config rejects annotations longer than 256 characters.
+ANNOTATION_MAX_LENGTH = 256
+
+REQUIRED_EVALUATION_FIELDS = ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp')
+
+def build_annotation(annotation_string):
+    if len(annotation_string) > ANNOTATION_MAX_LENGTH:
+        return annotation_string[:244] + " [truncated]"
+    return annotation_string
+
+class EvaluationFactory():
+    """Build the evaluations of a single invocation.
+
+    The invoking event is parsed once when the factory is created, instead of once per evaluation.
+
+    Keyword arguments:
+    event -- the event variable given in the lambda handler
+    default_resource_type -- the CloudFormation resource type used when none is given
+    """
+    def __init__(self, event, default_resource_type):
+        self.invoking_event = event['invokingEvent']
+        self.default_resource_type = default_resource_type
+        self.ordering_timestamp = str(json.loads(self.invoking_event)['notificationCreationTime'])
+
+    def is_bound_to(self, event):
+        return self.invoking_event is event['invokingEvent']
+
+    def build_evaluation(self, resource_id, compliance_type, resource_type=None, annotation=None):
+        eval_cc = {}
+        if annotation:
+            eval_cc['Annotation'] = build_annotation(annotation)
+        eval_cc['ComplianceResourceType'] = resource_type or self.default_resource_type
+        eval_cc['ComplianceResourceId'] = resource_id
+        eval_cc['ComplianceType'] = compliance_type
+        eval_cc['OrderingTimestamp'] = self.ordering_timestamp
+        return eval_cc
+
+    @staticmethod
+    def build_evaluation_from_config_item(configuration_item, compliance_type, annotation=None):
+        eval_ci = {}
+        if annotation:
+            eval_ci['Annotation'] = build_annotation(annotation)
+        eval_ci['ComplianceResourceType'] = configuration_item['resourceType']
+        eval_ci['ComplianceResourceId'] = configuration_item['resourceId']
+        eval_ci['ComplianceType'] = compliance_type
+        eval_ci['OrderingTimestamp'] = configuration_item['configurationItemCaptureTime']
+        return eval_ci
+
+def has_required_fields(evaluation):
+    missing_fields = False
+    for field in REQUIRED_EVALUATION_FIELDS:
+        if field not in evaluation:
+            print("Missing " + field + " from custom evaluation.")
+            missing_fields = True
+    return not missing_fields
+
+# Yield the COMPLIANT and NON_COMPLIANT results of the previous evaluation, one page at a time.
+def get_old_evaluations(config_client, config_rule_name):
+    return paginate(config_client.get_compliance_details_by_config_rule, 'EvaluationResults',
+                    ConfigRuleName=config_rule_name, ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'], Limit=100)
+
+def get_resource_key(evaluation):
+    return (evaluation['ComplianceResourceType'], evaluation['ComplianceResourceId'])
+
+# Yield a NOT_APPLICABLE evaluation for each resource of the previous evaluation which is not reported anymore.
+def get_stale_evaluations(config_client, evaluation_factory, latest_resource_keys, event):
+    """Yield the NOT_APPLICABLE evaluations of the resources not in latest_resource_keys.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    evaluation_factory -- the EvaluationFactory of the invocation
+    latest_resource_keys -- the set of (ComplianceResourceType, ComplianceResourceId) reported by the current invocation
+    event -- the event variable given in the lambda handler
+    """
+    for old_eval in get_old_evaluations(config_client, event['configRuleName']):
+        old_qualifier = old_eval['EvaluationResultIdentifier']['EvaluationResultQualifier']
+        old_resource_type = old_qualifier.get('ResourceType', evaluation_factory.default_resource_type)
+        old_resource_id = old_qualifier['ResourceId']
+        if (old_resource_type, old_resource_id) not in latest_resource_keys:
+            yield evaluation_factory.build_evaluation(old_resource_id, "NOT_APPLICABLE", resource_type=old_resource_type)
+
+# This removes older evaluation (usually useful for periodic rule not reporting on AWS::::Account).
+def clean_up_old_evaluations(config_client, evaluation_factory, latest_evaluations, event):
+    """Return the latest evaluations preceded by a NOT_APPLICABLE evaluation for each resource not reported anymore.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    evaluation_factory -- the EvaluationFactory of the invocation
+    latest_evaluations -- the list of evaluations of the current invocation
+    event -- the event variable given in the lambda handler
+    """
+    # Index the latest evaluations once, so that each old result is looked up in constant time.
+    latest_resource_keys = set(get_resource_key(latest_eval) for latest_eval in latest_evaluations)
+    cleaned_evaluations = list(get_stale_evaluations(config_client, evaluation_factory, latest_resource_keys, event))
+    return cleaned_evaluations + latest_evaluations
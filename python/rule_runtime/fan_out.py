@@ -0,0 +1,68 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Evaluate the entities of a scheduled rule (e.g. the IAM users) with a bounded pool of threads.
+
+The per-entity calls of a rule (e.g. list_mfa_devices for every user) mostly wait on the network, so running a
+few of them concurrently divides the wall time by about the concurrency, until the API throttles. The calls of
+the clients returned by get_client() all take their token from the rate limiter shared by the service, account
+and region, which is thread-safe: the threads are spaced by the learnt rate and slow down together on throttling.
+
+The results are yielded in the order of the entities, whatever the order the calls complete in, so that the
+evaluations are reported in the same order as a sequential run. At most 2 * concurrency entities are in flight,
+the entities are read lazily (e.g. from rule_runtime.paginate()) and the results streamed.
+
+The concurrency is RULE_RUNTIME_ENTITY_CONCURRENCY (default 8); 1 evaluates the entities one after another in
+the calling thread.
+'''
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ENTITY_CONCURRENCY_VARIABLE = 'RULE_RUNTIME_ENTITY_CONCURRENCY'
+DEFAULT_ENTITY_CONCURRENCY = 8
+
+def get_entity_concurrency():
+    """Return the number of entities evaluated concurrently, from the environment."""
+    try:
+        return max(1, int(os.environ.get(ENTITY_CONCURRENCY_VARIABLE, DEFAULT_ENTITY_CONCURRENCY)))
+    except ValueError:
+        print('Invalid {} value, {} is used.'.format(ENTITY_CONCURRENCY_VARIABLE, DEFAULT_ENTITY_CONCURRENCY))
+        return DEFAULT_ENTITY_CONCURRENCY
+
+def map_entities(function, entities, max_workers=None):
+    """Yield (entity, function(entity)) for every entity, in the order of entities.
+
+    The function runs in the threads of the pool: it should only call the AWS APIs and compute the result, the
+    evaluations being built by the caller. An exception of the function is raised when its entity is reached.
+    Closing the generator early waits for the calls in flight and cancels the others.
+
+    Keyword arguments:
+    function -- the work item, called with an entity
+    entities -- an iterable of entities, e.g. rule_runtime.paginate(iam_client.list_users, 'Users', 'Marker')
+    max_workers -- the number of entities evaluated concurrently (default get_entity_concurrency())
+    """
+    if max_workers is None:
+        max_workers = get_entity_concurrency()
+    if max_workers <= 1:
+        for entity in entities:
+            yield entity, function(entity)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = collections.deque()
+    try:
+        for entity in entities:
+            pending.append((entity, executor.submit(function, entity)))
+            # The window keeps the pool busy while the caller consumes the oldest result.
+            if len(pending) >= 2 * max_workers:
+                entity, future = pending.popleft()
+                yield entity, future.result()
+        while pending:
+            entity, future = pending.popleft()
+            yield entity, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,159 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Report the evaluations to Config Rules with concurrent put_evaluations calls.
+'''
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import botocore
+import botocore.exceptions
+
+# Maximum number of evaluations accepted by a put_evaluations call.
+PUT_EVALUATIONS_BATCH_SIZE = 100
+
+# Number of put_evaluations calls in flight.
+FLUSHER_MAX_WORKERS = 8
+
+# Number of attempts for a batch, after which its evaluations are reported as failed.
+FLUSHER_MAX_ATTEMPTS = 6
+
+# The backoff before the nth retry is drawn between 0 and min(FLUSHER_MAX_DELAY_SECONDS, FLUSHER_BASE_DELAY_SECONDS * 2 ** n).
+FLUSHER_BASE_DELAY_SECONDS = 0.1
+FLUSHER_MAX_DELAY_SECONDS = 5
+
+THROTTLING_ERROR_CODES = ('Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+                          'RequestLimitExceeded', 'RequestThrottled', 'RequestThrottledException')
+
+def is_throttling_error(exception):
+    return isinstance(exception, botocore.exceptions.ClientError) and exception.response['Error']['Code'] in THROTTLING_ERROR_CODES
+
+def get_failed_evaluations(response):
+    if not isinstance(response, dict):
+        return []
+    return list(response.get('FailedEvaluations', []))
+
+def iter_batches(evaluations, batch_size=PUT_EVALUATIONS_BATCH_SIZE):
+    """Yield the consecutive batches of evaluations, without copying nor shifting the list."""
+    for start in range(0, len(evaluations), batch_size):
+        yield evaluations[start:start + batch_size]
+
+class EvaluationFlusher():
+    """Send the evaluations by batches of 100 with a bounded thread pool.
+
+    Only the evaluations returned in FailedEvaluations, or the whole batch when the call is throttled,
+    are sent again after a jittered exponential backoff.
+
+    The evaluations are either sent at once with flush(), or streamed batch by batch with submit()
+    while they are being built, then finish() waits for the calls in flight. submit() blocks while
+    2 * max_workers batches are pending, so that a fast producer does not pile up evaluations in memory.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    result_token -- the resultToken of the event
+    test_mode -- True to skip the actual recording of the evaluations (default False)
+    max_workers -- the number of put_evaluations calls in flight (default FLUSHER_MAX_WORKERS)
+    max_attempts -- the number of attempts for a batch (default FLUSHER_MAX_ATTEMPTS)
+    base_delay -- the base of the backoff, in seconds (default FLUSHER_BASE_DELAY_SECONDS)
+    """
+    def __init__(self, config_client, result_token, test_mode=False, max_workers=FLUSHER_MAX_WORKERS,
+                 max_attempts=FLUSHER_MAX_ATTEMPTS, base_delay=FLUSHER_BASE_DELAY_SECONDS):
+        self.config_client = config_client
+        self.result_token = result_token
+        self.test_mode = test_mode
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.start = time.time()
+        self.first_result_seconds = None
+        self.evaluation_count = 0
+        self.executor = None
+        self.pending_batches = threading.BoundedSemaphore(2 * max_workers)
+        self.futures = []
+
+    def backoff(self, attempt):
+        time.sleep(random.uniform(0, min(FLUSHER_MAX_DELAY_SECONDS, self.base_delay * 2 ** attempt)))
+
+    def send_batch(self, batch):
+        """Send a batch until all its evaluations are accepted, and return its totals."""
+        totals = {'calls': 0, 'retried': 0, 'throttled': 0, 'failed_evaluations': []}
+        pending = batch
+        for attempt in range(self.max_attempts):
+            if attempt:
+                totals['retried'] += len(pending)
+                self.backoff(attempt)
+            totals['calls'] += 1
+            try:
+                response = self.config_client.put_evaluations(Evaluations=pending, ResultToken=self.result_token, TestMode=self.test_mode)
+            except botocore.exceptions.ClientError as ex:
+                if not is_throttling_error(ex):
+                    raise
+                totals['throttled'] += 1
+                continue
+            if self.first_result_seconds is None:
+                self.first_result_seconds = round(time.time() - self.start, 3)
+            pending = get_failed_evaluations(response)
+            if not pending:
+                return totals
+        totals['failed_evaluations'] = pending
+        return totals
+
+    def release_batch(self, _future):
+        self.pending_batches.release()
+
+    def submit(self, batch):
+        """Send a batch of at most 100 evaluations in the background.
+
+        Keyword arguments:
+        batch -- the list of evaluations, which must not be modified afterwards
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.evaluation_count += len(batch)
+        self.pending_batches.acquire()
+        future = self.executor.submit(self.send_batch, batch)
+        future.add_done_callback(self.release_batch)
+        self.futures.append(future)
+
+    def finish(self):
+        """Wait for the batches submitted so far and return the totals of the run."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        report = {'evaluations': self.evaluation_count, 'batches': len(self.futures), 'calls': 0, 'retried': 0, 'throttled': 0, 'failed_evaluations': []}
+        for future in self.futures:
+            totals = future.result()
+            report['calls'] += totals['calls']
+            report['retried'] += totals['retried']
+            report['throttled'] += totals['throttled']
+            report['failed_evaluations'] += totals['failed_evaluations']
+        report['first_result_seconds'] = self.first_result_seconds
+        report['seconds'] = round(time.time() - self.start, 3)
+        return report
+
+    def abort(self):
+        """Wait for the batches in flight and discard their totals (e.g. when the evaluation failed midway)."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.futures = []
+
+    def flush(self, evaluations):
+        """Send all the evaluations and return the totals of the run.
+
+        Keyword arguments:
+        evaluations -- the list of evaluations to report
+        """
+        if len(evaluations) <= PUT_EVALUATIONS_BATCH_SIZE:
+            # A single call does not need the thread pool.
+            self.evaluation_count += len(evaluations)
+            for batch in iter_batches(evaluations):
+                future = Future()
+                future.set_result(self.send_batch(batch))
+                self.futures.append(future)
+            return self.finish()
+        for batch in iter_batches(evaluations):
+            self.submit(batch)
+        return self.finish()
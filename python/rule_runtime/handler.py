@@ -0,0 +1,358 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+The RDK lambda_handler pipeline shared by the rules.
+'''
+import inspect
+import json
+import sys
+import botocore
+import botocore.exceptions
+
+from rule_runtime.clients import get_client
+from rule_runtime.configuration import check_defined, get_configuration_item, is_applicable
+from rule_runtime.evaluations import (EvaluationFactory, clean_up_old_evaluations, get_resource_key, get_stale_evaluations,
+                                      has_required_fields)
+from rule_runtime.flusher import PUT_EVALUATIONS_BATCH_SIZE, EvaluationFlusher
+from rule_runtime.instrumentation import start_recording, stop_recording
+from rule_runtime.leader_region import get_invocation_region, get_leader_region_mode
+from rule_runtime.policy_documents import log_policy_cache_report
+from rule_runtime.profiling import EvaluationProfiler, get_profile_mode
+from rule_runtime.rate_limiter import log_rate_limiter_report
+from rule_runtime.verdict_cache import evaluate_incrementally, get_verdict_cache_backend, invalidate_verdict, log_verdict_cache_report
+
+try:
+    import liblogging
+except ImportError:
+    pass
+
+MESSAGE_TYPES = ('ConfigurationItemChangeNotification', 'ScheduledNotification', 'OversizedConfigurationItemChangeNotification')
+
+class RuleRuntime():
+    """Run the RDK pipeline on behalf of a rule module.
+
+    The rule module supplies evaluate_compliance() and evaluate_parameters(), and sets DEFAULT_RESOURCE_TYPE
+    and ASSUME_ROLE_MODE. They are read from the module on every invocation, so that they can be changed
+    on the rule module (e.g. by the *_test.py files).
+
+    Keyword arguments:
+    rule -- the rule module, usually sys.modules[__name__]
+    message_types -- the messageType values evaluated, the others being reported as an internal error (default
+                     MESSAGE_TYPES); None evaluates the configurationItem whatever the messageType
+    """
+    def __init__(self, rule, message_types=MESSAGE_TYPES):
+        self.rule = rule
+        self.message_types = message_types
+        self.config_client = None
+        self.evaluation_factory = None
+
+    def get_client(self, service, event, region=None):
+        """Return the service boto client. It should be used instead of directly calling the client.
+
+        Keyword arguments:
+        service -- the service name used for calling the boto.client()
+        event -- the event variable given in the lambda handler
+        region -- the region where the client will be called (default None)
+        """
+        return get_client(service, event, getattr(self.rule, 'ASSUME_ROLE_MODE', False), region)
+
+    def get_evaluation_factory(self, event):
+        """Return the EvaluationFactory of the invocation, the invoking event is only parsed on its first use."""
+        if self.evaluation_factory is None or not self.evaluation_factory.is_bound_to(event):
+            self.evaluation_factory = EvaluationFactory(event, self.rule.DEFAULT_RESOURCE_TYPE)
+        return self.evaluation_factory
+
+    def build_evaluation(self, resource_id, compliance_type, event, resource_type=None, annotation=None):
+        """Form an evaluation as a dictionary. Usually suited to report on scheduled rules.
+
+        Keyword arguments:
+        resource_id -- the unique id of the resource to report
+        compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
+        event -- the event variable given in the lambda handler
+        resource_type -- the CloudFormation resource type (or AWS::::Account) to report on the rule (default DEFAULT_RESOURCE_TYPE)
+        annotation -- an annotation to be added to the evaluation (default None)
+        """
+        return self.get_evaluation_factory(event).build_evaluation(resource_id, compliance_type, resource_type, annotation)
+
+    @staticmethod
+    def build_evaluation_from_config_item(configuration_item, compliance_type, annotation=None):
+        """Form an evaluation as a dictionary. Usually suited to report on configuration change rules.
+
+        Keyword arguments:
+        configuration_item -- the configurationItem dictionary in the invokingEvent
+        compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
+        annotation -- an annotation to be added to the evaluation (default None)
+        """
+        return EvaluationFactory.build_evaluation_from_config_item(configuration_item, compliance_type, annotation)
+
+    def evaluate_incrementally(self, event, configuration_item, configuration_fields, valid_rule_parameters, evaluate):
+        """Return the cached verdict of the configuration item when the configuration fields the rule depends on
+        are unchanged, otherwise evaluate() (see rule_runtime.verdict_cache). Without RULE_RUNTIME_VERDICT_CACHE,
+        evaluate() is always called.
+
+        Keyword arguments:
+        event -- the event variable given in the lambda handler
+        configuration_item -- the configurationItem dictionary in the invokingEvent
+        configuration_fields -- the fields of the configuration the verdict depends on, e.g. ('attachedManagedPolicies',)
+        valid_rule_parameters -- the output of the evaluate_parameters()
+        evaluate -- the function evaluating the configuration item, returning a compliance type or an evaluation
+        """
+        return evaluate_incrementally(get_verdict_cache_backend(self.get_client, event), event, configuration_item, configuration_fields,
+                                      valid_rule_parameters, evaluate, self.build_evaluation_from_config_item)
+
+    def clean_up_old_evaluations(self, latest_evaluations, event):
+        return clean_up_old_evaluations(self.config_client, self.get_evaluation_factory(event), latest_evaluations, event)
+
+    def lambda_handler(self, event, context):
+        return self.run(self.handle_event, event, context)
+
+    def run(self, handle_event, event, context):
+        """Call handle_event(event, context), then report the throttling, the policy document cache hit rate and
+        the accounting of the API calls it made (see rule_runtime.instrumentation) whatever the outcome.
+
+        Keyword arguments:
+        handle_event -- the handler of the invocation, e.g. the custom lambda_handler of a rule
+        event -- the event variable given in the lambda handler
+        context -- the context variable given in the lambda handler
+        """
+        recorder = start_recording(self.rule.__name__, event)
+        try:
+            return handle_event(event, context)
+        finally:
+            log_rate_limiter_report()
+            log_policy_cache_report()
+            log_verdict_cache_report()
+            stop_recording(recorder)
+
+    # This decorates the lambda_handler in rule_code with the actual PutEvaluation call
+    def handle_event(self, event, context):
+        if 'liblogging' in sys.modules:
+            liblogging.logEvent(event)
+
+        check_defined(event, 'event')
+        invoking_event = json.loads(event['invokingEvent'])
+        rule_parameters = {}
+        if 'ruleParameters' in event:
+            rule_parameters = json.loads(event['ruleParameters'])
+        profiler = EvaluationProfiler(self.rule.__name__, get_profile_mode(rule_parameters))
+
+        try:
+            # The reserved rule parameters are removed before the ones of the rule are validated.
+            leader_region_mode = get_leader_region_mode(rule_parameters)
+            valid_rule_parameters = self.rule.evaluate_parameters(rule_parameters)
+        except ValueError as ex:
+            return build_parameters_value_error_response(ex)
+
+        try:
+            self.config_client = self.get_client('config', event)
+            if self.message_types is None or invoking_event['messageType'] in self.message_types:
+                configuration_item = get_configuration_item(self.config_client, invoking_event)
+                if leader_region_mode is not None and not leader_region_mode.is_leader(event):
+                    compliance_result = self.get_follower_evaluations(leader_region_mode, event)
+                elif is_applicable(configuration_item, event):
+                    profiler.start()
+                    compliance_result = self.rule.evaluate_compliance(event, configuration_item, valid_rule_parameters)
+                else:
+                    # A deleted resource is evaluated again if it is recreated.
+                    if configuration_item:
+                        invalidate_verdict(get_verdict_cache_backend(self.get_client, event), event, configuration_item)
+                    compliance_result = "NOT_APPLICABLE"
+            else:
+                return build_internal_error_response('Unexpected message type', str(invoking_event))
+
+            # A generator is consumed while its evaluations are being reported, the API errors can then occur here.
+            if inspect.isgenerator(compliance_result):
+                # The evaluations are only kept for the RDK tests and for the results saved by the leader region.
+                keep_evaluations = event['resultToken'] == 'TESTMODE' or is_saving_leader_run(leader_region_mode, invoking_event, event)
+                evaluations, report = self.stream_evaluations(compliance_result, event, keep_evaluations)
+            else:
+                evaluations, report = self.report_evaluations(compliance_result, configuration_item, event)
+        except botocore.exceptions.ClientError as ex:
+            if is_internal_error(ex):
+                return build_internal_error_response("Unexpected error while completing API request", str(ex))
+            return build_error_response("Customer error while making API request", str(ex), ex.response['Error']['Code'], ex.response['Error']['Message'])
+        except ValueError as ex:
+            return build_internal_error_response(str(ex), str(ex))
+        finally:
+            profiler.stop()
+
+        if report['failed_evaluations']:
+            return build_internal_error_response("Unable to report {} evaluations".format(len(report['failed_evaluations'])),
+                                                 str(report['failed_evaluations']))
+
+        # Only the periodic runs of the leader region evaluate all the resources.
+        if is_saving_leader_run(leader_region_mode, invoking_event, event):
+            leader_region_mode.save_evaluations(evaluations, self.get_client, event)
+
+        # Used solely for RDK test to be able to test Lambda function
+        return evaluations
+
+    def get_follower_evaluations(self, leader_region_mode, event):
+        """Return the evaluations of the leader region for a follower region, instead of evaluate_compliance().
+
+        Keyword arguments:
+        leader_region_mode -- the LeaderRegionMode of the rule parameters
+        event -- the event variable given in the lambda handler
+        """
+        persisted_evaluations = leader_region_mode.load_evaluations(self.get_client, event)
+        print('{} is evaluated in the leader region {}, {} evaluations reused in {}'.format(
+            self.rule.__name__, leader_region_mode.leader_region, len(persisted_evaluations or []), get_invocation_region(event)))
+        # Without results, NOT_APPLICABLE is reported on the account.
+        return [self.build_evaluation(evaluation['ComplianceResourceId'], evaluation['ComplianceType'], event,
+                                      resource_type=evaluation['ComplianceResourceType'], annotation=evaluation.get('Annotation'))
+                for evaluation in persisted_evaluations or []]
+
+    def build_evaluations(self, compliance_result, configuration_item, event):
+        """Turn the value returned by evaluate_compliance() into the list of evaluations to report.
+
+        Keyword arguments:
+        compliance_result -- the output of the evaluate_compliance()
+        configuration_item -- the configurationItem dictionary in the invokingEvent
+        event -- the event variable given in the lambda handler
+        """
+        evaluations = []
+        latest_evaluations = []
+
+        if not compliance_result:
+            latest_evaluations.append(self.build_evaluation(event['accountId'], "NOT_APPLICABLE", event, resource_type='AWS::::Account'))
+            evaluations = self.clean_up_old_evaluations(latest_evaluations, event)
+        elif isinstance(compliance_result, str):
+            if configuration_item:
+                evaluations.append(self.build_evaluation_from_config_item(configuration_item, compliance_result))
+            else:
+                evaluations.append(self.build_evaluation(event['accountId'], compliance_result, event))
+        elif isinstance(compliance_result, list):
+            for evaluation in compliance_result:
+                if has_required_fields(evaluation):
+                    latest_evaluations.append(evaluation)
+            evaluations = self.clean_up_old_evaluations(latest_evaluations, event)
+        elif isinstance(compliance_result, dict):
+            if has_required_fields(compliance_result):
+                evaluations.append(compliance_result)
+        else:
+            evaluations.append(self.build_evaluation_from_config_item(configuration_item, 'NOT_APPLICABLE'))
+        return evaluations
+
+    def report_evaluations(self, compliance_result, configuration_item, event):
+        """Build the evaluations of the value returned by evaluate_compliance() and report them. Return the
+        evaluations and the totals of put_evaluations(), as stream_evaluations() does.
+
+        Keyword arguments:
+        compliance_result -- the output of the evaluate_compliance()
+        configuration_item -- the configurationItem dictionary in the invokingEvent
+        event -- the event variable given in the lambda handler
+        """
+        evaluations = self.build_evaluations(compliance_result, configuration_item, event)
+        return evaluations, self.put_evaluations(evaluations, event)
+
+    def stream_evaluations(self, evaluations, event, keep_evaluations=True):
+        """Report the evaluations yielded by evaluate_compliance() by batches of 100, while they are being built.
+
+        The resources reported so far are tracked by (type, id), then the old evaluations of the resources
+        not reported anymore are cleaned up once the generator is exhausted. Only the batch being filled is
+        held in memory: the reported evaluations are returned as lambda_handler() always did with
+        keep_evaluations, otherwise their counts {'latest_evaluations': ..., 'stale_evaluations': ...}.
+
+        Keyword arguments:
+        evaluations -- the generator returned by evaluate_compliance()
+        event -- the event variable given in the lambda handler
+        keep_evaluations -- whether to return the reported evaluations, e.g. for the RDK tests (default True)
+        """
+        flusher = self.build_flusher(event)
+        latest_evaluations = []
+        stale_evaluations = []
+        counts = {'latest_evaluations': 0, 'stale_evaluations': 0}
+        latest_resource_keys = set()
+        batch = []
+
+        def add(evaluation, reported_evaluations, count_name):
+            nonlocal batch
+            counts[count_name] += 1
+            if keep_evaluations:
+                reported_evaluations.append(evaluation)
+            batch.append(evaluation)
+            if len(batch) == PUT_EVALUATIONS_BATCH_SIZE:
+                flusher.submit(batch)
+                batch = []
+
+        try:
+            for evaluation in evaluations:
+                if has_required_fields(evaluation):
+                    latest_resource_keys.add(get_resource_key(evaluation))
+                    add(evaluation, latest_evaluations, 'latest_evaluations')
+            if not latest_resource_keys:
+                no_result_evaluation = self.build_evaluation(event['accountId'], "NOT_APPLICABLE", event, resource_type='AWS::::Account')
+                latest_resource_keys.add(get_resource_key(no_result_evaluation))
+                add(no_result_evaluation, latest_evaluations, 'latest_evaluations')
+            for evaluation in get_stale_evaluations(self.config_client, self.get_evaluation_factory(event), latest_resource_keys, event):
+                add(evaluation, stale_evaluations, 'stale_evaluations')
+            if batch:
+                flusher.submit(batch)
+        except Exception:
+            flusher.abort()
+            raise
+
+        report = flusher.finish()
+        log_flusher_report(report)
+        if not keep_evaluations:
+            return counts, report
+        # Same order as clean_up_old_evaluations()
+        return stale_evaluations + latest_evaluations, report
+
+    def build_flusher(self, event):
+        # Put together the request that reports the evaluation status
+        result_token = event['resultToken']
+        test_mode = False
+        if result_token == 'TESTMODE':
+            # Used solely for RDK test to skip actual put_evaluation API call
+            test_mode = True
+        return EvaluationFlusher(self.config_client, result_token, test_mode)
+
+    def put_evaluations(self, evaluations, event):
+        """Report the evaluations to Config Rules and return the totals of the EvaluationFlusher.
+
+        Keyword arguments:
+        evaluations -- the list of evaluations to report
+        event -- the event variable given in the lambda handler
+        """
+        # Invoke the Config API to report the result of the evaluation
+        report = self.build_flusher(event).flush(evaluations)
+        log_flusher_report(report)
+        return report
+
+def is_saving_leader_run(leader_region_mode, invoking_event, event):
+    return leader_region_mode is not None and leader_region_mode.is_leader(event) and invoking_event['messageType'] == 'ScheduledNotification'
+
+def log_flusher_report(report):
+    print("put_evaluations: {evaluations} evaluations in {batches} batches, {calls} calls, {retried} retried, {throttled} throttled, "
+          "{failed} failed, first result after {first_result_seconds}s, {seconds}s".format(failed=len(report['failed_evaluations']), **report))
+
+def is_internal_error(exception):
+    return ((not isinstance(exception, botocore.exceptions.ClientError)) or exception.response['Error']['Code'].startswith('5')
+            or 'InternalError' in exception.response['Error']['Code'] or 'ServiceError' in exception.response['Error']['Code'])
+
+def build_internal_error_response(internal_error_message, internal_error_details=None):
+    return build_error_response(internal_error_message, internal_error_details, 'InternalError', 'InternalError')
+
+def build_error_response(internal_error_message, internal_error_details=None, customer_error_code=None, customer_error_message=None):
+    error_response = {
+        'internalErrorMessage': internal_error_message,
+        'internalErrorDetails': internal_error_details,
+        'customerErrorMessage': customer_error_message,
+        'customerErrorCode': customer_error_code
+    }
+    print(error_response)
+    return error_response
+
+# Build an error to be displayed in the logs when the parameter is invalid.
+def build_parameters_value_error_response(ex):
+    """Return an error dictionary when the evaluate_parameters() raises a ValueError.
+
+    Keyword arguments:
+    ex -- Exception text
+    """
+    return build_error_response(internal_error_message="Parameter value is invalid",
+                                internal_error_details="An ValueError was raised during the validation of the Parameter value",
+                                customer_error_code="InvalidParameterValueException",
+                                customer_error_message=str(ex))
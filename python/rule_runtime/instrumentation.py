@@ -0,0 +1,192 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Accounting of the AWS API calls made during a rule invocation, emitted in CloudWatch Embedded Metric Format.
+
+Set the RULE_RUNTIME_METRICS environment variable of the Lambda function to true to record, per operation,
+the calls, the follow-up pages, the latency (sum, maximum and histogram), the retries, the throttled attempts
+and the errors. A single structured log line is printed at the end of the invocation, which CloudWatch turns
+into metrics of the RULE_RUNTIME_METRICS_NAMESPACE namespace (default ConfigRules) with the rule dimension.
+
+When the variable is not set, the botocore handlers are not even registered on the clients.
+'''
+import json
+import os
+import threading
+import time
+
+from rule_runtime.flusher import THROTTLING_ERROR_CODES
+
+METRICS_ENABLED_VARIABLE = 'RULE_RUNTIME_METRICS'
+METRICS_NAMESPACE_VARIABLE = 'RULE_RUNTIME_METRICS_NAMESPACE'
+DEFAULT_METRICS_NAMESPACE = 'ConfigRules'
+
+# Upper bounds of the latency histogram, in milliseconds. The slower calls are counted in the '+Inf' bucket.
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# CloudWatch accepts at most 100 metrics per directive of an Embedded Metric Format document.
+EMF_MAX_METRICS_PER_DIRECTIVE = 100
+
+# A call sending one of these parameters requests a follow-up page (see rule_runtime.pagination).
+PAGINATION_TOKENS = ('NextToken', 'nextToken', 'Marker', 'position', 'PaginationToken')
+
+# The recorder of the invocation in progress, None outside of an instrumented invocation.
+CURRENT_RECORDER = None
+
+def is_metrics_enabled():
+    return os.environ.get(METRICS_ENABLED_VARIABLE, '').lower() in ('1', 'true', 'yes')
+
+def get_operation_name(operation_model):
+    return '{}.{}'.format(operation_model.service_model.service_name, operation_model.name)
+
+def build_operation_stats():
+    return {'Calls': 0, 'Pages': 0, 'Retries': 0, 'Throttles': 0, 'Errors': 0, 'LatencySum': 0.0, 'LatencyMax': 0.0,
+            'LatencyHistogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+class ApiCallRecorder():
+    """Aggregate the API calls of an invocation per operation (e.g. 'iam.ListAccessKeys'), from any thread.
+
+    Keyword arguments:
+    rule_name -- the value of the Rule dimension, usually the name of the rule module
+    config_rule_name -- the name of the Config rule, logged as a property (default None)
+    """
+    def __init__(self, rule_name, config_rule_name=None):
+        self.rule_name = rule_name
+        self.config_rule_name = config_rule_name
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def get_stats(self, operation):
+        if operation not in self.operations:
+            self.operations[operation] = build_operation_stats()
+        return self.operations[operation]
+
+    def record_call(self, operation, latency_ms, next_page=False, retries=0, error=False):
+        """Record a call, i.e. all its attempts.
+
+        Keyword arguments:
+        operation -- the 'service.Operation' name
+        latency_ms -- the duration of the call, the retries included
+        next_page -- True if the call requested a follow-up page (default False)
+        retries -- the number of attempts after the first one (default 0)
+        error -- True if the call eventually failed (default False)
+        """
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                bucket = index
+                break
+        with self.lock:
+            stats = self.get_stats(operation)
+            stats['Calls'] += 1
+            stats['Pages'] += 1 if next_page else 0
+            stats['Retries'] += retries
+            stats['Errors'] += 1 if error else 0
+            stats['LatencySum'] += latency_ms
+            stats['LatencyMax'] = max(stats['LatencyMax'], latency_ms)
+            stats['LatencyHistogram'][bucket] += 1
+
+    def record_throttle(self, operation):
+        with self.lock:
+            self.get_stats(operation)['Throttles'] += 1
+
+    def build_log_entry(self, namespace=DEFAULT_METRICS_NAMESPACE, timestamp=None):
+        """Return the Embedded Metric Format document of the invocation.
+
+        Every operation contributes the <operation>.Calls, .Pages, .Retries, .Throttles, .Errors, .LatencySum and
+        .LatencyMax metrics, and the ApiCalls property holds the detail of the calls with the latency histograms.
+        """
+        with self.lock:
+            operations = {operation: dict(stats, LatencyHistogram=list(stats['LatencyHistogram']))
+                          for operation, stats in self.operations.items()}
+        bucket_names = ['le_{}'.format(bound) for bound in LATENCY_BUCKETS_MS] + ['+Inf']
+        log_entry = {'Rule': self.rule_name, 'ConfigRuleName': self.config_rule_name, 'ApiCalls': {}}
+        metrics = []
+        for operation in sorted(operations):
+            stats = operations[operation]
+            for name in ['Calls', 'Pages', 'Retries', 'Throttles', 'Errors']:
+                metrics.append({'Name': '{}.{}'.format(operation, name), 'Unit': 'Count'})
+                log_entry['{}.{}'.format(operation, name)] = stats[name]
+            for name in ['LatencySum', 'LatencyMax']:
+                metrics.append({'Name': '{}.{}'.format(operation, name), 'Unit': 'Milliseconds'})
+                log_entry['{}.{}'.format(operation, name)] = round(stats[name], 3)
+            log_entry['ApiCalls'][operation] = dict(stats, LatencySum=round(stats['LatencySum'], 3), LatencyMax=round(stats['LatencyMax'], 3),
+                                                    LatencyHistogram=dict(zip(bucket_names, stats['LatencyHistogram'])))
+        log_entry['_aws'] = {
+            'Timestamp': int((timestamp if timestamp is not None else time.time()) * 1000),
+            'CloudWatchMetrics': [{'Namespace': namespace, 'Dimensions': [['Rule']], 'Metrics': metrics[start:start + EMF_MAX_METRICS_PER_DIRECTIVE]}
+                                  for start in range(0, len(metrics), EMF_MAX_METRICS_PER_DIRECTIVE)]
+        }
+        return log_entry
+
+def before_parameter_build(model=None, params=None, context=None, **kwargs):
+    # botocore handler of 'before-parameter-build', emitted once per API call before anything else is done.
+    if CURRENT_RECORDER is None or context is None:
+        return None
+    context['rule_runtime_call_start'] = time.perf_counter()
+    context['rule_runtime_operation'] = get_operation_name(model) if model is not None else 'unknown'
+    context['rule_runtime_next_page'] = any(token in (params or {}) for token in PAGINATION_TOKENS)
+    return None
+
+def after_call(parsed=None, context=None, **kwargs):
+    # botocore handler of 'after-call', emitted once per API call with the last response, an error one included.
+    record_call(context, parsed or {})
+
+def after_call_error(context=None, **kwargs):
+    # botocore handler of 'after-call-error', emitted when a call fails without any response (e.g. connection error).
+    record_call(context, None)
+
+def record_call(context, parsed):
+    recorder = CURRENT_RECORDER
+    if recorder is None or not context or 'rule_runtime_call_start' not in context:
+        return
+    start = context.pop('rule_runtime_call_start')
+    operation = context.get('rule_runtime_operation', 'unknown')
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if parsed is not None else 0
+    error = parsed is None or 'Error' in parsed
+    recorder.record_call(operation, (time.perf_counter() - start) * 1000, context.get('rule_runtime_next_page', False), retries, error)
+
+def needs_retry(response=None, operation=None, **kwargs):
+    # botocore handler of 'needs-retry', emitted after every attempt. Returning None leaves the retry decision to botocore.
+    recorder = CURRENT_RECORDER
+    if recorder is None or response is None or operation is None:
+        return None
+    if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        recorder.record_throttle(get_operation_name(operation))
+    return None
+
+def install_instrumentation(client):
+    """Register the accounting handlers on a boto client when RULE_RUNTIME_METRICS is set, and return the client."""
+    if not is_metrics_enabled():
+        return client
+    events = client.meta.events
+    events.register('before-parameter-build', before_parameter_build, unique_id='rule-runtime-metrics-before-parameter-build')
+    events.register('after-call', after_call, unique_id='rule-runtime-metrics-after-call')
+    events.register('after-call-error', after_call_error, unique_id='rule-runtime-metrics-after-call-error')
+    events.register('needs-retry', needs_retry, unique_id='rule-runtime-metrics-needs-retry')
+    return client
+
+def start_recording(rule_name, event):
+    """Start accounting the API calls of an invocation, and return its recorder (None when disabled).
+
+    Keyword arguments:
+    rule_name -- the value of the Rule dimension
+    event -- the event variable given in the lambda handler
+    """
+    global CURRENT_RECORDER
+    if not is_metrics_enabled():
+        return None
+    CURRENT_RECORDER = ApiCallRecorder(rule_name, event.get('configRuleName') if isinstance(event, dict) else None)
+    return CURRENT_RECORDER
+
+def stop_recording(recorder):
+    """Stop the accounting started by start_recording() and print its Embedded Metric Format log line."""
+    global CURRENT_RECORDER
+    if recorder is None:
+        return None
+    if CURRENT_RECORDER is recorder:
+        CURRENT_RECORDER = None
+    log_entry = recorder.build_log_entry(os.environ.get(METRICS_NAMESPACE_VARIABLE, DEFAULT_METRICS_NAMESPACE))
+    print(json.dumps(log_entry))
+    return log_entry
@@ -0,0 +1,60 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Sets of IPv4 and IPv6 networks answering whether a network is included in them by binary search.
+
+A rule checking the source IPs of a policy against a whitelist (e.g. API_GW_RESTRICTED_IP) compares every network
+of the policy with every whitelisted network. IpNetworkSet collapses the whitelist once per IP version into sorted,
+non-overlapping ranges of integers: a network is included when the range starting at or before its first address
+also covers its last one, i.e. O(log n) per network whatever the size of the whitelist.
+
+The networks are the union of the whitelist, e.g. 10.0.0.0/25,10.0.0.128/25 includes 10.0.0.0/24.
+'''
+import bisect
+import ipaddress
+
+class IpNetworkSet():
+    """The union of IP networks.
+
+    Keyword arguments:
+    networks -- an iterable of networks or addresses, e.g. '10.0.0.0/8' or '192.168.1.1', as strings or ipaddress
+                objects. The host bits are ignored (e.g. 10.1.1.1/24 is 10.1.1.0/24).
+    """
+    __slots__ = ('ranges',)
+
+    def __init__(self, networks):
+        networks_by_version = {4: [], 6: []}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            networks_by_version[network.version].append(network)
+        # version: (sorted first addresses, last addresses), as integers.
+        self.ranges = {}
+        for version, version_networks in networks_by_version.items():
+            firsts = []
+            lasts = []
+            for network in ipaddress.collapse_addresses(version_networks):
+                first, last = int(network.network_address), int(network.broadcast_address)
+                if lasts and first <= lasts[-1] + 1:
+                    lasts[-1] = max(lasts[-1], last)
+                else:
+                    firsts.append(first)
+                    lasts.append(last)
+            self.ranges[version] = (firsts, lasts)
+
+    def includes(self, network):
+        """Return whether every address of a network (a string or an ipaddress object) is in the set."""
+        network = ipaddress.ip_network(network, strict=False)
+        firsts, lasts = self.ranges[network.version]
+        index = bisect.bisect_right(firsts, int(network.network_address)) - 1
+        return index >= 0 and int(network.broadcast_address) <= lasts[index]
+
+    def __iter__(self):
+        # The smallest list of networks covering the set, IPv4 first.
+        for version, address_class in [(4, ipaddress.IPv4Address), (6, ipaddress.IPv6Address)]:
+            for first, last in zip(*self.ranges[version]):
+                for network in ipaddress.summarize_address_range(address_class(first), address_class(last)):
+                    yield network
+
+    def __len__(self):
+        return sum(len(firsts) for firsts, _ in self.ranges.values())
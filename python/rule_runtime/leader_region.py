@@ -0,0 +1,202 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Evaluate the global resources (e.g. IAM) in a single region of the account.
+
+A rule on global resources deployed in every enabled region lists the same resources and reports the same
+evaluations in each of them. With the reserved RuleRuntimeLeaderRegion rule parameter (e.g. us-east-1), only the
+invocations of that region call evaluate_compliance(). The invocations of the other regions (the followers):
+
+  - without RuleRuntimeResultStore, report NOT_APPLICABLE on the account, the resources being evaluated by the
+    rule of the leader region
+  - with RuleRuntimeResultStore, report the COMPLIANT and NON_COMPLIANT evaluations persisted by the last run of
+    the leader region, with their own OrderingTimestamp. Until the leader ran, they report NOT_APPLICABLE on the
+    account.
+
+The results are saved with their time. They are replayed for two periods of the leader (RuleRuntimeLeaderPeriod,
+the MaximumExecutionFrequency of the rule, TwentyFour_Hours by default), i.e. one missed run: past this age, e.g.
+when the leader is disabled or keeps failing, the followers report NOT_APPLICABLE on the account.
+
+The store is either a local directory (a path or file:///tmp/results), e.g. on a file system shared by the
+functions or as a stand-in in the tests, or an S3 location (s3://bucket/prefix) read and written with the s3
+client of get_client(). The evaluations are kept in one JSON object per account and rule name. The store is best
+effort: an error is printed and the follower falls back on NOT_APPLICABLE.
+
+The region of an invocation is read from the ARN of the Config rule, or AWS_REGION.
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+import botocore.exceptions
+
+LEADER_REGION_PARAMETER = 'RuleRuntimeLeaderRegion'
+RESULT_STORE_PARAMETER = 'RuleRuntimeResultStore'
+LEADER_PERIOD_PARAMETER = 'RuleRuntimeLeaderPeriod'
+
+# The MaximumExecutionFrequency values of Config, in seconds.
+EXECUTION_FREQUENCIES = {'One_Hour': 3600, 'Three_Hours': 3 * 3600, 'Six_Hours': 6 * 3600, 'Twelve_Hours': 12 * 3600,
+                         'TwentyFour_Hours': 24 * 3600}
+DEFAULT_LEADER_PERIOD = 'TwentyFour_Hours'
+# The results of the leader are replayed for this number of its periods.
+RESULT_MAX_AGE_PERIODS = 2
+
+# Only the results of the resources are replayed, the stale evaluations being cleaned up in every region.
+PERSISTED_COMPLIANCE_TYPES = ('COMPLIANT', 'NON_COMPLIANT')
+PERSISTED_FIELDS = ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'Annotation')
+
+def get_invocation_region(event):
+    """Return the region of the invocation, e.g. 'eu-west-1' from arn:aws:config:eu-west-1:123456789012:config-rule/..."""
+    arn_fields = event.get('configRuleArn', '').split(':')
+    if len(arn_fields) > 3 and arn_fields[3]:
+        return arn_fields[3]
+    return os.environ.get('AWS_REGION')
+
+def get_result_key(event):
+    # The rule name is hashed, it may contain characters not allowed in a file name.
+    return '{}/{}.json'.format(event['accountId'], hashlib.sha256(event['configRuleName'].encode('utf-8')).hexdigest())
+
+class FileResultStore():
+    """The persisted results in a local directory.
+
+    Keyword arguments:
+    directory -- the root directory of the results
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.directory, key), encoding='utf-8') as result_file:
+                return json.load(result_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, key, result):
+        # The file is replaced atomically, a follower reads either run.
+        path = os.path.join(self.directory, key)
+        temporary_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary_path, 'w', encoding='utf-8') as result_file:
+            json.dump(result, result_file)
+        os.replace(temporary_path, path)
+
+class S3ResultStore():
+    """The persisted results in S3, or any service with the GetObject and PutObject API of S3.
+
+    Keyword arguments:
+    s3_client -- the S3 boto client
+    bucket -- the bucket name
+    prefix -- the prefix of the keys, e.g. 'config-results/' (default '')
+    """
+    def __init__(self, s3_client, bucket, prefix=''):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def load(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def save(self, key, result):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=json.dumps(result).encode('utf-8'),
+                                  ContentType='application/json')
+
+def build_result_store(location, get_client, event):
+    """Return the store of a RuleRuntimeResultStore value, e.g. 's3://bucket/prefix' or '/tmp/results'.
+
+    Keyword arguments:
+    location -- the value of the rule parameter
+    get_client -- the get_client() of the runtime, called for the s3 client
+    event -- the event variable given in the lambda handler
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return S3ResultStore(get_client('s3', event), bucket, prefix)
+    if location.startswith('file://'):
+        location = location[len('file://'):]
+    return FileResultStore(location)
+
+class LeaderRegionMode():
+    """The leader region of a rule on global resources, and the store of its results.
+
+    Keyword arguments:
+    leader_region -- the region evaluating the resources, e.g. 'us-east-1'
+    result_store_location -- the RuleRuntimeResultStore value, None to only report NOT_APPLICABLE in the other regions
+    leader_period -- the MaximumExecutionFrequency of the periodic runs of the leader (default 'TwentyFour_Hours')
+    """
+    def __init__(self, leader_region, result_store_location=None, leader_period=DEFAULT_LEADER_PERIOD):
+        self.leader_region = leader_region
+        self.result_store_location = result_store_location
+        self.result_max_age = RESULT_MAX_AGE_PERIODS * EXECUTION_FREQUENCIES[leader_period]
+
+    def is_leader(self, event):
+        return get_invocation_region(event) == self.leader_region
+
+    def get_result_store(self, get_client, event):
+        if not self.result_store_location:
+            return None
+        return build_result_store(self.result_store_location, get_client, event)
+
+    def save_evaluations(self, evaluations, get_client, event):
+        """Persist the COMPLIANT and NON_COMPLIANT evaluations reported by the leader region."""
+        try:
+            store = self.get_result_store(get_client, event)
+            if store is None:
+                return
+            store.save(get_result_key(event), {
+                'Region': get_invocation_region(event),
+                # In seconds since the epoch.
+                'SavedAt': time.time(),
+                'Evaluations': [{field: evaluation[field] for field in PERSISTED_FIELDS if field in evaluation}
+                                for evaluation in evaluations if evaluation['ComplianceType'] in PERSISTED_COMPLIANCE_TYPES]})
+        except (botocore.exceptions.ClientError, IOError, OSError, TypeError, ValueError) as ex:
+            print('Unable to save the results of the leader region {}: {}'.format(self.leader_region, ex))
+
+    def load_evaluations(self, get_client, event):
+        """Return the evaluations persisted by the leader region, as a list of dictionaries without OrderingTimestamp,
+        or None when there are none or they are older than two periods of the leader."""
+        try:
+            store = self.get_result_store(get_client, event)
+            result = store.load(get_result_key(event)) if store is not None else None
+        except (botocore.exceptions.ClientError, IOError, OSError, ValueError) as ex:
+            print('Unable to load the results of the leader region {}: {}'.format(self.leader_region, ex))
+            return None
+        if result is None:
+            return None
+        # The results saved without their time are as stale as the oldest ones.
+        saved_at = result.get('SavedAt')
+        if not isinstance(saved_at, (int, float)) or time.time() - saved_at > self.result_max_age:
+            print('The results of the leader region {} are older than {} seconds, not reused'.format(self.leader_region, self.result_max_age))
+            return None
+        return result.get('Evaluations', [])
+
+def get_leader_region_mode(rule_parameters):
+    """Return the LeaderRegionMode requested by the rule parameters, None when disabled.
+
+    The reserved rule parameters are removed from rule_parameters. Raise a ValueError for an unknown
+    RuleRuntimeLeaderPeriod.
+
+    Keyword arguments:
+    rule_parameters -- the dictionary of the rule parameters
+    """
+    # Some tests send ruleParameters encoded twice, i.e. a string rather than a dictionary.
+    if not isinstance(rule_parameters, dict):
+        return None
+    leader_region = str(rule_parameters.pop(LEADER_REGION_PARAMETER, '') or '').strip()
+    result_store_location = str(rule_parameters.pop(RESULT_STORE_PARAMETER, '') or '').strip()
+    leader_period = str(rule_parameters.pop(LEADER_PERIOD_PARAMETER, '') or '').strip() or DEFAULT_LEADER_PERIOD
+    if not leader_region:
+        return None
+    if leader_period not in EXECUTION_FREQUENCIES:
+        raise ValueError('The parameter {} must be one of {}.'.format(LEADER_PERIOD_PARAMETER, ', '.join(sorted(EXECUTION_FREQUENCIES))))
+    return LeaderRegionMode(leader_region, result_store_location or None, leader_period)
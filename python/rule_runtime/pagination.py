@@ -0,0 +1,77 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Lazy pagination of the List/Describe/Get APIs, whatever their pagination token.
+
+The token is sent in the input_token request parameter and read from the output_token response field
+(it defaults to input_token):
+
+  NextToken            most of the APIs (e.g. ec2, sns, cloudtrail, guardduty)
+  nextToken            logs
+  position             apigateway
+  Marker               iam, elasticache, emr
+  Marker / NextMarker  elbv2, lambda, kms, efs
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+def get_next_token(response, output_token):
+    """Return the token of the next page, or None on the last page.
+
+    An IsTruncated (iam) or Truncated (kms) field set to False ends the pagination, as does a missing or empty token.
+    """
+    for truncated_field in ('IsTruncated', 'Truncated'):
+        if truncated_field in response and not response[truncated_field]:
+            return None
+    if output_token in response and response[output_token]:
+        return response[output_token]
+    return None
+
+def iter_pages(operation, input_token='NextToken', output_token=None, prefetch=True, **kwargs):
+    """Yield the responses of a paginated API call, page by page.
+
+    The next page is requested in the background while the caller processes the current one. Closing the
+    generator early (e.g. a break in the caller) does not wait for the page in flight.
+
+    Keyword arguments:
+    operation -- the client method, e.g. iam_client.list_users
+    input_token -- the request parameter of the pagination token (default 'NextToken')
+    output_token -- the response field of the pagination token (default input_token)
+    prefetch -- False to request the next page only once the current one is processed (default True)
+    kwargs -- the other parameters of the request, sent with every page
+    """
+    output_token = output_token or input_token
+    executor = None
+    try:
+        response = operation(**kwargs)
+        while True:
+            next_token = get_next_token(response, output_token)
+            if next_token is None:
+                yield response
+                return
+            request = dict(kwargs)
+            request[input_token] = next_token
+            if prefetch:
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers=1)
+                next_response = executor.submit(operation, **request)
+                yield response
+                response = next_response.result()
+            else:
+                yield response
+                response = operation(**request)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+def paginate(operation, result_key, input_token='NextToken', output_token=None, prefetch=True, **kwargs):
+    """Yield the items of a paginated API call, e.g. paginate(iam_client.list_users, 'Users', 'Marker').
+
+    Keyword arguments:
+    operation -- the client method
+    result_key -- the response field holding the list of items of a page
+    input_token, output_token, prefetch, kwargs -- as in iter_pages()
+    """
+    for page in iter_pages(operation, input_token, output_token, prefetch, **kwargs):
+        for item in page.get(result_key, []):
+            yield item
@@ -0,0 +1,167 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Compilation of the IAM policy documents into statements that the rules query without walking the JSON again.
+
+compile_policy() normalizes a document once: Statement, Action, NotAction, Resource, NotResource and the condition
+values are always tuples (a single string or a single statement is accepted, as IAM does) and the condition keys
+are lowercased (IAM compares them case-insensitively). The action and resource patterns are compiled into matchers
+on their first use, so that the policies only checked for a full star do not pay for them. The compiled policy is not modified afterwards, so it can be cached with the policy version it was compiled
+from (see rule_runtime.get_compiled_policy()).
+'''
+import re
+
+SOURCE_IP_KEY = 'aws:sourceip'
+
+def to_tuple(value):
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return (value,)
+
+class PatternMatcher():
+    """Match a value against IAM patterns, where * is any sequence of characters and ? any single character.
+
+    The patterns without wildcard are looked up in a set, the others are joined in a single regular expression.
+
+    Keyword arguments:
+    patterns -- the patterns, e.g. the Action of a statement
+    ignore_case -- True for the actions, which IAM compares case-insensitively (default False)
+    """
+    __slots__ = ('ignore_case', 'exact', 'expression', 'matches_all')
+
+    def __init__(self, patterns, ignore_case=False):
+        self.ignore_case = ignore_case
+        patterns = [pattern.lower() if ignore_case else pattern for pattern in patterns if isinstance(pattern, str)]
+        self.matches_all = '*' in patterns
+        self.exact = frozenset(pattern for pattern in patterns if '*' not in pattern and '?' not in pattern)
+        wildcards = [pattern for pattern in patterns if pattern not in self.exact]
+        self.expression = None
+        if wildcards and not self.matches_all:
+            self.expression = re.compile('|'.join(re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.') for pattern in wildcards) + r'\Z',
+                                         re.DOTALL)
+
+    def match(self, value):
+        if self.matches_all:
+            return True
+        if self.ignore_case:
+            value = value.lower()
+        return value in self.exact or (self.expression is not None and self.expression.match(value) is not None)
+
+class CompiledStatement():
+    """A normalized statement of a policy document.
+
+    Keyword arguments:
+    statement -- the statement dictionary of the document
+    """
+    __slots__ = ('source', 'sid', 'effect', 'actions', 'not_actions', 'resources', 'not_resources', 'conditions',
+                 'compiled_action_matcher', 'compiled_resource_matcher')
+
+    def __init__(self, statement):
+        # The source is kept for the checks the compiled form does not cover.
+        self.source = statement
+        self.sid = statement.get('Sid')
+        self.effect = statement.get('Effect')
+        self.actions = to_tuple(statement.get('Action'))
+        self.not_actions = to_tuple(statement.get('NotAction'))
+        self.resources = to_tuple(statement.get('Resource'))
+        self.not_resources = to_tuple(statement.get('NotResource'))
+        self.conditions = {}
+        condition = statement.get('Condition')
+        if isinstance(condition, dict):
+            for operator, values in condition.items():
+                if isinstance(values, dict):
+                    self.conditions[operator] = {key.lower(): to_tuple(value) for key, value in values.items()}
+        self.compiled_action_matcher = None
+        self.compiled_resource_matcher = None
+
+    @property
+    def action_matcher(self):
+        if self.compiled_action_matcher is None:
+            self.compiled_action_matcher = PatternMatcher(self.actions or self.not_actions, ignore_case=True)
+        return self.compiled_action_matcher
+
+    @property
+    def resource_matcher(self):
+        if self.compiled_resource_matcher is None:
+            self.compiled_resource_matcher = PatternMatcher(self.resources or self.not_resources)
+        return self.compiled_resource_matcher
+
+    def is_allow(self):
+        return self.effect == 'Allow'
+
+    def is_deny(self):
+        return self.effect == 'Deny'
+
+    def matches_action(self, action):
+        """Return True if the statement applies to the action, e.g. 's3:GetObject', through Action or NotAction."""
+        if self.actions:
+            return self.action_matcher.match(action)
+        if self.not_actions:
+            return not self.action_matcher.match(action)
+        return False
+
+    def matches_resource(self, resource):
+        """Return True if the statement applies to the resource ARN, through Resource or NotResource."""
+        if self.resources:
+            return self.resource_matcher.match(resource)
+        if self.not_resources:
+            return not self.resource_matcher.match(resource)
+        return False
+
+    def get_condition_values(self, operator, key):
+        """Return the values of a condition, e.g. get_condition_values('IpAddress', 'aws:SourceIp'), None when it is missing."""
+        return self.conditions.get(operator, {}).get(key.lower())
+
+    def get_source_ips(self, operator):
+        """Return the aws:SourceIp values of an IP operator, either plain or with the ForAnyValue: qualifier, or None."""
+        values = self.get_condition_values(operator, SOURCE_IP_KEY)
+        if values is None:
+            values = self.get_condition_values('ForAnyValue:' + operator, SOURCE_IP_KEY)
+        return values
+
+class CompiledPolicy():
+    """The compiled statements of a policy document.
+
+    Keyword arguments:
+    document -- the policy document dictionary, its Statement being a statement or a list of statements
+    """
+    __slots__ = ('statements', 'full_star_allow')
+
+    def __init__(self, document):
+        statements = document.get('Statement') if isinstance(document, dict) else None
+        if isinstance(statements, dict):
+            statements = [statements]
+        elif not isinstance(statements, list):
+            statements = []
+        self.statements = tuple(CompiledStatement(statement) for statement in statements if isinstance(statement, dict))
+        self.full_star_allow = any(not statement.is_deny() and '*' in statement.actions for statement in self.statements)
+
+    def has_full_star_allow(self):
+        """Return True if a statement which is not a Deny has "*" in its Action."""
+        return self.full_star_allow
+
+    def allows_action(self, action, resource=None):
+        """Return True if the policy may allow the action, on the resource ARN when given.
+
+        The conditions are not evaluated: an Allow statement applies whatever its conditions and a Deny statement
+        only applies without condition. Without resource, only the Deny statements on every resource apply.
+        """
+        allowed = False
+        for statement in self.statements:
+            if not statement.matches_action(action):
+                continue
+            if statement.is_deny() and not statement.conditions:
+                if resource is None and statement.resources and statement.resource_matcher.matches_all:
+                    return False
+                if resource is not None and statement.matches_resource(resource):
+                    return False
+            elif statement.is_allow() and (resource is None or statement.matches_resource(resource)):
+                allowed = True
+        return allowed
+
+def compile_policy(document):
+    """Return the CompiledPolicy of a policy document dictionary."""
+    return CompiledPolicy(document)
@@ -0,0 +1,200 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Cache of the managed policy documents, shared by the IAM rules and kept across warm invocations.
+
+get_policy_document() still calls get_policy for the default version of the policy, but only calls
+get_policy_version when that version is not cached. An entry is keyed by the policy ARN and holds a single
+version: a new default version replaces the previous one.
+
+The cache is bounded to RULE_RUNTIME_POLICY_CACHE_SIZE customer managed policies (default 1000), the least
+recently used being evicted first. The AWS managed policies (arn:aws:iam::aws:policy/...) are the same in
+every account and are pinned, they are never evicted. With RULE_RUNTIME_POLICY_CACHE_DIR set (e.g. /tmp/policies),
+the documents are also written in that directory and read back after an eviction or by a new process in a
+container that kept its /tmp. The hit rate of the invocation is printed at its end.
+
+get_compiled_policy() returns the document compiled by rule_runtime.policy_compiler, which is cached along with
+the document it was compiled from.
+'''
+import collections
+import hashlib
+import json
+import os
+import threading
+
+from rule_runtime.policy_compiler import compile_policy
+
+POLICY_CACHE_SIZE_VARIABLE = 'RULE_RUNTIME_POLICY_CACHE_SIZE'
+POLICY_CACHE_DIR_VARIABLE = 'RULE_RUNTIME_POLICY_CACHE_DIR'
+DEFAULT_POLICY_CACHE_SIZE = 1000
+
+# The ARNs of the AWS managed policies, in any partition (e.g. arn:aws-cn:iam::aws:policy/ReadOnlyAccess).
+AWS_MANAGED_POLICY_MARKER = ':iam::aws:policy/'
+
+# The cache of the Lambda container, built on first use.
+POLICY_DOCUMENT_CACHE = None
+
+def is_aws_managed_policy(policy_arn):
+    return AWS_MANAGED_POLICY_MARKER in policy_arn
+
+class PolicyDocumentCache():
+    """LRU cache of the default version of the managed policies, by ARN.
+
+    Keyword arguments:
+    max_size -- the maximum number of customer managed policies kept in memory
+    directory -- the directory of the on-disk tier, None to keep the documents in memory only (default None)
+    """
+    def __init__(self, max_size, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self.pinned = {}
+        self.entries = collections.OrderedDict()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+    def get(self, policy_arn, version_id):
+        """Return the cached document of this version of the policy, or None."""
+        with self.lock:
+            entries = self.pinned if is_aws_managed_policy(policy_arn) else self.entries
+            entry = entries.get(policy_arn)
+            if entry is not None and entry['VersionId'] == version_id:
+                if entries is self.entries:
+                    self.entries.move_to_end(policy_arn)
+                self.stats['hits'] += 1
+                return entry['Document']
+        document = self.read(policy_arn, version_id)
+        with self.lock:
+            if document is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+            self.add(policy_arn, version_id, document)
+        return document
+
+    def put(self, policy_arn, version_id, document):
+        """Cache the document of this version of the policy, in place of any other version."""
+        with self.lock:
+            self.add(policy_arn, version_id, document)
+        self.write(policy_arn, version_id, document)
+
+    def get_compiled(self, policy_arn, version_id, document):
+        """Return the compiled document of this version of the policy, compiled on the first call."""
+        with self.lock:
+            entry = (self.pinned if is_aws_managed_policy(policy_arn) else self.entries).get(policy_arn)
+            if entry is not None and entry['VersionId'] == version_id and entry['Compiled'] is not None:
+                return entry['Compiled']
+        compiled = compile_policy(document)
+        with self.lock:
+            entry = (self.pinned if is_aws_managed_policy(policy_arn) else self.entries).get(policy_arn)
+            if entry is not None and entry['VersionId'] == version_id:
+                entry['Compiled'] = compiled
+        return compiled
+
+    def add(self, policy_arn, version_id, document):
+        entry = {'VersionId': version_id, 'Document': document, 'Compiled': None}
+        if is_aws_managed_policy(policy_arn):
+            self.pinned[policy_arn] = entry
+            return
+        self.entries[policy_arn] = entry
+        self.entries.move_to_end(policy_arn)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def get_path(self, policy_arn):
+        return os.path.join(self.directory, hashlib.sha256(policy_arn.encode('utf-8')).hexdigest() + '.json')
+
+    def read(self, policy_arn, version_id):
+        if not self.directory:
+            return None
+        try:
+            with open(self.get_path(policy_arn), encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('PolicyArn') != policy_arn or entry.get('VersionId') != version_id:
+            return None
+        return entry.get('Document')
+
+    def write(self, policy_arn, version_id, document):
+        # The file is replaced atomically, a concurrent reader sees either version. The disk tier is best effort.
+        if not self.directory:
+            return
+        path = self.get_path(policy_arn)
+        temporary_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+                json.dump({'PolicyArn': policy_arn, 'VersionId': version_id, 'Document': document}, cache_file)
+            os.replace(temporary_path, path)
+        except (IOError, OSError, TypeError, ValueError) as ex:
+            print('Unable to write the policy document cache file {}: {}'.format(path, ex))
+
+    def pop_stats(self):
+        """Return the counters since the last call and the number of cached policies, and reset the counters."""
+        with self.lock:
+            stats = dict(self.stats, size=len(self.entries), pinned=len(self.pinned))
+            for key in self.stats:
+                self.stats[key] = 0
+        return stats
+
+def get_policy_document_cache():
+    """Return the cache of the Lambda container, configured by the environment on first use."""
+    global POLICY_DOCUMENT_CACHE
+    if POLICY_DOCUMENT_CACHE is None:
+        POLICY_DOCUMENT_CACHE = PolicyDocumentCache(int(os.environ.get(POLICY_CACHE_SIZE_VARIABLE, DEFAULT_POLICY_CACHE_SIZE)),
+                                                    os.environ.get(POLICY_CACHE_DIR_VARIABLE) or None)
+    return POLICY_DOCUMENT_CACHE
+
+def reset_policy_document_cache():
+    """Forget the cached documents of the process (i.e. back to a cold start), the on-disk tier is kept."""
+    global POLICY_DOCUMENT_CACHE
+    POLICY_DOCUMENT_CACHE = None
+
+def get_policy_document(iam_client, policy_arn, version_id=None):
+    """Return the document of the default version of a managed policy, from the cache when possible.
+
+    The document is shared by the callers and must not be modified.
+
+    Keyword arguments:
+    iam_client -- the IAM boto client
+    policy_arn -- the ARN of the managed policy
+    version_id -- the default version of the policy when already known, e.g. from list_policies (default None)
+    """
+    if version_id is None:
+        version_id = get_default_version_id(iam_client, policy_arn)
+    cache = get_policy_document_cache()
+    document = cache.get(policy_arn, version_id)
+    if document is None:
+        document = iam_client.get_policy_version(PolicyArn=policy_arn, VersionId=version_id)['PolicyVersion']['Document']
+        cache.put(policy_arn, version_id, document)
+    return document
+
+def get_compiled_policy(iam_client, policy_arn, version_id=None):
+    """Return the CompiledPolicy of the default version of a managed policy, from the cache when possible.
+
+    Keyword arguments:
+    iam_client -- the IAM boto client
+    policy_arn -- the ARN of the managed policy
+    version_id -- the default version of the policy when already known (default None)
+    """
+    if version_id is None:
+        version_id = get_default_version_id(iam_client, policy_arn)
+    document = get_policy_document(iam_client, policy_arn, version_id)
+    return get_policy_document_cache().get_compiled(policy_arn, version_id, document)
+
+def get_default_version_id(iam_client, policy_arn):
+    return iam_client.get_policy(PolicyArn=policy_arn)['Policy']['DefaultVersionId']
+
+def log_policy_cache_report():
+    """Print the hit rate of the cache since the last report, if it was used."""
+    if POLICY_DOCUMENT_CACHE is None:
+        return
+    stats = POLICY_DOCUMENT_CACHE.pop_stats()
+    lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+    if not lookups:
+        return
+    print('policy document cache: {lookups} lookups, {hits} hits, {disk_hits} disk hits, {misses} misses ({hit_rate:.1f}% hit rate), '
+          '{evictions} evicted, {size} cached and {pinned} pinned policies'.format(
+              lookups=lookups, hit_rate=100.0 * (stats['hits'] + stats['disk_hits']) / lookups, **stats))
@@ -0,0 +1,62 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Ranges of ports, and sets of ports answering whether a range is included in them by binary search.
+
+A rule checking the rules of a security group against a list of authorized ranges (e.g. the authorizedTcpPorts
+parameter of VPC_SG_OPEN_ONLY_TO_AUTHORIZED_PORTS) scans the whole list for every rule. PortIntervals merges the
+ranges once into sorted, non-overlapping intervals: a range is included when the interval starting at or before
+its first port also covers its last one, i.e. O(log n) per rule whatever the number of authorized ranges.
+
+Overlapping and adjacent ranges are merged, e.g. 80-90,91-100 includes 85-95: every port of it is authorized.
+'''
+import bisect
+import collections
+
+class PortRange(collections.namedtuple('PortRange', ['begin', 'end'])):
+    """An inclusive range of ports, e.g. PortRange(1020, 1025), or PortRange(443) for a single port."""
+    __slots__ = ()
+
+    def __new__(cls, begin, end=None):
+        return super(PortRange, cls).__new__(cls, begin, begin if end is None else end)
+
+    def get_str(self):
+        if self.begin == self.end:
+            return str(self.begin)
+        return '{}-{}'.format(self.begin, self.end)
+
+class PortIntervals():
+    """The union of port ranges, as sorted, non-overlapping intervals.
+
+    Keyword arguments:
+    port_ranges -- an iterable of PortRange, or of (begin, end) tuples, in any order
+    """
+    __slots__ = ('begins', 'ends')
+
+    def __init__(self, port_ranges):
+        self.begins = []
+        self.ends = []
+        for begin, end in sorted(port_ranges):
+            if self.ends and begin <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.begins.append(begin)
+                self.ends.append(end)
+
+    def includes(self, port_range):
+        """Return whether every port of port_range is in the intervals."""
+        index = bisect.bisect_right(self.begins, port_range[0]) - 1
+        return index >= 0 and port_range[1] <= self.ends[index]
+
+    def overlaps(self, port_range):
+        """Return whether any port of port_range is in the intervals."""
+        index = bisect.bisect_right(self.begins, port_range[1]) - 1
+        return index >= 0 and port_range[0] <= self.ends[index]
+
+    def __iter__(self):
+        for begin, end in zip(self.begins, self.ends):
+            yield PortRange(begin, end)
+
+    def __len__(self):
+        return len(self.begins)
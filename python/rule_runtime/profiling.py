@@ -0,0 +1,111 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Opt-in profiling of the evaluation of a rule with cProfile and tracemalloc.
+
+The profiling is switched on by the RULE_RUNTIME_PROFILE environment variable or by the reserved
+RuleRuntimeProfile rule parameter (which is removed before evaluate_parameters() sees it), with one of:
+
+  log   print the functions with the highest cumulative time and the top allocation sites
+  file  also dump the cProfile statistics in RULE_RUNTIME_PROFILE_DIR (default the temporary directory,
+        i.e. /tmp on Lambda) for e.g. python -m pstats or snakeviz
+
+The evaluation covers evaluate_compliance() and, when it is a generator, its consumption while the
+evaluations are streamed. cProfile only sees the calling thread, not the pagination or put_evaluations
+workers; tracemalloc sees all the threads.
+'''
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+
+PROFILE_VARIABLE = 'RULE_RUNTIME_PROFILE'
+PROFILE_DIR_VARIABLE = 'RULE_RUNTIME_PROFILE_DIR'
+PROFILE_PARAMETER = 'RuleRuntimeProfile'
+PROFILE_MODES = ('log', 'file')
+
+# Number of functions and allocation sites printed.
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_TOP_ALLOCATIONS = 15
+
+def get_profile_mode(rule_parameters):
+    """Return the profiling mode requested by the rule parameters or the environment, None when disabled.
+
+    The reserved rule parameter is removed from rule_parameters.
+
+    Keyword arguments:
+    rule_parameters -- the dictionary of the rule parameters
+    """
+    # Some tests send ruleParameters encoded twice, i.e. a string rather than a dictionary.
+    requested_mode = rule_parameters.pop(PROFILE_PARAMETER, None) if isinstance(rule_parameters, dict) else None
+    mode = requested_mode or os.environ.get(PROFILE_VARIABLE)
+    if not mode:
+        return None
+    mode = str(mode).strip().lower()
+    if mode in ('1', 'true', 'yes'):
+        return 'log'
+    return mode if mode in PROFILE_MODES else None
+
+class EvaluationProfiler():
+    """Profile the code run between start() and stop(), then print or dump the results.
+
+    A profiler without mode does nothing, so that the handler does not need to check whether profiling is on.
+
+    Keyword arguments:
+    rule_name -- the name of the rule, used in the logs and the file name
+    mode -- 'log', 'file' or None (default None)
+    """
+    def __init__(self, rule_name, mode=None):
+        self.rule_name = rule_name
+        self.mode = mode
+        self.profile = None
+        self.started_tracemalloc = False
+        self.start_time = None
+        self.report = None
+
+    def start(self):
+        if self.mode is None or self.profile is not None:
+            return
+        # tracemalloc may already be tracing, e.g. in a benchmark: it is then left running.
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+        else:
+            tracemalloc.clear_traces()
+        self.start_time = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """Stop the profiling started by start() and report it. Return the report, None if nothing was profiled."""
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.start_time
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        self.report = self.build_report(elapsed, snapshot, peak)
+        self.profile = None
+        print(self.report)
+        return self.report
+
+    def build_report(self, elapsed, snapshot, peak):
+        lines = ['profile of {}: {:.3f}s, peak of traced memory {:.1f} MiB'.format(self.rule_name, elapsed, peak / 1024.0 / 1024.0)]
+        if self.mode == 'file':
+            path = os.path.join(os.environ.get(PROFILE_DIR_VARIABLE, tempfile.gettempdir()),
+                                '{}-{}.pstats'.format(self.rule_name, time.strftime('%Y%m%dT%H%M%S')))
+            self.profile.dump_stats(path)
+            lines.append('cProfile statistics written to {}'.format(path))
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        lines.append(stream.getvalue().strip())
+        lines.append('top {} allocation sites:'.format(PROFILE_TOP_ALLOCATIONS))
+        for statistic in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]:
+            lines.append(str(statistic))
+        return '\n'.join(lines)
@@ -0,0 +1,178 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Adaptive client-side rate limiting of the AWS API calls made by the rules.
+
+Every attempt of a call (the botocore retries included) takes a token from a bucket shared by the clients
+of the same service, account and region. The refill rate adapts to the throttling responses (AIMD): it is
+halved on a throttling error, at most once per RATE_LIMITER_DECREASE_COOLDOWN_SECONDS, and grows by about
+one call per second for every second of successful calls.
+
+The limiters live as long as the Lambda container, so that warm invocations start at the rate learnt by
+the previous ones.
+'''
+import threading
+import time
+
+from rule_runtime.flusher import THROTTLING_ERROR_CODES
+
+# Calls per second of a new limiter, and the bounds of its adaptive rate.
+RATE_LIMITER_INITIAL_RATE = 40.0
+RATE_LIMITER_MIN_RATE = 0.5
+RATE_LIMITER_MAX_RATE = 100.0
+
+# The rate is multiplied by this factor on throttling...
+RATE_LIMITER_DECREASE_FACTOR = 0.5
+# ... but only once per cooldown, since the calls in flight are throttled together.
+RATE_LIMITER_DECREASE_COOLDOWN_SECONDS = 1.0
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+class AdaptiveRateLimiter():
+    """Thread-safe token bucket whose rate follows the throttling of the API (AIMD).
+
+    The bucket holds at most max(1, rate) tokens, i.e. one second of calls. acquire() reserves a token and
+    sleeps outside of the lock until it is due, so that concurrent callers are spaced by 1 / rate seconds.
+
+    Keyword arguments:
+    name -- the name used in the reports, e.g. 'iam@123456789012'
+    rate -- the initial number of calls per second (default RATE_LIMITER_INITIAL_RATE)
+    min_rate -- the lowest rate reached on throttling (default RATE_LIMITER_MIN_RATE)
+    max_rate -- the highest rate reached without throttling (default RATE_LIMITER_MAX_RATE)
+    """
+    def __init__(self, name, rate=RATE_LIMITER_INITIAL_RATE, min_rate=RATE_LIMITER_MIN_RATE, max_rate=RATE_LIMITER_MAX_RATE):
+        self.name = name
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = max(1.0, self.rate)
+        self.last_refill = time.monotonic()
+        self.last_decrease = None
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """Wait until a call is allowed and return the time waited, in seconds."""
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens -= 1
+            self.calls += 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited_seconds += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def on_throttle(self):
+        """Decrease the rate multiplicatively, and drop the tokens left in the bucket."""
+        with self.lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if self.last_decrease is not None and now - self.last_decrease < RATE_LIMITER_DECREASE_COOLDOWN_SECONDS:
+                return
+            self.refill(now)
+            self.rate = max(self.min_rate, self.rate * RATE_LIMITER_DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_decrease = now
+
+    def on_success(self):
+        """Increase the rate additively: 1 / rate per call, i.e. about 1 call per second every second."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    def before_send(self, **kwargs):
+        # botocore handler of 'before-send', emitted for every attempt. Returning None lets the request go.
+        self.acquire()
+
+    def needs_retry(self, response=None, **kwargs):
+        # botocore handler of 'needs-retry', emitted after every attempt. Returning None leaves the retry
+        # decision to the retry handler of botocore.
+        if response is None:
+            return None
+        error_code = response[1].get('Error', {}).get('Code')
+        if error_code in THROTTLING_ERROR_CODES:
+            self.on_throttle()
+        elif not error_code:
+            self.on_success()
+        return None
+
+    def pop_stats(self):
+        """Return the counters since the last call and reset them. The rate is kept."""
+        with self.lock:
+            stats = {'calls': self.calls, 'throttled': self.throttled, 'waited_seconds': round(self.waited_seconds, 3),
+                     'rate': round(self.rate, 2)}
+            self.calls = 0
+            self.throttled = 0
+            self.waited_seconds = 0.0
+        return stats
+
+def get_rate_limiter(service, account_id=None, region=None):
+    """Return the limiter shared by the clients of a service in an account and a region.
+
+    Keyword arguments:
+    service -- the service name, e.g. 'iam'
+    account_id -- the account the calls are made in (default None)
+    region -- the region of the clients (default None)
+    """
+    key = (service, account_id, region)
+    with RATE_LIMITERS_LOCK:
+        if key not in RATE_LIMITERS:
+            name = '@'.join(str(part) for part in key if part)
+            RATE_LIMITERS[key] = AdaptiveRateLimiter(name)
+        return RATE_LIMITERS[key]
+
+def install_rate_limiter(client, limiter):
+    """Make every attempt of the calls of a boto client wait for a token of the limiter, and return the client.
+
+    Keyword arguments:
+    client -- the boto client
+    limiter -- the AdaptiveRateLimiter, usually from get_rate_limiter()
+    """
+    client.meta.events.register('before-send', limiter.before_send, unique_id='rule-runtime-rate-limiter-before-send')
+    client.meta.events.register('needs-retry', limiter.needs_retry, unique_id='rule-runtime-rate-limiter-needs-retry')
+    return client
+
+def pop_rate_limiter_stats():
+    """Return the counters of the limiters used since the last call, by limiter name, and reset them."""
+    with RATE_LIMITERS_LOCK:
+        limiters = list(RATE_LIMITERS.values())
+    stats = {}
+    for limiter in limiters:
+        limiter_stats = limiter.pop_stats()
+        if limiter_stats['calls']:
+            stats[limiter.name] = limiter_stats
+    return stats
+
+def reset_rate_limiters():
+    """Forget the limiters and their learnt rates (i.e. back to a cold start)."""
+    with RATE_LIMITERS_LOCK:
+        RATE_LIMITERS.clear()
+
+def log_rate_limiter_report():
+    """Print the throttling rate and the latency added by each limiter used since the last report."""
+    for name, stats in sorted(pop_rate_limiter_stats().items()):
+        print("rate limiter {}: {} calls, {} throttled ({:.1%}), {}s added latency, {} calls/s".format(
+            name, stats['calls'], stats['throttled'], stats['throttled'] / stats['calls'], stats['waited_seconds'], stats['rate']))
+
+class RateLimitedClientFactory():
+    """Wrap the ClientFactory of rdklib, so that the clients it builds share the limiters of get_client().
+
+    Keyword arguments:
+    client_factory -- the rdklib ClientFactory given to the evaluate_* methods
+    account_id -- the account the calls are made in, usually event['accountId']
+    """
+    def __init__(self, client_factory, account_id=None):
+        self.client_factory = client_factory
+        self.account_id = account_id
+
+    def build_client(self, service, *args, **kwargs):
+        client = self.client_factory.build_client(service, *args, **kwargs)
+        return install_rate_limiter(client, get_rate_limiter(service, self.account_id, client.meta.region_name))
@@ -0,0 +1,135 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+The configuration items of related resources (e.g. an EC2 instance, its network interfaces, their subnets and
+route tables), loaded by batches from Config and kept for the run.
+
+Walking the relationships one configuration item at a time costs a get_resource_config_history call per hop and
+per evaluated resource, and reads the shared resources (a VPC, its route tables) again for every resource in them.
+ConfigResourceGraph reads the items with rule_runtime.ConfigBatchFetcher and memoizes them, the missing ones
+included. find_paths() walks the graph breadth-first from many resources at once and loads each level with a
+single batch of keys: the number of Config calls depends on the number of distinct resources, by batches of 100,
+and not on the number of resources the paths start from.
+
+The base configuration items of batch_get_resource_config have no relationships. The edges are read from the
+configurations by the caller, e.g. the subnetId of a network interface, or from all the items of a type, e.g. the
+associations of the route tables of get_items_of_type().
+
+The keys Config still left unprocessed after the retries of the fetcher are not resources missing from Config:
+they are kept in unprocessed_keys and read again by the next load(), get() raises a ValueError for them, and
+find_paths() leaves out the items whose walk reached one without finding a target.
+'''
+import json
+
+from rule_runtime.config_batch import ConfigBatchFetcher, build_resource_key, get_key_tuple
+from rule_runtime.pagination import paginate
+
+class ConfigResourceGraph():
+    """The configuration items of an account and region, per (resourceType, resourceId), with their configuration
+    parsed.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    max_workers -- the number of batch_get_resource_config calls in flight (default get_entity_concurrency())
+    """
+    def __init__(self, config_client, max_workers=None):
+        self.config_client = config_client
+        self.fetcher = ConfigBatchFetcher(config_client, max_workers)
+        # (resourceType, resourceId): configuration item, None when Config does not return it (e.g. deleted).
+        self.items = {}
+        # The keys left unprocessed by the last load() which read them, not memoized.
+        self.unprocessed_keys = set()
+        self.resource_ids_of_type = {}
+
+    def add(self, configuration_item):
+        """Add a configuration item, e.g. the one of the invoking event, and return it with its configuration parsed."""
+        if isinstance(configuration_item.get('configuration'), str):
+            configuration_item = dict(configuration_item, configuration=json.loads(configuration_item['configuration']))
+        self.items[(configuration_item['resourceType'], configuration_item['resourceId'])] = configuration_item
+        return configuration_item
+
+    def load(self, resource_keys):
+        """Read the items of the (resourceType, resourceId) keys not loaded yet, in batches."""
+        missing_keys = [key for key in dict.fromkeys(resource_keys) if key not in self.items]
+        if not missing_keys:
+            return
+        # The keys given up by this fetch are the ones appended to the stats of the fetcher.
+        given_up_count = len(self.fetcher.stats['unprocessed_keys'])
+        configuration_items = self.fetcher.fetch(build_resource_key(resource_type, resource_id) for resource_type, resource_id in missing_keys)
+        unprocessed_keys = set(get_key_tuple(resource_key) for resource_key in self.fetcher.stats['unprocessed_keys'][given_up_count:])
+        self.unprocessed_keys.difference_update(missing_keys)
+        self.unprocessed_keys.update(unprocessed_keys)
+        for key in missing_keys:
+            configuration_item = configuration_items.get(key)
+            if configuration_item is not None:
+                self.add(configuration_item)
+            elif key not in unprocessed_keys:
+                self.items[key] = None
+
+    def get(self, resource_type, resource_id):
+        """Return the item of a resource, None when Config does not return it. Raise a ValueError when Config left
+        its key unprocessed."""
+        key = (resource_type, resource_id)
+        self.load([key])
+        if key in self.unprocessed_keys:
+            raise ValueError('{} {} left unprocessed by batch_get_resource_config'.format(resource_type, resource_id))
+        return self.items[key]
+
+    def get_items(self, resource_keys):
+        """Return the items of the (resourceType, resourceId) keys returned by Config, in the order of the keys. The
+        keys left unprocessed are skipped, see unprocessed_keys."""
+        resource_keys = list(resource_keys)
+        self.load(resource_keys)
+        return [self.items[key] for key in dict.fromkeys(resource_keys) if self.items.get(key) is not None]
+
+    def get_items_of_type(self, resource_type):
+        """Return the items of all the resources of a type discovered by Config, listed once per run. The keys left
+        unprocessed are skipped, see unprocessed_keys."""
+        if resource_type not in self.resource_ids_of_type:
+            self.resource_ids_of_type[resource_type] = [resource['resourceId'] for resource in paginate(
+                self.config_client.list_discovered_resources, 'resourceIdentifiers', 'nextToken', resourceType=resource_type)]
+        return self.get_items((resource_type, resource_id) for resource_id in self.resource_ids_of_type[resource_type])
+
+    def find_paths(self, start_items, get_neighbour_keys, is_target):
+        """Return {(resourceType, resourceId) of a start item: the list of the items from it to the first target
+        found breadth-first, None when no target can be reached}. The start items whose walk reached a key left
+        unprocessed, without finding a target, are left out: whether they reach one is unknown.
+
+        Keyword arguments:
+        start_items -- the configuration items the paths start from
+        get_neighbour_keys -- called with the graph and an item, returns the (resourceType, resourceId) keys it leads to
+        is_target -- called with an item, returns whether the path ends there
+        """
+        paths = {}
+        unresolved_start_keys = set()
+        # The paths being extended, with the keys they already went through.
+        frontier = []
+        for item in start_items:
+            start_key = (item['resourceType'], item['resourceId'])
+            paths[start_key] = None
+            frontier.append((start_key, [item], set([start_key])))
+        while frontier:
+            next_steps = []
+            for start_key, path, visited in frontier:
+                if paths[start_key] is not None:
+                    continue
+                if is_target(path[-1]):
+                    paths[start_key] = path
+                    continue
+                for key in get_neighbour_keys(self, path[-1]):
+                    if key not in visited:
+                        next_steps.append((start_key, path, visited, key))
+            # The neighbours of the whole level are read together.
+            self.load(key for _, _, _, key in next_steps)
+            frontier = []
+            for start_key, path, visited, key in next_steps:
+                if key in self.unprocessed_keys:
+                    unresolved_start_keys.add(start_key)
+                elif self.items[key] is not None and paths[start_key] is None:
+                    visited.add(key)
+                    frontier.append((start_key, path + [self.items[key]], visited))
+        for start_key in unresolved_start_keys:
+            if paths[start_key] is None:
+                del paths[start_key]
+        return paths
@@ -0,0 +1,1190 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+import datetime
+import io
+import ipaddress
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+import botocore
+import botocore.session
+from botocore.stub import Stubber
+
+CONFIG_CLIENT_MOCK = MagicMock()
+STS_CLIENT_MOCK = MagicMock()
+EC2_CLIENT_MOCK = MagicMock()
+S3_CLIENT_MOCK = MagicMock()
+DYNAMODB_CLIENT_MOCK = MagicMock()
+
+class Boto3Mock():
+    @staticmethod
+    def client(client_name, *args, **kwargs):
+        if client_name == 'config':
+            return CONFIG_CLIENT_MOCK
+        if client_name == 'sts':
+            return STS_CLIENT_MOCK
+        if client_name == 'ec2':
+            return EC2_CLIENT_MOCK
+        if client_name == 's3':
+            return S3_CLIENT_MOCK
+        if client_name == 'dynamodb':
+            return DYNAMODB_CLIENT_MOCK
+        raise Exception("Attempting to create an unknown client")
+
+sys.modules['boto3'] = Boto3Mock()
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import rule_runtime
+
+def build_rule(evaluate_compliance, evaluate_parameters=lambda rule_parameters: rule_parameters):
+    rule = types.ModuleType('FAKE_RULE')
+    rule.DEFAULT_RESOURCE_TYPE = 'AWS::EC2::Instance'
+    rule.ASSUME_ROLE_MODE = False
+    rule.evaluate_compliance = evaluate_compliance
+    rule.evaluate_parameters = evaluate_parameters
+    rule.RUNTIME = rule_runtime.RuleRuntime(rule)
+    return rule
+
+class LambdaHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG_CLIENT_MOCK.reset_mock()
+        STS_CLIENT_MOCK.reset_mock()
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.return_value = {'EvaluationResults': []}
+
+    def test_evaluations_are_put_by_batches_of_100(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            return [rule.RUNTIME.build_evaluation('i-{}'.format(i), 'COMPLIANT', event) for i in range(250)]
+        rule = build_rule(evaluate_compliance)
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual(250, len(response))
+        batch_sizes = [len(call[1]['Evaluations']) for call in CONFIG_CLIENT_MOCK.put_evaluations.call_args_list]
+        self.assertEqual([100, 100, 50], batch_sizes)
+
+    def test_no_result_reports_not_applicable_on_account(self):
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: None)
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual([('AWS::::Account', '123456789012', 'NOT_APPLICABLE')],
+                         [(evaluation['ComplianceResourceType'], evaluation['ComplianceResourceId'], evaluation['ComplianceType']) for evaluation in response])
+
+    def test_string_result_is_reported_on_configuration_item(self):
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: 'NON_COMPLIANT')
+        response = rule.RUNTIME.lambda_handler(build_lambda_configurationchange_event(), {})
+        self.assertEqual('i-12345678', response[0]['ComplianceResourceId'])
+        self.assertEqual('NON_COMPLIANT', response[0]['ComplianceType'])
+        self.assertEqual('2019-01-01T00:00:00.000Z', response[0]['OrderingTimestamp'])
+
+    def test_oversized_configuration_item_is_fetched(self):
+        CONFIG_CLIENT_MOCK.get_resource_config_history.return_value = {'configurationItems': [{
+            'accountId': '123456789012', 'arn': 'arn', 'configurationItemMD5Hash': '', 'version': '1.3',
+            'configuration': '{"instanceId": "i-12345678"}', 'configurationItemStatus': 'OK',
+            'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-12345678', 'configurationItemCaptureTime': '2019-01-01T00:00:00.000Z'}]}
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: 'COMPLIANT' if configuration_item['configuration']['instanceId'] == 'i-12345678' else 'NON_COMPLIANT')
+        invoking_event = {
+            'messageType': 'OversizedConfigurationItemChangeNotification',
+            'notificationCreationTime': '2019-01-01T00:00:00.000Z',
+            'configurationItemSummary': {'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-12345678', 'configurationItemCaptureTime': '2019-01-01T00:00:00.000Z'}}
+        response = rule.RUNTIME.lambda_handler(build_lambda_event(invoking_event), {})
+        self.assertEqual('COMPLIANT', response[0]['ComplianceType'])
+        CONFIG_CLIENT_MOCK.get_resource_config_history.assert_called_once_with(
+            resourceType='AWS::EC2::Instance', resourceId='i-12345678', laterTime='2019-01-01T00:00:00.000Z', limit=1)
+
+    def test_unreported_evaluations_are_an_internal_error(self):
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: 'NON_COMPLIANT')
+        CONFIG_CLIENT_MOCK.put_evaluations.side_effect = lambda Evaluations, ResultToken, TestMode: {'FailedEvaluations': Evaluations}
+        try:
+            with patch.object(rule_runtime.EvaluationFlusher, 'backoff'):
+                response = rule.RUNTIME.lambda_handler(build_lambda_configurationchange_event(), {})
+        finally:
+            CONFIG_CLIENT_MOCK.put_evaluations.side_effect = None
+        self.assertEqual('InternalError', response['customerErrorCode'])
+        self.assertEqual('Unable to report 1 evaluations', response['internalErrorMessage'])
+
+    def test_message_types(self):
+        invoking_event = json.loads(build_lambda_configurationchange_event()['invokingEvent'])
+        invoking_event['messageType'] = 'SomeType'
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: 'NON_COMPLIANT')
+        response = rule.RUNTIME.lambda_handler(build_lambda_event(invoking_event), {})
+        self.assertEqual('Unexpected message type', response['internalErrorMessage'])
+        # A rule only triggered by configuration changes evaluates the configurationItem whatever the messageType.
+        rule.RUNTIME = rule_runtime.RuleRuntime(rule, message_types=None)
+        response = rule.RUNTIME.lambda_handler(build_lambda_event(invoking_event), {})
+        self.assertEqual([('i-12345678', 'NON_COMPLIANT')], [(evaluation['ComplianceResourceId'], evaluation['ComplianceType']) for evaluation in response])
+
+    def test_invalid_parameters(self):
+        def evaluate_parameters(rule_parameters):
+            raise ValueError('Invalid value for the parameter')
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: 'COMPLIANT', evaluate_parameters)
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual('InvalidParameterValueException', response['customerErrorCode'])
+        self.assertEqual('Invalid value for the parameter', response['customerErrorMessage'])
+
+    def test_customer_error(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'access-denied'}}, 'operation')
+        rule = build_rule(evaluate_compliance)
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual('AccessDenied', response['customerErrorCode'])
+
+    def test_annotation_is_truncated(self):
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: None)
+        evaluation = rule.RUNTIME.build_evaluation('i-12345678', 'NON_COMPLIANT', build_lambda_scheduled_event(), annotation='x' * 300)
+        self.assertEqual(rule_runtime.evaluations.ANNOTATION_MAX_LENGTH, len(evaluation['Annotation']))
+        self.assertTrue(evaluation['Annotation'].endswith(' [truncated]'))
+
+class GetClientTest(unittest.TestCase):
+
+    def setUp(self):
+        STS_CLIENT_MOCK.reset_mock()
+        STS_CLIENT_MOCK.assume_role.return_value = {'Credentials': {'AccessKeyId': 'key', 'SecretAccessKey': 'secret', 'SessionToken': 'token'}}
+
+    def test_assume_role_mode_is_read_on_the_rule(self):
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: None)
+        rule.RUNTIME.get_client('ec2', build_lambda_scheduled_event())
+        STS_CLIENT_MOCK.assume_role.assert_not_called()
+        rule.ASSUME_ROLE_MODE = True
+        rule.RUNTIME.get_client('ec2', build_lambda_scheduled_event())
+        self.assertEqual('arn:aws:iam::123456789012:role/config-role', STS_CLIENT_MOCK.assume_role.call_args[1]['RoleArn'])
+
+    def test_execution_role_name_parameter(self):
+        event = build_lambda_scheduled_event(rule_parameters='{"ExecutionRoleName": "audit-role"}')
+        self.assertEqual('arn:aws:iam::123456789012:role/audit-role', rule_runtime.get_execution_role_arn(event))
+
+    def test_assume_role_access_denied_is_scrubbed(self):
+        STS_CLIENT_MOCK.assume_role.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'arn:aws:iam::123456789012:role/config-role'}}, 'AssumeRole')
+        try:
+            with self.assertRaises(botocore.exceptions.ClientError) as context:
+                rule_runtime.get_assume_role_credentials('arn:aws:iam::123456789012:role/config-role')
+        finally:
+            STS_CLIENT_MOCK.assume_role.side_effect = None
+        self.assertEqual('AWS Config does not have permission to assume the IAM role.', context.exception.response['Error']['Message'])
+
+class ClientCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        rule_runtime.clients.reset_client_cache()
+        STS_CLIENT_MOCK.reset_mock()
+        STS_CLIENT_MOCK.assume_role.return_value = build_assume_role_response(datetime.timedelta(hours=1))
+
+    def test_clients_and_credentials_are_reused_across_invocations(self):
+        event = build_lambda_scheduled_event()
+        first_client = rule_runtime.get_client('ec2', event, assume_role_mode=True)
+        rule_runtime.get_client('config', event, assume_role_mode=True)
+        self.assertIs(first_client, rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True))
+        self.assertEqual(1, STS_CLIENT_MOCK.assume_role.call_count)
+        self.assertEqual({'client_hits': 1, 'client_misses': 2, 'credentials_hits': 1, 'credentials_misses': 1},
+                         rule_runtime.get_cache_stats())
+
+    def test_credentials_are_refreshed_before_expiry(self):
+        STS_CLIENT_MOCK.assume_role.return_value = build_assume_role_response(datetime.timedelta(seconds=60))
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True)
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True)
+        self.assertEqual(2, STS_CLIENT_MOCK.assume_role.call_count)
+
+    def test_cache_is_keyed_by_role_and_region(self):
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True)
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True, region='eu-west-1')
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(rule_parameters='{"ExecutionRoleName": "audit-role"}'), assume_role_mode=True)
+        self.assertEqual(3, STS_CLIENT_MOCK.assume_role.call_count)
+        self.assertEqual(0, rule_runtime.get_cache_stats()['client_hits'])
+
+    def test_credentials_without_expiration_are_not_cached(self):
+        STS_CLIENT_MOCK.assume_role.return_value = {'Credentials': {'AccessKeyId': 'key', 'SecretAccessKey': 'secret', 'SessionToken': 'token'}}
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True)
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event(), assume_role_mode=True)
+        self.assertEqual(2, STS_CLIENT_MOCK.assume_role.call_count)
+
+class EvaluationFlusherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_client = MagicMock()
+        self.config_client.put_evaluations.return_value = {'FailedEvaluations': []}
+        self.evaluations = [{'ComplianceResourceId': 'i-{}'.format(i)} for i in range(1050)]
+
+    def build_flusher(self):
+        return rule_runtime.EvaluationFlusher(self.config_client, 'token', max_workers=4, max_attempts=3, base_delay=0)
+
+    def sent_resource_ids(self):
+        return sorted(evaluation['ComplianceResourceId'] for call in self.config_client.put_evaluations.call_args_list for evaluation in call[1]['Evaluations'])
+
+    def test_all_evaluations_are_sent_once_by_batches_of_100(self):
+        report = self.build_flusher().flush(self.evaluations)
+        self.assertEqual(sorted(evaluation['ComplianceResourceId'] for evaluation in self.evaluations), self.sent_resource_ids())
+        self.assertEqual(11, self.config_client.put_evaluations.call_count)
+        self.assertTrue(all(len(call[1]['Evaluations']) <= 100 for call in self.config_client.put_evaluations.call_args_list))
+        self.assertEqual((1050, 11, 11, 0, []), (report['evaluations'], report['batches'], report['calls'], report['retried'], report['failed_evaluations']))
+
+    def test_only_failed_evaluations_are_sent_again(self):
+        def put_evaluations(Evaluations, ResultToken, TestMode):
+            if len(Evaluations) == 100 and Evaluations[0]['ComplianceResourceId'] == 'i-0':
+                return {'FailedEvaluations': Evaluations[:2]}
+            return {'FailedEvaluations': []}
+        self.config_client.put_evaluations.side_effect = put_evaluations
+        report = self.build_flusher().flush(self.evaluations)
+        self.assertEqual(12, report['calls'])
+        self.assertEqual(2, report['retried'])
+        self.assertEqual([], report['failed_evaluations'])
+        self.assertEqual(1052, len(self.sent_resource_ids()))
+
+    def test_throttled_batches_are_retried(self):
+        throttling = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'PutEvaluations')
+        self.config_client.put_evaluations.side_effect = [throttling, {'FailedEvaluations': []}]
+        report = self.build_flusher().flush(self.evaluations[:10])
+        self.assertEqual((2, 1, 10, []), (report['calls'], report['throttled'], report['retried'], report['failed_evaluations']))
+
+    def test_failed_evaluations_are_reported_after_the_last_attempt(self):
+        self.config_client.put_evaluations.side_effect = lambda Evaluations, ResultToken, TestMode: {'FailedEvaluations': Evaluations[:1]}
+        report = self.build_flusher().flush(self.evaluations[:10])
+        self.assertEqual(3, report['calls'])
+        self.assertEqual([{'ComplianceResourceId': 'i-0'}], report['failed_evaluations'])
+
+    def test_other_errors_are_raised(self):
+        self.config_client.put_evaluations.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'InvalidResultTokenException', 'Message': 'invalid'}}, 'PutEvaluations')
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.build_flusher().flush(self.evaluations[:10])
+
+class StreamEvaluationsTest(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG_CLIENT_MOCK.reset_mock()
+        CONFIG_CLIENT_MOCK.put_evaluations.return_value = {'FailedEvaluations': []}
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.return_value = {'EvaluationResults': []}
+
+    def test_batches_are_put_while_the_evaluations_are_yielded(self):
+        flushers = []
+        submitted_batches = []
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            for i in range(250):
+                if i == 200:
+                    submitted_batches.append(len(flushers[0].futures))
+                yield rule.RUNTIME.build_evaluation('i-{}'.format(i), 'COMPLIANT', event)
+        rule = build_rule(evaluate_compliance)
+        build_flusher = rule.RUNTIME.build_flusher
+        def keep_flusher(event):
+            flushers.append(build_flusher(event))
+            return flushers[0]
+        rule.RUNTIME.build_flusher = keep_flusher
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual([2], submitted_batches)
+        # Outside of the RDK tests, only the counts of the reported evaluations are kept.
+        self.assertEqual({'latest_evaluations': 250, 'stale_evaluations': 0}, response)
+        batch_sizes = [len(call[1]['Evaluations']) for call in CONFIG_CLIENT_MOCK.put_evaluations.call_args_list]
+        self.assertEqual([100, 100, 50], batch_sizes)
+
+    def test_resources_not_yielded_anymore_are_cleaned_up(self):
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.return_value = {'EvaluationResults': [
+            {'EvaluationResultIdentifier': {'EvaluationResultQualifier': {'ResourceType': 'AWS::EC2::Instance', 'ResourceId': 'i-0'}}},
+            {'EvaluationResultIdentifier': {'EvaluationResultQualifier': {'ResourceType': 'AWS::EC2::Instance', 'ResourceId': 'i-deleted'}}}]}
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            yield rule.RUNTIME.build_evaluation('i-0', 'COMPLIANT', event)
+        rule = build_rule(evaluate_compliance)
+        response = rule.RUNTIME.lambda_handler(build_test_mode_scheduled_event(), {})
+        self.assertEqual([('i-deleted', 'NOT_APPLICABLE'), ('i-0', 'COMPLIANT')],
+                         [(evaluation['ComplianceResourceId'], evaluation['ComplianceType']) for evaluation in response])
+
+    def test_empty_stream_reports_not_applicable_on_account(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            return
+            yield
+        rule = build_rule(evaluate_compliance)
+        response = rule.RUNTIME.lambda_handler(build_test_mode_scheduled_event(), {})
+        self.assertEqual([('AWS::::Account', '123456789012', 'NOT_APPLICABLE')],
+                         [(evaluation['ComplianceResourceType'], evaluation['ComplianceResourceId'], evaluation['ComplianceType']) for evaluation in response])
+
+    def test_error_in_the_stream_is_a_customer_error(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            for i in range(150):
+                yield rule.RUNTIME.build_evaluation('i-{}'.format(i), 'COMPLIANT', event)
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'access-denied'}}, 'operation')
+        rule = build_rule(evaluate_compliance)
+        response = rule.RUNTIME.lambda_handler(build_lambda_scheduled_event(), {})
+        self.assertEqual('AccessDenied', response['customerErrorCode'])
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.assert_not_called()
+
+class PaginateTest(unittest.TestCase):
+
+    def test_next_token_is_sent_until_the_last_page(self):
+        operation = MagicMock(side_effect=[{'Items': [1, 2], 'NextToken': 'a'}, {'Items': [3], 'NextToken': 'b'}, {'Items': [4]}])
+        self.assertEqual([1, 2, 3, 4], list(rule_runtime.paginate(operation, 'Items', MaxResults=2)))
+        self.assertEqual([{'MaxResults': 2}, {'MaxResults': 2, 'NextToken': 'a'}, {'MaxResults': 2, 'NextToken': 'b'}],
+                         [call[1] for call in operation.call_args_list])
+
+    def test_marker_and_next_marker(self):
+        operation = MagicMock(side_effect=[{'Functions': [1], 'NextMarker': 'a'}, {'Functions': [2]}])
+        self.assertEqual([1, 2], list(rule_runtime.paginate(operation, 'Functions', 'Marker', 'NextMarker')))
+        self.assertEqual({'Marker': 'a'}, operation.call_args[1])
+
+    def test_position(self):
+        operation = MagicMock(side_effect=[{'items': [1], 'position': 'a'}, {}])
+        self.assertEqual([1], list(rule_runtime.paginate(operation, 'items', 'position', limit=500)))
+        self.assertEqual({'position': 'a', 'limit': 500}, operation.call_args[1])
+
+    def test_not_truncated_or_empty_token_is_the_last_page(self):
+        operation = MagicMock(return_value={'Users': [1], 'IsTruncated': False, 'Marker': 'a'})
+        self.assertEqual([1], list(rule_runtime.paginate(operation, 'Users', 'Marker')))
+        operation = MagicMock(return_value={'FindingIds': ['f'], 'NextToken': ''})
+        self.assertEqual(1, len(list(rule_runtime.iter_pages(operation))))
+        self.assertEqual(1, operation.call_count)
+
+    def test_next_page_is_requested_while_the_current_page_is_processed(self):
+        second_page_requested = threading.Event()
+        def operation(**kwargs):
+            if 'NextToken' not in kwargs:
+                return {'Items': [1], 'NextToken': 'a'}
+            second_page_requested.set()
+            return {'Items': [2]}
+        pages = rule_runtime.iter_pages(operation)
+        next(pages)
+        self.assertTrue(second_page_requested.wait(5))
+        pages.close()
+
+    def test_without_prefetch_pages_are_requested_on_demand(self):
+        operation = MagicMock(side_effect=[{'Items': [1], 'NextToken': 'a'}, {'Items': [2]}])
+        items = rule_runtime.paginate(operation, 'Items', prefetch=False)
+        self.assertEqual(1, next(items))
+        self.assertEqual(1, operation.call_count)
+        self.assertEqual([2], list(items))
+
+class MapEntitiesTest(unittest.TestCase):
+
+    def test_results_keep_the_order_of_the_entities(self):
+        # The first entities complete last.
+        def work(entity):
+            time.sleep(0.001 * (10 - entity))
+            return entity * 2
+        self.assertEqual([(entity, entity * 2) for entity in range(10)], list(rule_runtime.map_entities(work, range(10), max_workers=4)))
+
+    def test_in_flight_entities_are_bounded(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max_running': 0}
+        def work(entity):
+            with lock:
+                state['running'] += 1
+                state['max_running'] = max(state['max_running'], state['running'])
+            time.sleep(0.002)
+            with lock:
+                state['running'] -= 1
+            return entity
+        self.assertEqual(list(range(50)), [result for _, result in rule_runtime.map_entities(work, range(50), max_workers=3)])
+        self.assertTrue(1 < state['max_running'] <= 3)
+
+    def test_error_is_raised_at_its_entity(self):
+        def work(entity):
+            if entity == 2:
+                raise ValueError('entity 2')
+            return entity
+        results = rule_runtime.map_entities(work, range(5), max_workers=2)
+        self.assertEqual([(0, 0), (1, 1)], [next(results), next(results)])
+        with self.assertRaises(ValueError):
+            next(results)
+
+    def test_concurrency_of_1_runs_in_the_calling_thread(self):
+        with patch.dict(os.environ, {'RULE_RUNTIME_ENTITY_CONCURRENCY': '1'}):
+            self.assertEqual(1, rule_runtime.get_entity_concurrency())
+            threads = [thread for _, thread in rule_runtime.map_entities(lambda entity: threading.current_thread(), range(3))]
+        self.assertEqual([threading.current_thread()] * 3, threads)
+
+class LeaderRegionTest(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG_CLIENT_MOCK.reset_mock()
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.return_value = {'EvaluationResults': []}
+        self.directory = tempfile.mkdtemp()
+        self.evaluated_regions = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build_iam_rule(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            self.evaluated_regions.append(event['configRuleArn'].split(':')[3])
+            yield rule.RUNTIME.build_evaluation('AIDA1', 'COMPLIANT', event)
+            yield rule.RUNTIME.build_evaluation('AIDA2', 'NON_COMPLIANT', event, annotation='No MFA.')
+        rule = build_rule(evaluate_compliance)
+        rule.DEFAULT_RESOURCE_TYPE = 'AWS::IAM::User'
+        return rule
+
+    def invoke_regions(self, rule, regions, rule_parameters):
+        return {region: rule.RUNTIME.lambda_handler(build_regional_scheduled_event(region, json.dumps(rule_parameters)), {}) for region in regions}
+
+    def test_only_the_leader_region_evaluates(self):
+        rule = self.build_iam_rule()
+        responses = self.invoke_regions(rule, ['us-east-1', 'eu-west-1', 'ap-southeast-2'], {'RuleRuntimeLeaderRegion': 'us-east-1'})
+        self.assertEqual(['us-east-1'], self.evaluated_regions)
+        self.assertEqual(['AIDA1', 'AIDA2'], [evaluation['ComplianceResourceId'] for evaluation in responses['us-east-1']])
+        for region in ['eu-west-1', 'ap-southeast-2']:
+            self.assertEqual([('AWS::::Account', '123456789012', 'NOT_APPLICABLE')],
+                             [(evaluation['ComplianceResourceType'], evaluation['ComplianceResourceId'], evaluation['ComplianceType']) for evaluation in responses[region]])
+
+    def test_followers_reuse_the_results_of_the_leader_from_a_directory(self):
+        rule = self.build_iam_rule()
+        rule_parameters = {'RuleRuntimeLeaderRegion': 'us-east-1', 'RuleRuntimeResultStore': 'file://' + self.directory}
+        # A follower invoked before the leader has nothing to reuse yet.
+        responses = self.invoke_regions(rule, ['eu-west-1', 'us-east-1', 'eu-central-1'], rule_parameters)
+        self.assertEqual(['us-east-1'], self.evaluated_regions)
+        self.assertEqual('NOT_APPLICABLE', responses['eu-west-1'][0]['ComplianceType'])
+        self.assertEqual([('AIDA1', 'COMPLIANT', None), ('AIDA2', 'NON_COMPLIANT', 'No MFA.')],
+                         [(evaluation['ComplianceResourceId'], evaluation['ComplianceType'], evaluation.get('Annotation'))
+                          for evaluation in responses['eu-central-1']])
+        self.assertEqual('AWS::IAM::User', responses['eu-central-1'][0]['ComplianceResourceType'])
+        self.assertEqual('2019-01-01T00:00:00.000Z', responses['eu-central-1'][0]['OrderingTimestamp'])
+
+    def test_followers_reuse_the_results_of_the_leader_from_s3(self):
+        objects = {}
+        def put_object(Bucket, Key, Body, **kwargs):
+            objects[(Bucket, Key)] = Body
+        def get_object(Bucket, Key):
+            if (Bucket, Key) not in objects:
+                raise botocore.exceptions.ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'missing'}}, 'GetObject')
+            return {'Body': io.BytesIO(objects[(Bucket, Key)])}
+        S3_CLIENT_MOCK.put_object = MagicMock(side_effect=put_object)
+        S3_CLIENT_MOCK.get_object = MagicMock(side_effect=get_object)
+        rule = self.build_iam_rule()
+        responses = self.invoke_regions(rule, ['us-east-1', 'eu-west-1'], {'RuleRuntimeLeaderRegion': 'us-east-1', 'RuleRuntimeResultStore': 's3://results/config'})
+        self.assertEqual(['us-east-1'], self.evaluated_regions)
+        self.assertEqual('results', S3_CLIENT_MOCK.put_object.call_args[1]['Bucket'])
+        self.assertTrue(S3_CLIENT_MOCK.put_object.call_args[1]['Key'].startswith('config/123456789012/'))
+        self.assertEqual(['AIDA1', 'AIDA2'], [evaluation['ComplianceResourceId'] for evaluation in responses['eu-west-1']])
+
+    def test_followers_do_not_reuse_stale_results(self):
+        rule = self.build_iam_rule()
+        rule_parameters = {'RuleRuntimeLeaderRegion': 'us-east-1', 'RuleRuntimeResultStore': self.directory, 'RuleRuntimeLeaderPeriod': 'One_Hour'}
+        with patch('rule_runtime.leader_region.time') as time_mock:
+            time_mock.time.return_value = time.time() - 3 * 3600
+            self.invoke_regions(rule, ['us-east-1'], rule_parameters)
+        # Saved three hours ago: stale for a leader running every hour, reused for one running every six hours.
+        response = self.invoke_regions(rule, ['eu-west-1'], rule_parameters)['eu-west-1']
+        self.assertEqual([('AWS::::Account', 'NOT_APPLICABLE')], [(evaluation['ComplianceResourceType'], evaluation['ComplianceType']) for evaluation in response])
+        response = self.invoke_regions(rule, ['eu-west-1'], dict(rule_parameters, RuleRuntimeLeaderPeriod='Six_Hours'))['eu-west-1']
+        self.assertEqual(['AIDA1', 'AIDA2'], [evaluation['ComplianceResourceId'] for evaluation in response])
+
+    def test_unknown_leader_period_is_a_parameter_error(self):
+        rule = self.build_iam_rule()
+        response = self.invoke_regions(rule, ['us-east-1'], {'RuleRuntimeLeaderRegion': 'us-east-1', 'RuleRuntimeLeaderPeriod': 'Daily'})['us-east-1']
+        self.assertEqual('InvalidParameterValueException', response['customerErrorCode'])
+        self.assertEqual([], self.evaluated_regions)
+
+    def test_reserved_parameters_are_not_passed_to_the_rule(self):
+        received_parameters = []
+        def evaluate_parameters(rule_parameters):
+            received_parameters.append(dict(rule_parameters))
+            return rule_parameters
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: None, evaluate_parameters)
+        self.invoke_regions(rule, ['us-east-1'], {'RuleRuntimeLeaderRegion': 'us-east-1', 'WhitelistedUserList': 'AIDA1'})
+        self.assertEqual([{'WhitelistedUserList': 'AIDA1'}], received_parameters)
+
+class VerdictCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG_CLIENT_MOCK.reset_mock()
+        rule_runtime.reset_verdict_cache()
+        self.calls = []
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            def evaluate():
+                self.calls.append(configuration_item['configurationItemCaptureTime'])
+                return rule.RUNTIME.build_evaluation_from_config_item(configuration_item, 'NON_COMPLIANT', annotation='Full star.')
+            return rule.RUNTIME.evaluate_incrementally(event, configuration_item, ('attachedManagedPolicies',), valid_rule_parameters, evaluate)
+        rule = build_rule(evaluate_compliance)
+        self.rule = rule
+
+    def invoke(self, capture_time, policies, tags=None, status='OK', rule_parameters='{}'):
+        invoking_event = {
+            'messageType': 'ConfigurationItemChangeNotification',
+            'notificationCreationTime': capture_time,
+            'configurationItem': {
+                'configurationItemStatus': status, 'resourceType': 'AWS::IAM::Role', 'resourceId': 'AROA1', 'resourceName': 'role',
+                'ARN': 'arn:aws:iam::123456789012:role/role', 'configurationItemCaptureTime': capture_time, 'tags': tags or {},
+                'configuration': {'attachedManagedPolicies': [{'policyArn': arn} for arn in policies]}}}
+        return self.rule.RUNTIME.lambda_handler(build_lambda_event(invoking_event, rule_parameters), {})
+
+    def test_disabled_without_the_environment_variable(self):
+        self.invoke('2019-01-01T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+        self.invoke('2019-01-02T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+        self.assertEqual(2, len(self.calls))
+
+    def test_unchanged_policies_reuse_the_verdict(self):
+        with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'memory'}):
+            self.invoke('2019-01-01T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+            response = self.invoke('2019-01-02T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'], tags={'team': 'b'})
+        self.assertEqual(['2019-01-01T00:00:00.000Z'], self.calls)
+        self.assertEqual(('NON_COMPLIANT', 'Full star.', '2019-01-02T00:00:00.000Z'),
+                         (response[0]['ComplianceType'], response[0]['Annotation'], response[0]['OrderingTimestamp']))
+
+    def test_invalidations(self):
+        with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'memory'}):
+            self.invoke('2019-01-01T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+            # The relevant fields changed.
+            self.invoke('2019-01-02T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'])
+            # The rule parameters changed.
+            self.invoke('2019-01-03T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'], rule_parameters='{"policyArns": "x"}')
+            # The resource was deleted and recreated, the verdict cached then expires at once.
+            self.invoke('2019-01-04T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'], status='ResourceDeleted', rule_parameters='{"policyArns": "x"}')
+            with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE_TTL': '-1'}):
+                self.invoke('2019-01-05T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'], rule_parameters='{"policyArns": "x"}')
+            # The verdict expired.
+            self.invoke('2019-01-06T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'], rule_parameters='{"policyArns": "x"}')
+            self.invoke('2019-01-07T00:00:00.000Z', ['arn:aws:iam::aws:policy/B'], rule_parameters='{"policyArns": "x"}')
+        self.assertEqual(['2019-01-01T00:00:00.000Z', '2019-01-02T00:00:00.000Z', '2019-01-03T00:00:00.000Z',
+                          '2019-01-05T00:00:00.000Z', '2019-01-06T00:00:00.000Z'], self.calls)
+
+    def test_file_backend(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'file://' + directory}):
+                self.invoke('2019-01-01T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+                rule_runtime.reset_verdict_cache()
+                self.invoke('2019-01-02T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+            self.assertEqual(1, len(self.calls))
+            self.assertEqual(1, len(os.listdir(directory)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_dynamodb_backend(self):
+        items = {}
+        DYNAMODB_CLIENT_MOCK.put_item = MagicMock(side_effect=lambda TableName, Item: items.__setitem__((TableName, Item['CacheKey']['S']), Item))
+        DYNAMODB_CLIENT_MOCK.get_item = MagicMock(side_effect=lambda TableName, Key: {'Item': items[(TableName, Key['CacheKey']['S'])]}
+                                                  if (TableName, Key['CacheKey']['S']) in items else {})
+        with patch.dict(os.environ, {'RULE_RUNTIME_VERDICT_CACHE': 'dynamodb://verdicts'}):
+            self.invoke('2019-01-01T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+            self.invoke('2019-01-02T00:00:00.000Z', ['arn:aws:iam::aws:policy/A'])
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual(['verdicts'], [table for table, _ in items])
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        rule_runtime.clients.reset_client_cache()
+        rule_runtime.reset_rate_limiters()
+
+    def test_throttling_halves_the_rate_once_per_cooldown(self):
+        limiter = rule_runtime.AdaptiveRateLimiter('iam', rate=40)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertEqual(20, limiter.rate)
+        self.assertEqual(2, limiter.throttled)
+        limiter.last_decrease -= rule_runtime.rate_limiter.RATE_LIMITER_DECREASE_COOLDOWN_SECONDS
+        limiter.on_throttle()
+        self.assertEqual(10, limiter.rate)
+
+    def test_rate_bounds(self):
+        limiter = rule_runtime.AdaptiveRateLimiter('iam', rate=1, min_rate=0.5, max_rate=2)
+        for _ in range(10):
+            limiter.on_success()
+        self.assertEqual(2, limiter.rate)
+        for _ in range(10):
+            limiter.last_decrease = None
+            limiter.on_throttle()
+        self.assertEqual(0.5, limiter.rate)
+
+    def test_acquire_waits_once_the_bucket_is_empty(self):
+        limiter = rule_runtime.AdaptiveRateLimiter('iam', rate=10)
+        with patch('rule_runtime.rate_limiter.time.sleep') as sleep_mock:
+            waits = [limiter.acquire() for _ in range(12)]
+        self.assertEqual([0.0] * 10, waits[:10])
+        self.assertAlmostEqual(0.1, waits[10], delta=0.05)
+        self.assertAlmostEqual(0.2, waits[11], delta=0.05)
+        self.assertEqual(2, sleep_mock.call_count)
+
+    def test_botocore_responses_drive_the_rate(self):
+        limiter = rule_runtime.AdaptiveRateLimiter('iam', rate=10)
+        limiter.needs_retry(response=(MagicMock(), {'ResponseMetadata': {}}))
+        self.assertAlmostEqual(10.1, limiter.rate)
+        limiter.needs_retry(response=(MagicMock(), {'Error': {'Code': 'AccessDenied'}}))
+        self.assertAlmostEqual(10.1, limiter.rate)
+        self.assertIsNone(limiter.needs_retry(response=(MagicMock(), {'Error': {'Code': 'Throttling'}})))
+        self.assertAlmostEqual(5.05, limiter.rate)
+        self.assertIsNone(limiter.needs_retry(response=None, caught_exception=Exception()))
+
+    def test_get_client_installs_the_limiter_of_the_account(self):
+        EC2_CLIENT_MOCK.reset_mock()
+        rule_runtime.get_client('ec2', build_lambda_scheduled_event())
+        limiter = rule_runtime.get_rate_limiter('ec2', '123456789012', EC2_CLIENT_MOCK.meta.region_name)
+        EC2_CLIENT_MOCK.meta.events.register.assert_any_call('before-send', limiter.before_send, unique_id='rule-runtime-rate-limiter-before-send')
+        EC2_CLIENT_MOCK.meta.events.register.assert_any_call('needs-retry', limiter.needs_retry, unique_id='rule-runtime-rate-limiter-needs-retry')
+
+    def test_rdklib_client_factory(self):
+        client_factory = MagicMock()
+        client = rule_runtime.RateLimitedClientFactory(client_factory, '123456789012').build_client('elbv2', region='eu-west-1')
+        client_factory.build_client.assert_called_once_with('elbv2', region='eu-west-1')
+        self.assertEqual(2, client.meta.events.register.call_count)
+
+    def test_stats_are_reset_but_the_rate_is_kept(self):
+        limiter = rule_runtime.get_rate_limiter('iam', '123456789012')
+        limiter.acquire()
+        limiter.on_throttle()
+        self.assertEqual({'iam@123456789012': {'calls': 1, 'throttled': 1, 'waited_seconds': 0.0, 'rate': 20.0}},
+                         rule_runtime.pop_rate_limiter_stats())
+        self.assertEqual({}, rule_runtime.pop_rate_limiter_stats())
+        self.assertEqual(20.0, limiter.rate)
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        rule_runtime.instrumentation.CURRENT_RECORDER = None
+
+    def test_disabled(self):
+        client = MagicMock()
+        with patch.dict(os.environ, {'RULE_RUNTIME_METRICS': ''}):
+            rule_runtime.install_instrumentation(client)
+            self.assertIsNone(rule_runtime.start_recording('FAKE_RULE', build_lambda_scheduled_event()))
+        client.meta.events.register.assert_not_called()
+
+    def test_botocore_calls_are_accounted_per_operation(self):
+        iam_client = botocore.session.get_session().create_client('iam', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+        with patch.dict(os.environ, {'RULE_RUNTIME_METRICS': 'true'}):
+            rule_runtime.install_instrumentation(iam_client)
+            recorder = rule_runtime.start_recording('FAKE_RULE', build_lambda_scheduled_event())
+            with Stubber(iam_client) as stubber:
+                stubber.add_response('list_users', {'Users': [], 'IsTruncated': True, 'Marker': 'm1'})
+                stubber.add_response('list_users', {'Users': []}, {'Marker': 'm1'})
+                stubber.add_client_error('get_user', 'NoSuchEntity')
+                iam_client.list_users()
+                iam_client.list_users(Marker='m1')
+                with self.assertRaises(botocore.exceptions.ClientError):
+                    iam_client.get_user()
+            with patch('rule_runtime.instrumentation.print') as print_mock:
+                log_entry = rule_runtime.stop_recording(recorder)
+        self.assertEqual(json.loads(print_mock.call_args[0][0]), log_entry)
+        self.assertIsNone(rule_runtime.instrumentation.CURRENT_RECORDER)
+        self.assertEqual('FAKE_RULE', log_entry['Rule'])
+        self.assertEqual(2, log_entry['iam.ListUsers.Calls'])
+        self.assertEqual(1, log_entry['iam.ListUsers.Pages'])
+        self.assertEqual(0, log_entry['iam.ListUsers.Errors'])
+        self.assertEqual(1, log_entry['iam.GetUser.Errors'])
+        self.assertEqual(2, sum(log_entry['ApiCalls']['iam.ListUsers']['LatencyHistogram'].values()))
+        directive = log_entry['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual([['Rule']], directive['Dimensions'])
+        self.assertEqual(14, len(directive['Metrics']))
+        self.assertIn({'Name': 'iam.GetUser.LatencyMax', 'Unit': 'Milliseconds'}, directive['Metrics'])
+
+    def test_throttled_attempts(self):
+        recorder = rule_runtime.ApiCallRecorder('FAKE_RULE')
+        rule_runtime.instrumentation.CURRENT_RECORDER = recorder
+        operation = MagicMock()
+        operation.name = 'PutEvaluations'
+        operation.service_model.service_name = 'config'
+        rule_runtime.instrumentation.needs_retry(response=(MagicMock(), {'Error': {'Code': 'ThrottlingException'}}), operation=operation)
+        rule_runtime.instrumentation.needs_retry(response=(MagicMock(), {'ResponseMetadata': {}}), operation=operation)
+        self.assertEqual(1, recorder.operations['config.PutEvaluations']['Throttles'])
+
+    def test_the_metrics_are_emitted_when_the_rule_fails(self):
+        def handle_event(event, context):
+            self.assertIsNotNone(rule_runtime.instrumentation.CURRENT_RECORDER)
+            raise ValueError('failed')
+        rule = build_rule(lambda event, configuration_item, valid_rule_parameters: [])
+        with patch.dict(os.environ, {'RULE_RUNTIME_METRICS': 'true'}), patch('rule_runtime.handler.stop_recording') as stop_recording_mock:
+            with self.assertRaises(ValueError):
+                rule.RUNTIME.run(handle_event, build_lambda_scheduled_event(), {})
+        self.assertEqual('FAKE_RULE', stop_recording_mock.call_args[0][0].rule_name)
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG_CLIENT_MOCK.reset_mock()
+        CONFIG_CLIENT_MOCK.get_compliance_details_by_config_rule.return_value = {'EvaluationResults': []}
+
+    def test_profile_mode(self):
+        with patch.dict(os.environ, {'RULE_RUNTIME_PROFILE': ''}):
+            rule_parameters = {'RuleRuntimeProfile': 'File', 'Other': 'value'}
+            self.assertEqual('file', rule_runtime.get_profile_mode(rule_parameters))
+            self.assertEqual({'Other': 'value'}, rule_parameters)
+            self.assertIsNone(rule_runtime.get_profile_mode({}))
+            self.assertIsNone(rule_runtime.get_profile_mode({'RuleRuntimeProfile': 'unknown'}))
+        with patch.dict(os.environ, {'RULE_RUNTIME_PROFILE': 'true'}):
+            self.assertEqual('log', rule_runtime.get_profile_mode({}))
+
+    def test_streamed_evaluation_is_profiled(self):
+        def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+            for i in range(10):
+                yield rule.RUNTIME.build_evaluation('i-{}'.format(i), 'COMPLIANT', event)
+        received_parameters = []
+        rule = build_rule(evaluate_compliance, lambda rule_parameters: received_parameters.append(rule_parameters))
+        with patch('rule_runtime.profiling.print') as print_mock:
+            response = rule.RUNTIME.lambda_handler(build_test_mode_scheduled_event('{"RuleRuntimeProfile": "log"}'), {})
+        self.assertEqual(10, len(response))
+        self.assertEqual([{}], received_parameters)
+        report = print_mock.call_args[0][0]
+        self.assertTrue(report.startswith('profile of FAKE_RULE: '))
+        self.assertIn('(evaluate_compliance)', report)
+        self.assertIn('allocation sites', report)
+
+    def test_file_mode_dumps_the_statistics(self):
+        profile_dir = tempfile.mkdtemp()
+        try:
+            profiler = rule_runtime.EvaluationProfiler('FAKE_RULE', 'file')
+            with patch.dict(os.environ, {'RULE_RUNTIME_PROFILE_DIR': profile_dir}), patch('rule_runtime.profiling.print'):
+                profiler.start()
+                sorted(range(1000), key=str)
+                profiler.stop()
+            dumps = os.listdir(profile_dir)
+            self.assertEqual(1, len(dumps))
+            self.assertTrue(pstats.Stats(os.path.join(profile_dir, dumps[0])).total_calls > 0)
+        finally:
+            shutil.rmtree(profile_dir)
+
+    def test_disabled_profiler_does_nothing(self):
+        profiler = rule_runtime.EvaluationProfiler('FAKE_RULE')
+        profiler.start()
+        self.assertIsNone(profiler.stop())
+
+class CredentialReportTest(unittest.TestCase):
+
+    CONTENT = (b'user,arn,access_key_1_active,access_key_1_last_rotated,access_key_2_active,access_key_2_last_rotated\n'
+               b'<root_account>,arn:aws:iam::123456789012:root,false,N/A,false,N/A\n'
+               b'alice,arn:aws:iam::123456789012:user/alice,true,2019-01-01T00:00:00+00:00,false,2018-01-01T00:00:00+00:00\n')
+
+    def build_iam_client(self, generated_hours_ago, states=('COMPLETE',)):
+        iam_client = MagicMock()
+        iam_client.generate_credential_report.side_effect = [{'State': state} for state in states]
+        iam_client.get_credential_report.return_value = {
+            'Content': self.CONTENT,
+            'GeneratedTime': datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=generated_hours_ago)}
+        return iam_client
+
+    def test_rows_and_active_key_dates(self):
+        rows = list(rule_runtime.iter_credential_report(self.CONTENT))
+        self.assertEqual(['<root_account>', 'alice'], [row['user'] for row in rows])
+        self.assertEqual([], rule_runtime.get_active_access_key_dates(rows[0]))
+        self.assertEqual([datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)], rule_runtime.get_active_access_key_dates(rows[1]))
+        self.assertIsNone(rule_runtime.parse_report_date('no_information'))
+
+    def test_generation_is_awaited(self):
+        iam_client = self.build_iam_client(1, ['STARTED', 'INPROGRESS', 'COMPLETE'])
+        with patch('rule_runtime.credential_report.time.sleep') as sleep_mock:
+            self.assertEqual(self.CONTENT, rule_runtime.get_credential_report(iam_client))
+        self.assertEqual(2, sleep_mock.call_count)
+
+    def test_stale_or_unavailable_report(self):
+        self.assertIsNone(rule_runtime.get_credential_report(self.build_iam_client(5)))
+        iam_client = self.build_iam_client(1)
+        iam_client.get_credential_report.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'ReportNotPresent', 'Message': ''}}, 'GetCredentialReport')
+        self.assertIsNone(rule_runtime.get_credential_report(iam_client))
+        iam_client = self.build_iam_client(1, ['STARTED'] * 100)
+        with patch('rule_runtime.credential_report.time.sleep'):
+            self.assertIsNone(rule_runtime.get_credential_report(iam_client, timeout_seconds=0))
+
+class AuthorizationDetailsTest(unittest.TestCase):
+
+    def test_entities_and_default_policy_versions(self):
+        iam_client = MagicMock()
+        iam_client.get_account_authorization_details.return_value = {
+            'GroupDetailList': [{'GroupName': 'admins', 'GroupId': 'AGPA1', 'AttachedManagedPolicies': [{'PolicyName': 'Admin', 'PolicyArn': 'arn:admin'}],
+                                 'GroupPolicyList': [{'PolicyName': 'inline', 'PolicyDocument': '%7B%22Statement%22%3A%20%5B%5D%7D'}]}],
+            'Policies': [{'Arn': 'arn:admin', 'DefaultVersionId': 'v2', 'PolicyVersionList': [
+                {'VersionId': 'v1', 'IsDefaultVersion': False, 'Document': {'Statement': 'v1'}},
+                {'VersionId': 'v2', 'IsDefaultVersion': True, 'Document': {'Statement': 'v2'}}]}],
+            'IsTruncated': False}
+        details = rule_runtime.AuthorizationDetails(iam_client, ['AWS::IAM::Group'])
+        iam_client.get_account_authorization_details.assert_called_once_with(Filter=['Group', 'LocalManagedPolicy', 'AWSManagedPolicy'], MaxItems=1000)
+        [(group_id, group_name, group)] = list(details.iter_entities('AWS::IAM::Group'))
+        self.assertEqual(('AGPA1', 'admins'), (group_id, group_name))
+        # The URL-encoded documents are decoded.
+        self.assertEqual([('inline', {'Statement': []})], details.get_inline_policies('AWS::IAM::Group', group))
+        self.assertEqual([('arn:admin', 'Admin', {'Statement': 'v2'})], details.get_managed_policies(group))
+        iam_client.get_policy.assert_not_called()
+
+class PolicyDocumentCacheTest(unittest.TestCase):
+
+    CUSTOMER_ARN = 'arn:aws:iam::123456789012:policy/custom'
+    AWS_ARN = 'arn:aws:iam::aws:policy/ReadOnlyAccess'
+
+    def setUp(self):
+        rule_runtime.reset_policy_document_cache()
+
+    def build_iam_client(self, version_id='v1'):
+        iam_client = MagicMock()
+        iam_client.get_policy.return_value = {'Policy': {'DefaultVersionId': version_id}}
+        iam_client.get_policy_version.side_effect = lambda PolicyArn, VersionId: {'PolicyVersion': {'Document': {'Statement': [PolicyArn, VersionId]}}}
+        return iam_client
+
+    def test_documents_are_cached_by_default_version(self):
+        iam_client = self.build_iam_client()
+        for _ in range(3):
+            self.assertEqual({'Statement': [self.CUSTOMER_ARN, 'v1']}, rule_runtime.get_policy_document(iam_client, self.CUSTOMER_ARN))
+        self.assertEqual(3, iam_client.get_policy.call_count)
+        self.assertEqual(1, iam_client.get_policy_version.call_count)
+        # A new default version replaces the cached one.
+        iam_client = self.build_iam_client('v2')
+        self.assertEqual({'Statement': [self.CUSTOMER_ARN, 'v2']}, rule_runtime.get_policy_document(iam_client, self.CUSTOMER_ARN))
+        with patch('builtins.print') as print_mock:
+            rule_runtime.log_policy_cache_report()
+        self.assertIn('4 lookups, 2 hits, 0 disk hits, 2 misses (50.0% hit rate)', print_mock.call_args[0][0])
+
+    def test_lru_eviction_and_pinned_aws_managed_policies(self):
+        cache = rule_runtime.PolicyDocumentCache(2)
+        cache.put(self.AWS_ARN, 'v1', 'aws')
+        for index in range(3):
+            cache.put('arn:aws:iam::123456789012:policy/p{}'.format(index), 'v1', index)
+            cache.get('arn:aws:iam::123456789012:policy/p0', 'v1')
+        self.assertEqual(0, cache.get('arn:aws:iam::123456789012:policy/p0', 'v1'))
+        self.assertIsNone(cache.get('arn:aws:iam::123456789012:policy/p1', 'v1'))
+        self.assertEqual('aws', cache.get(self.AWS_ARN, 'v1'))
+        self.assertEqual({'hits': 5, 'disk_hits': 0, 'misses': 1, 'evictions': 1, 'size': 2, 'pinned': 1}, cache.pop_stats())
+
+    def test_disk_tier(self):
+        directory = tempfile.mkdtemp()
+        try:
+            rule_runtime.PolicyDocumentCache(10, directory).put(self.CUSTOMER_ARN, 'v1', {'Statement': []})
+            # A new process, or an eviction, reads the document back from the directory.
+            cache = rule_runtime.PolicyDocumentCache(10, directory)
+            self.assertEqual({'Statement': []}, cache.get(self.CUSTOMER_ARN, 'v1'))
+            self.assertIsNone(cache.get(self.CUSTOMER_ARN, 'v2'))
+            self.assertEqual(1, cache.pop_stats()['disk_hits'])
+        finally:
+            shutil.rmtree(directory)
+
+class PolicyCompilerTest(unittest.TestCase):
+
+    DOCUMENT = {'Statement': [
+        {'Effect': 'Allow', 'Action': ['s3:Get*', 'EC2:DescribeInstances'], 'Resource': 'arn:aws:s3:::bucket/*'},
+        {'Effect': 'Allow', 'NotAction': 'iam:*', 'Resource': '*', 'Condition': {'IpAddress': {'aws:SourceIp': '10.0.0.0/8'}}},
+        {'Effect': 'Deny', 'Action': 's3:GetObject?cl', 'Resource': '*'},
+        {'Effect': 'Deny', 'Action': '*', 'Resource': '*', 'Condition': {'ForAnyValue:NotIpAddress': {'AWS:SourceIp': ['10.0.0.0/8', '192.168.0.0/16']}}}]}
+
+    def test_statements_are_normalized(self):
+        policy = rule_runtime.compile_policy(self.DOCUMENT)
+        self.assertEqual(4, len(policy.statements))
+        self.assertEqual(('s3:Get*', 'EC2:DescribeInstances'), policy.statements[0].actions)
+        self.assertEqual(('iam:*',), policy.statements[1].not_actions)
+        self.assertEqual(('10.0.0.0/8',), policy.statements[1].get_source_ips('IpAddress'))
+        self.assertEqual(('10.0.0.0/8', '192.168.0.0/16'), policy.statements[3].get_source_ips('NotIpAddress'))
+        self.assertIsNone(policy.statements[0].get_source_ips('IpAddress'))
+        single = rule_runtime.compile_policy({'Statement': {'Effect': 'Allow', 'Action': '*'}})
+        self.assertEqual(1, len(single.statements))
+        self.assertTrue(single.has_full_star_allow())
+        self.assertFalse(policy.has_full_star_allow())
+        self.assertEqual((), rule_runtime.compile_policy({'Statement': 'unexpected'}).statements)
+
+    def test_allows_action(self):
+        policy = rule_runtime.compile_policy(self.DOCUMENT)
+        self.assertTrue(policy.allows_action('ec2:describeinstances'))
+        self.assertTrue(policy.allows_action('s3:GetBucketPolicy', 'arn:aws:s3:::bucket/key'))
+        # The Deny statement matches GetObjectAcl, the conditional one never denies.
+        self.assertFalse(policy.allows_action('s3:GetObjectAcl', 'arn:aws:s3:::bucket/key'))
+        self.assertTrue(policy.allows_action('sqs:SendMessage', 'arn:aws:sqs:us-east-1:123456789012:queue'))
+        self.assertFalse(policy.allows_action('iam:CreateUser'))
+
+    def test_compiled_policies_are_cached_with_their_version(self):
+        rule_runtime.reset_policy_document_cache()
+        iam_client = MagicMock()
+        iam_client.get_policy.return_value = {'Policy': {'DefaultVersionId': 'v1'}}
+        iam_client.get_policy_version.return_value = {'PolicyVersion': {'Document': self.DOCUMENT}}
+        compiled = rule_runtime.get_compiled_policy(iam_client, 'arn:aws:iam::123456789012:policy/custom')
+        self.assertIs(compiled, rule_runtime.get_compiled_policy(iam_client, 'arn:aws:iam::123456789012:policy/custom'))
+        iam_client.get_policy.return_value = {'Policy': {'DefaultVersionId': 'v2'}}
+        self.assertIsNot(compiled, rule_runtime.get_compiled_policy(iam_client, 'arn:aws:iam::123456789012:policy/custom'))
+        self.assertEqual(2, iam_client.get_policy_version.call_count)
+
+class PortRangesTest(unittest.TestCase):
+
+    def test_single_port(self):
+        self.assertEqual((443, 443), rule_runtime.PortRange(443))
+        self.assertEqual('443', rule_runtime.PortRange(443).get_str())
+        self.assertEqual('1020-1025', rule_runtime.PortRange(1020, 1025).get_str())
+
+    def test_ranges_are_merged(self):
+        intervals = rule_runtime.PortIntervals([rule_runtime.PortRange(91, 100), rule_runtime.PortRange(443),
+                                                rule_runtime.PortRange(80, 90), (85, 87), (8000, 8080)])
+        self.assertEqual([(80, 100), (443, 443), (8000, 8080)], list(intervals))
+        self.assertEqual(3, len(intervals))
+
+    def test_includes(self):
+        intervals = rule_runtime.PortIntervals([(80, 90), (91, 100), (443, 443), (8000, 8080)])
+        self.assertTrue(intervals.includes(rule_runtime.PortRange(85, 95)))
+        self.assertTrue(intervals.includes(rule_runtime.PortRange(443)))
+        self.assertTrue(intervals.includes(rule_runtime.PortRange(8080)))
+        self.assertFalse(intervals.includes(rule_runtime.PortRange(79)))
+        self.assertFalse(intervals.includes(rule_runtime.PortRange(100, 443)))
+        self.assertFalse(intervals.includes(rule_runtime.PortRange(8081)))
+        self.assertFalse(rule_runtime.PortIntervals([]).includes(rule_runtime.PortRange(0, 65535)))
+
+    def test_overlaps(self):
+        intervals = rule_runtime.PortIntervals([(80, 90), (443, 443)])
+        self.assertTrue(intervals.overlaps(rule_runtime.PortRange(1, 80)))
+        self.assertTrue(intervals.overlaps(rule_runtime.PortRange(90, 100)))
+        self.assertTrue(intervals.overlaps(rule_runtime.PortRange(100, 1024)))
+        self.assertFalse(intervals.overlaps(rule_runtime.PortRange(91, 442)))
+        self.assertFalse(intervals.overlaps(rule_runtime.PortRange(79)))
+        self.assertFalse(rule_runtime.PortIntervals([]).overlaps(rule_runtime.PortRange(0, 65535)))
+
+class IpNetworkSetTest(unittest.TestCase):
+
+    def test_networks_are_collapsed(self):
+        networks = rule_runtime.IpNetworkSet(['10.0.0.0/25', '10.0.0.128/25', '10.0.1.1/24', '192.168.1.1', '2001:db8::/33', '2001:db8:8000::/33'])
+        self.assertEqual(['10.0.0.0/23', '192.168.1.1/32', '2001:db8::/32'], [str(network) for network in networks])
+        self.assertEqual(3, len(networks))
+
+    def test_includes(self):
+        networks = rule_runtime.IpNetworkSet(['10.0.0.0/25', '10.0.0.128/25', '10.0.2.0/24', '10.0.3.0/24', '2001:db8::/32'])
+        self.assertTrue(networks.includes('10.0.0.0/24'))
+        self.assertTrue(networks.includes('10.0.0.200'))
+        self.assertTrue(networks.includes(ipaddress.ip_network('10.0.2.128/25')))
+        self.assertTrue(networks.includes('10.0.2.0/23'))
+        self.assertTrue(networks.includes('2001:db8:ffff::/48'))
+        self.assertFalse(networks.includes('10.0.0.0/22'))
+        self.assertFalse(networks.includes('10.0.1.1'))
+        self.assertFalse(networks.includes('9.255.255.255'))
+        self.assertFalse(networks.includes('2001:db9::1'))
+        self.assertFalse(rule_runtime.IpNetworkSet(['2001:db8::/32']).includes('10.0.0.1'))
+
+class SecurityGroupExposureTest(unittest.TestCase):
+
+    def setUp(self):
+        rule_runtime.reset_security_group_exposure_index()
+        self.ec2_client = MagicMock()
+        self.ec2_client.describe_security_groups.return_value = {'SecurityGroups': [build_api_security_group('sg-1', '0.0.0.0/0'),
+                                                                                     build_api_security_group('sg-2', '10.0.0.0/8')]}
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        rule_runtime.reset_security_group_exposure_index()
+
+    def get_client(self, service, event, region=None):
+        return self.ec2_client
+
+    def test_configuration_item(self):
+        exposure = rule_runtime.SecurityGroupExposure.from_configuration({'groupId': 'sg-1', 'ipPermissions': [
+            {'ipProtocol': 'tcp', 'fromPort': 22, 'toPort': 22, 'ipv4Ranges': [{'cidrIp': '10.0.0.0/8'}], 'ipv6Ranges': []},
+            {'ipProtocol': 'tcp', 'fromPort': 443, 'toPort': 443, 'ipv4Ranges': [], 'ipv6Ranges': [{'cidrIpv6': '::/0'}]},
+            {'ipProtocol': '17', 'fromPort': 53, 'toPort': 53, 'ipRanges': ['0.0.0.0/0']}]})
+        self.assertEqual('sg-1', exposure.group_id)
+        self.assertEqual(['udp'], [rule.protocol for rule in exposure.iter_rules_open_to('0.0.0.0/0')])
+        self.assertTrue(exposure.is_open_to_world())
+        self.assertTrue(exposure.is_open_to_world(ip_versions=(6,)))
+        self.assertEqual([(443, 443)], list(exposure.get_ports_open_to_world('tcp')))
+        self.assertEqual([(53, 53), (443, 443)], list(exposure.get_ports_open_to_world()))
+        self.assertEqual([(53, 53)], list(exposure.get_ports_open_to_world(ip_versions=(4,))))
+        self.assertFalse(exposure.has_all_ports_rule())
+        self.assertFalse(exposure.has_all_protocols_rule())
+
+    def test_all_protocols_and_ports(self):
+        exposure = rule_runtime.SecurityGroupExposure.from_configuration(build_api_security_group('sg-1', '0.0.0.0/0'))
+        self.assertTrue(exposure.has_all_ports_rule())
+        self.assertTrue(exposure.has_all_protocols_rule())
+        self.assertEqual([(0, 65535)], list(exposure.get_ports_open_to_world('tcp')))
+        self.assertFalse(rule_runtime.SecurityGroupExposure.from_configuration(build_api_security_group('sg-2', '10.0.0.0/8')).is_open_to_world())
+
+    def test_index_of_configuration_items(self):
+        index = rule_runtime.SecurityGroupExposureIndex()
+        index.add(json.dumps({'groupId': 'sg-1', 'ipPermissions': [{'ipv4Ranges': [], 'ipv6Ranges': [{'cidrIpv6': '::/0'}]}]}))
+        index.add({'groupId': 'sg-2', 'ipPermissions': []})
+        self.assertEqual(['sg-1'], [group.group_id for group in index if group.is_open_to_world()])
+        self.assertIn('sg-2', index)
+        self.assertIsNone(index.get('sg-3'))
+
+    def test_index_is_described_once(self):
+        event = build_regional_scheduled_event('eu-west-1')
+        index = rule_runtime.get_security_group_exposure_index(self.get_client, event)
+        self.assertIs(index, rule_runtime.get_security_group_exposure_index(self.get_client, event))
+        self.assertEqual(2, len(index))
+        self.assertEqual({'MaxResults': 1000}, self.ec2_client.describe_security_groups.call_args[1])
+        self.assertEqual(1, self.ec2_client.describe_security_groups.call_count)
+
+    def test_index_is_described_again_after_the_ttl(self):
+        event = build_regional_scheduled_event('eu-west-1')
+        with patch.dict(os.environ, {'RULE_RUNTIME_SG_INDEX_TTL': '0'}):
+            rule_runtime.get_security_group_exposure_index(self.get_client, event)
+            rule_runtime.get_security_group_exposure_index(self.get_client, event)
+        self.assertEqual(2, self.ec2_client.describe_security_groups.call_count)
+
+    def test_index_is_persisted(self):
+        event = build_regional_scheduled_event('eu-west-1')
+        with patch.dict(os.environ, {'RULE_RUNTIME_SG_INDEX_STORE': self.directory}):
+            rule_runtime.get_security_group_exposure_index(self.get_client, event)
+            # A cold start reads the index of the previous invocation.
+            rule_runtime.reset_security_group_exposure_index()
+            index = rule_runtime.get_security_group_exposure_index(self.get_client, event)
+        self.assertEqual(1, self.ec2_client.describe_security_groups.call_count)
+        self.assertEqual(['sg-1'], [group.group_id for group in index.get_groups(['sg-1', 'sg-2']) if group.is_open_to_world()])
+        self.assertTrue(index.get('sg-1').has_all_protocols_rule())
+
+    def test_missing_groups_are_described(self):
+        index = rule_runtime.get_security_group_exposure_index(self.get_client, build_regional_scheduled_event('eu-west-1'))
+        self.ec2_client.describe_security_groups.return_value = {'SecurityGroups': [build_api_security_group('sg-3', '::/0')]}
+        self.assertEqual(['sg-1', 'sg-3'], [group.group_id for group in index.get_groups(['sg-1', 'sg-3'], self.ec2_client)])
+        self.assertEqual({'GroupIds': ['sg-3']}, self.ec2_client.describe_security_groups.call_args[1])
+        index.get_groups(['sg-1', 'sg-3'], self.ec2_client)
+        self.assertEqual(2, self.ec2_client.describe_security_groups.call_count)
+
+class ConfigBatchFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_client = MagicMock()
+        self.config_client.batch_get_resource_config = MagicMock(side_effect=lambda resourceKeys: {
+            'baseConfigurationItems': [dict(resource_key, configuration='{}') for resource_key in resourceKeys], 'unprocessedResourceKeys': []})
+
+    def test_keys_are_deduplicated_and_batched(self):
+        group_ids = ['sg-{}'.format(index) for index in range(250)]
+        with patch.dict(os.environ, {'RULE_RUNTIME_ENTITY_CONCURRENCY': '4'}):
+            configuration_items = rule_runtime.batch_get_configuration_items(self.config_client, 'AWS::EC2::SecurityGroup', group_ids + group_ids[:10])
+        self.assertEqual(group_ids, [configuration_item['resourceId'] for configuration_item in configuration_items])
+        self.assertEqual([100, 100, 50], sorted([len(call[1]['resourceKeys']) for call in self.config_client.batch_get_resource_config.call_args_list], reverse=True))
+
+    def test_unprocessed_keys_are_retried(self):
+        resource_keys = [rule_runtime.build_resource_key('AWS::EC2::Subnet', 'subnet-{}'.format(index)) for index in range(3)]
+        responses = [botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'BatchGetResourceConfig'),
+                     {'baseConfigurationItems': [dict(resource_keys[0])], 'unprocessedResourceKeys': resource_keys[1:]},
+                     {'baseConfigurationItems': [dict(resource_keys[2]), dict(resource_keys[1])], 'unprocessedResourceKeys': []}]
+        self.config_client.batch_get_resource_config = MagicMock(side_effect=responses)
+        fetcher = rule_runtime.ConfigBatchFetcher(self.config_client)
+        with patch.object(fetcher, 'backoff') as backoff:
+            configuration_items = fetcher.fetch(resource_keys)
+        self.assertEqual({('AWS::EC2::Subnet', 'subnet-0'), ('AWS::EC2::Subnet', 'subnet-1'), ('AWS::EC2::Subnet', 'subnet-2')}, set(configuration_items))
+        self.assertEqual(resource_keys[1:], self.config_client.batch_get_resource_config.call_args[1]['resourceKeys'])
+        self.assertEqual([1, 2], [call[0][0] for call in backoff.call_args_list])
+        self.assertEqual({'keys': 3, 'calls': 3, 'retried': 5, 'throttled': 1, 'unprocessed_keys': []}, fetcher.stats)
+
+    def test_unprocessed_keys_are_given_up(self):
+        resource_key = rule_runtime.build_resource_key('AWS::EC2::Subnet', 'subnet-1')
+        self.config_client.batch_get_resource_config = MagicMock(return_value={'baseConfigurationItems': [], 'unprocessedResourceKeys': [resource_key]})
+        fetcher = rule_runtime.ConfigBatchFetcher(self.config_client, max_attempts=3)
+        with patch.object(fetcher, 'backoff'):
+            self.assertEqual({}, fetcher.fetch([resource_key]))
+        self.assertEqual(3, self.config_client.batch_get_resource_config.call_count)
+        self.assertEqual([resource_key], fetcher.stats['unprocessed_keys'])
+
+    def test_unprocessed_ids_are_raised(self):
+        self.config_client.batch_get_resource_config = MagicMock(side_effect=[
+            {'baseConfigurationItems': [], 'unprocessedResourceKeys': [rule_runtime.build_resource_key('AWS::EC2::SecurityGroup', 'sg-1')]}] * 6)
+        with patch.object(rule_runtime.ConfigBatchFetcher, 'backoff'):
+            with self.assertRaises(ValueError) as context:
+                rule_runtime.batch_get_configuration_items(self.config_client, 'AWS::EC2::SecurityGroup', ['sg-1'])
+        self.assertEqual('1 AWS::EC2::SecurityGroup left unprocessed by batch_get_resource_config: sg-1', str(context.exception))
+
+class ConfigResourceGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        # A chain of resources per instance: instance-N -> eni-N -> subnet-(N % 2), subnet-0 -> rtb-0 -> igw-0.
+        self.configurations = {}
+        for index in range(4):
+            self.configurations[('AWS::EC2::Instance', 'i-{}'.format(index))] = {'next': ['AWS::EC2::NetworkInterface', 'eni-{}'.format(index)]}
+            self.configurations[('AWS::EC2::NetworkInterface', 'eni-{}'.format(index))] = {'next': ['AWS::EC2::Subnet', 'subnet-{}'.format(index % 2)]}
+        self.configurations[('AWS::EC2::Subnet', 'subnet-0')] = {'next': ['AWS::EC2::RouteTable', 'rtb-0']}
+        self.configurations[('AWS::EC2::Subnet', 'subnet-1')] = {'next': ['AWS::EC2::RouteTable', 'rtb-deleted']}
+        self.configurations[('AWS::EC2::RouteTable', 'rtb-0')] = {'next': ['AWS::EC2::InternetGateway', 'igw-0']}
+        self.configurations[('AWS::EC2::InternetGateway', 'igw-0')] = {}
+        self.config_client = MagicMock()
+        self.config_client.batch_get_resource_config = MagicMock(side_effect=lambda resourceKeys: {
+            'baseConfigurationItems': [dict(resource_key, configuration=json.dumps(self.configurations[(resource_key['resourceType'], resource_key['resourceId'])]))
+                                       for resource_key in resourceKeys if (resource_key['resourceType'], resource_key['resourceId']) in self.configurations],
+            'unprocessedResourceKeys': []})
+        self.config_client.list_discovered_resources = MagicMock(side_effect=[
+            {'resourceIdentifiers': [{'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-0'}, {'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-1'}], 'nextToken': 'page-2'},
+            {'resourceIdentifiers': [{'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-2'}, {'resourceType': 'AWS::EC2::Instance', 'resourceId': 'i-3'}]}])
+
+    def test_items_are_loaded_once(self):
+        graph = rule_runtime.ConfigResourceGraph(self.config_client)
+        self.assertEqual({'next': ['AWS::EC2::RouteTable', 'rtb-0']}, graph.get('AWS::EC2::Subnet', 'subnet-0')['configuration'])
+        self.assertIsNone(graph.get('AWS::EC2::RouteTable', 'rtb-deleted'))
+        self.assertEqual(['subnet-0', 'subnet-1'], [item['resourceId'] for item in graph.get_items([('AWS::EC2::Subnet', 'subnet-0'), ('AWS::EC2::Subnet', 'subnet-1'),
+                                                                                                   ('AWS::EC2::RouteTable', 'rtb-deleted')])])
+        self.assertEqual(3, self.config_client.batch_get_resource_config.call_count)
+
+    def test_items_of_type(self):
+        graph = rule_runtime.ConfigResourceGraph(self.config_client)
+        self.assertEqual(['i-0', 'i-1', 'i-2', 'i-3'], [item['resourceId'] for item in graph.get_items_of_type('AWS::EC2::Instance')])
+        graph.get_items_of_type('AWS::EC2::Instance')
+        self.assertEqual('page-2', self.config_client.list_discovered_resources.call_args[1]['nextToken'])
+        self.assertEqual(2, self.config_client.list_discovered_resources.call_count)
+        self.assertEqual(1, self.config_client.batch_get_resource_config.call_count)
+
+    def test_paths_are_found_level_by_level(self):
+        graph = rule_runtime.ConfigResourceGraph(self.config_client)
+        paths = graph.find_paths(graph.get_items_of_type('AWS::EC2::Instance'),
+                                 lambda graph, item: [tuple(item['configuration']['next'])] if 'next' in item['configuration'] else [],
+                                 lambda item: item['resourceType'] == 'AWS::EC2::InternetGateway')
+        self.assertEqual(['i-0', 'eni-0', 'subnet-0', 'rtb-0', 'igw-0'], [item['resourceId'] for item in paths[('AWS::EC2::Instance', 'i-0')]])
+        self.assertEqual(['i-2', 'eni-2', 'subnet-0', 'rtb-0', 'igw-0'], [item['resourceId'] for item in paths[('AWS::EC2::Instance', 'i-2')]])
+        self.assertIsNone(paths[('AWS::EC2::Instance', 'i-1')])
+        self.assertIsNone(paths[('AWS::EC2::Instance', 'i-3')])
+        # The instances, then one batch per level: the interfaces, the subnets, the route tables and the gateway.
+        self.assertEqual(5, self.config_client.batch_get_resource_config.call_count)
+
+    def test_unprocessed_keys_are_not_memoized(self):
+        respond = self.config_client.batch_get_resource_config.side_effect
+        unprocessed_key = {'resourceType': 'AWS::EC2::Subnet', 'resourceId': 'subnet-0'}
+        # Config leaves subnet-0 unprocessed until it is read again by a later load.
+        self.config_client.batch_get_resource_config = MagicMock(side_effect=lambda resourceKeys: {
+            'baseConfigurationItems': respond([resource_key for resource_key in resourceKeys if resource_key != unprocessed_key])['baseConfigurationItems'],
+            'unprocessedResourceKeys': [resource_key for resource_key in resourceKeys if resource_key == unprocessed_key]})
+        graph = rule_runtime.ConfigResourceGraph(self.config_client)
+        graph.fetcher = rule_runtime.ConfigBatchFetcher(self.config_client, max_attempts=1)
+        paths = graph.find_paths(graph.get_items_of_type('AWS::EC2::Instance'),
+                                 lambda graph, item: [tuple(item['configuration']['next'])] if 'next' in item['configuration'] else [],
+                                 lambda item: item['resourceType'] == 'AWS::EC2::InternetGateway')
+        # The instances behind subnet-0 are left out, not reported without a path.
+        self.assertEqual([('AWS::EC2::Instance', 'i-1'), ('AWS::EC2::Instance', 'i-3')], sorted(paths))
+        self.assertEqual(set([('AWS::EC2::Subnet', 'subnet-0')]), graph.unprocessed_keys)
+        self.assertNotIn(('AWS::EC2::Subnet', 'subnet-0'), graph.items)
+        with self.assertRaises(ValueError):
+            graph.get('AWS::EC2::Subnet', 'subnet-0')
+        unprocessed_key = None
+        self.assertEqual({'next': ['AWS::EC2::RouteTable', 'rtb-0']}, graph.get('AWS::EC2::Subnet', 'subnet-0')['configuration'])
+        self.assertEqual(set(), graph.unprocessed_keys)
+
+####################
+# Helper Functions #
+####################
+
+def build_api_security_group(group_id, cidr):
+    ip_range = {'CidrIpv6': cidr} if ':' in cidr else {'CidrIp': cidr}
+    return {'GroupId': group_id, 'IpPermissions': [{'IpProtocol': '-1', 'IpRanges': [] if ':' in cidr else [ip_range],
+                                                    'Ipv6Ranges': [ip_range] if ':' in cidr else []}]}
+
+def build_assume_role_response(expires_in):
+    return {'Credentials': {
+        'AccessKeyId': 'key',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': datetime.datetime.now(datetime.timezone.utc) + expires_in}}
+
+def build_lambda_event(invoking_event, rule_parameters='{}'):
+    return {
+        'configRuleName': 'myrule',
+        'executionRoleArn': 'arn:aws:iam::123456789012:role/config-role',
+        'eventLeftScope': False,
+        'invokingEvent': json.dumps(invoking_event),
+        'accountId': '123456789012',
+        'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
+        'resultToken': 'token',
+        'ruleParameters': rule_parameters
+    }
+
+def build_lambda_scheduled_event(rule_parameters='{}'):
+    invoking_event = {'messageType': 'ScheduledNotification', 'notificationCreationTime': '2019-01-01T00:00:00.000Z'}
+    return build_lambda_event(invoking_event, rule_parameters)
+
+def build_test_mode_scheduled_event(rule_parameters='{}'):
+    event = build_lambda_scheduled_event(rule_parameters)
+    event['resultToken'] = 'TESTMODE'
+    return event
+
+def build_regional_scheduled_event(region, rule_parameters='{}'):
+    event = build_lambda_scheduled_event(rule_parameters)
+    event['configRuleArn'] = 'arn:aws:config:{}:123456789012:config-rule/config-rule-8fngan'.format(region)
+    return event
+
+def build_lambda_configurationchange_event():
+    invoking_event = {
+        'messageType': 'ConfigurationItemChangeNotification',
+        'notificationCreationTime': '2019-01-01T00:00:00.000Z',
+        'configurationItem': {
+            'configurationItemStatus': 'OK',
+            'resourceType': 'AWS::EC2::Instance',
+            'resourceId': 'i-12345678',
+            'configurationItemCaptureTime': '2019-01-01T00:00:00.000Z',
+            'configuration': {}}}
+    return build_lambda_event(invoking_event)
@@ -0,0 +1,253 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+The exposure of the security groups of an account and region: the protocols, port ranges and source CIDRs of the
+inbound rules of every group, and which of them are open to the world (0.0.0.0/0 or ::/0).
+
+The rules inspecting security groups query a SecurityGroupExposure instead of walking the ipPermissions again. It
+reads both shapes of a group: the configuration of its configuration item (ipPermissions, ipv4Ranges, fromPort...)
+and the describe_security_groups response (IpPermissions, IpRanges, FromPort...).
+
+A rule on many groups (e.g. the groups of the EC2 instances or EMR clusters) gets the index of all the groups of the
+region with get_security_group_exposure_index(), built from a single paginated describe_security_groups. The index
+is kept across warm invocations for RULE_RUNTIME_SG_INDEX_TTL seconds (default 300) and, with
+RULE_RUNTIME_SG_INDEX_STORE set to a directory (/tmp/sg-index, file:///...) or an S3 location (s3://bucket/prefix),
+persisted for the other functions and the cold starts, with the stores of rule_runtime.leader_region. A group
+created since is described on its first lookup.
+'''
+import collections
+import json
+import os
+import threading
+import time
+import botocore.exceptions
+
+from rule_runtime.leader_region import build_result_store, get_invocation_region
+from rule_runtime.pagination import paginate
+from rule_runtime.port_ranges import PortIntervals, PortRange
+
+SG_INDEX_TTL_VARIABLE = 'RULE_RUNTIME_SG_INDEX_TTL'
+SG_INDEX_STORE_VARIABLE = 'RULE_RUNTIME_SG_INDEX_STORE'
+DEFAULT_SG_INDEX_TTL_SECONDS = 300
+
+# Increased when the persisted index changes, so that the indexes of a previous version are rebuilt.
+SG_INDEX_FORMAT = 1
+
+WORLD_CIDRS = {4: '0.0.0.0/0', 6: '::/0'}
+ALL_PROTOCOLS = '-1'
+PROTOCOL_NAMES = {'6': 'tcp', '17': 'udp', '1': 'icmp', '58': 'icmpv6'}
+
+# The indexes of the warm container, per (account, region).
+SG_INDEXES = {}
+SG_INDEXES_LOCK = threading.Lock()
+
+class ExposureRule(collections.namedtuple('ExposureRule', ['protocol', 'port_range', 'all_ports', 'cidrs'])):
+    """An inbound rule: its protocol (e.g. 'tcp', '-1' for all), PortRange (0-65535 when the rule has no port, i.e.
+    all_ports), and tuple of source IPv4 and IPv6 CIDRs."""
+    __slots__ = ()
+
+    def is_open_to(self, cidr):
+        return cidr in self.cidrs
+
+    def applies_to(self, protocol):
+        return self.protocol in (protocol, ALL_PROTOCOLS)
+
+def get_field(permission, config_field, api_field, default=None):
+    return permission.get(config_field, permission.get(api_field, default))
+
+def build_exposure_rule(permission):
+    protocol = str(get_field(permission, 'ipProtocol', 'IpProtocol', ALL_PROTOCOLS)).lower()
+    from_port = get_field(permission, 'fromPort', 'FromPort')
+    to_port = get_field(permission, 'toPort', 'ToPort')
+    cidrs = []
+    # The configuration items of the former version only hold the IPv4 CIDRs as strings, in ipRanges.
+    ipv4_ranges = get_field(permission, 'ipv4Ranges', 'IpRanges')
+    if ipv4_ranges is None:
+        ipv4_ranges = permission.get('ipRanges', [])
+    for ip_range in ipv4_ranges:
+        cidrs.append(ip_range if isinstance(ip_range, str) else get_field(ip_range, 'cidrIp', 'CidrIp'))
+    for ip_range in get_field(permission, 'ipv6Ranges', 'Ipv6Ranges', []):
+        cidrs.append(get_field(ip_range, 'cidrIpv6', 'CidrIpv6'))
+    return ExposureRule(PROTOCOL_NAMES.get(protocol, protocol),
+                        PortRange(0 if from_port is None else from_port, 65535 if to_port is None else to_port),
+                        from_port is None, tuple(cidrs))
+
+class SecurityGroupExposure():
+    """The inbound rules of a security group.
+
+    Keyword arguments:
+    group_id -- the id of the group, e.g. 'sg-0123456789abcdef0'
+    rules -- the list of its ExposureRule, in the order of the ipPermissions
+    """
+    __slots__ = ('group_id', 'rules')
+
+    def __init__(self, group_id, rules):
+        self.group_id = group_id
+        self.rules = tuple(rules)
+
+    @classmethod
+    def from_configuration(cls, configuration):
+        """Return the exposure of the configuration of a configuration item, or of a describe_security_groups item."""
+        return cls(configuration.get('groupId', configuration.get('GroupId')),
+                   [build_exposure_rule(permission) for permission in get_field(configuration, 'ipPermissions', 'IpPermissions', [])])
+
+    def iter_rules_open_to(self, cidr):
+        """Yield the rules whose sources include cidr, e.g. '0.0.0.0/0', in order."""
+        for rule in self.rules:
+            if rule.is_open_to(cidr):
+                yield rule
+
+    def is_open_to_world(self, ip_versions=(4, 6)):
+        """Return whether a rule is open to 0.0.0.0/0 and/or ::/0, whatever its protocol and ports."""
+        return any(rule.is_open_to(WORLD_CIDRS[version]) for rule in self.rules for version in ip_versions)
+
+    def get_ports_open_to_world(self, protocol=None, ip_versions=(4, 6)):
+        """Return the PortIntervals open to the world for a protocol (e.g. 'tcp'), including the rules of all the
+        protocols, or for any protocol when None."""
+        world_cidrs = [WORLD_CIDRS[version] for version in ip_versions]
+        return PortIntervals(rule.port_range for rule in self.rules
+                             if (protocol is None or rule.applies_to(protocol)) and any(rule.is_open_to(cidr) for cidr in world_cidrs))
+
+    def has_all_protocols_rule(self):
+        """Return whether a rule allows all the protocols (-1), whatever its sources."""
+        return any(rule.protocol == ALL_PROTOCOLS for rule in self.rules)
+
+    def has_all_ports_rule(self):
+        """Return whether a rule allows all the ports (i.e. it has no port range), whatever its sources."""
+        return any(rule.all_ports for rule in self.rules)
+
+    def to_dict(self):
+        return {'GroupId': self.group_id, 'Rules': [[rule.protocol, list(rule.port_range), rule.all_ports, list(rule.cidrs)] for rule in self.rules]}
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(value['GroupId'], [ExposureRule(protocol, PortRange(*port_range), all_ports, tuple(cidrs))
+                                      for protocol, port_range, all_ports, cidrs in value['Rules']])
+
+class SecurityGroupExposureIndex():
+    """The SecurityGroupExposure of the security groups of an account and region, per group id.
+
+    Keyword arguments:
+    groups -- the initial SecurityGroupExposure (default none)
+    created_at -- the time the groups were read at (default now)
+    """
+    def __init__(self, groups=None, created_at=None):
+        self.groups = {group.group_id: group for group in groups or []}
+        self.created_at = time.time() if created_at is None else created_at
+        self.lock = threading.Lock()
+
+    def add(self, configuration):
+        """Add the group of a configuration item configuration, describe_security_groups item or JSON string of them
+        (e.g. the configuration of batch_get_resource_config), and return its SecurityGroupExposure."""
+        if isinstance(configuration, str):
+            configuration = json.loads(configuration)
+        group = SecurityGroupExposure.from_configuration(configuration)
+        with self.lock:
+            self.groups[group.group_id] = group
+        return group
+
+    def load_security_groups(self, ec2_client, group_ids=None):
+        """Describe the groups of the region, or only the given group ids, and add them."""
+        if group_ids is not None and not group_ids:
+            return
+        # MaxResults cannot be set along with GroupIds.
+        kwargs = {'GroupIds': list(group_ids)} if group_ids is not None else {'MaxResults': 1000}
+        for security_group in paginate(ec2_client.describe_security_groups, 'SecurityGroups', 'NextToken', **kwargs):
+            self.add(security_group)
+
+    def get(self, group_id):
+        """Return the SecurityGroupExposure of a group id, None when it is not in the index."""
+        return self.groups.get(group_id)
+
+    def get_groups(self, group_ids, ec2_client=None):
+        """Return the SecurityGroupExposure of the group ids in the index. With ec2_client, the groups missing from
+        the index (e.g. created since it was built) are described first, in one call."""
+        if ec2_client is not None:
+            missing_group_ids = sorted(set(group_id for group_id in group_ids if group_id not in self.groups))
+            if missing_group_ids:
+                self.load_security_groups(ec2_client, missing_group_ids)
+        return [self.groups[group_id] for group_id in group_ids if group_id in self.groups]
+
+    def is_fresh(self, ttl):
+        return time.time() < self.created_at + ttl
+
+    def __contains__(self, group_id):
+        return group_id in self.groups
+
+    def __iter__(self):
+        return iter(list(self.groups.values()))
+
+    def __len__(self):
+        return len(self.groups)
+
+    def to_dict(self):
+        return {'Format': SG_INDEX_FORMAT, 'CreatedAt': self.created_at, 'Groups': [group.to_dict() for group in self]}
+
+    @classmethod
+    def from_dict(cls, value):
+        """Return the index of to_dict(), None when it was written by another version."""
+        if not value or value.get('Format') != SG_INDEX_FORMAT:
+            return None
+        return cls([SecurityGroupExposure.from_dict(group) for group in value['Groups']], value['CreatedAt'])
+
+def get_sg_index_ttl():
+    try:
+        return int(os.environ.get(SG_INDEX_TTL_VARIABLE, DEFAULT_SG_INDEX_TTL_SECONDS))
+    except ValueError:
+        print('Invalid {} value, {} is used.'.format(SG_INDEX_TTL_VARIABLE, DEFAULT_SG_INDEX_TTL_SECONDS))
+        return DEFAULT_SG_INDEX_TTL_SECONDS
+
+def get_sg_index_key(event, region):
+    return '{}/{}/security-groups.json'.format(event.get('accountId'), region)
+
+def load_stored_index(store, key, ttl):
+    try:
+        index = SecurityGroupExposureIndex.from_dict(store.load(key))
+    except (botocore.exceptions.ClientError, IOError, OSError, KeyError, TypeError, ValueError) as ex:
+        print('Unable to load the security group index: {}'.format(ex))
+        return None
+    if index is None or not index.is_fresh(ttl):
+        return None
+    return index
+
+def save_stored_index(store, key, index):
+    try:
+        store.save(key, index.to_dict())
+    except (botocore.exceptions.ClientError, IOError, OSError, TypeError, ValueError) as ex:
+        print('Unable to save the security group index: {}'.format(ex))
+
+def get_security_group_exposure_index(get_client, event, region=None):
+    """Return the SecurityGroupExposureIndex of all the security groups of the account and region of the invocation,
+    from the warm container or RULE_RUNTIME_SG_INDEX_STORE while younger than RULE_RUNTIME_SG_INDEX_TTL seconds,
+    otherwise described again.
+
+    Keyword arguments:
+    get_client -- the get_client() of the runtime, called for the ec2 (and s3) client
+    event -- the event variable given in the lambda handler
+    region -- the region of the security groups (default the region of the invocation)
+    """
+    region = region or get_invocation_region(event)
+    ttl = get_sg_index_ttl()
+    cache_key = (event.get('accountId'), region)
+    with SG_INDEXES_LOCK:
+        index = SG_INDEXES.get(cache_key)
+    if index is not None and index.is_fresh(ttl):
+        return index
+
+    location = os.environ.get(SG_INDEX_STORE_VARIABLE, '').strip()
+    store = build_result_store(location, get_client, event) if location else None
+    index = load_stored_index(store, get_sg_index_key(event, region), ttl) if store is not None else None
+    if index is None:
+        index = SecurityGroupExposureIndex()
+        index.load_security_groups(get_client('ec2', event, region=region))
+        if store is not None:
+            save_stored_index(store, get_sg_index_key(event, region), index)
+    with SG_INDEXES_LOCK:
+        SG_INDEXES[cache_key] = index
+    return index
+
+def reset_security_group_exposure_index():
+    """Forget the indexes of the warm container (i.e. back to a cold start)."""
+    with SG_INDEXES_LOCK:
+        SG_INDEXES.clear()
@@ -0,0 +1,266 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+'''
+Incremental evaluation of the configuration change notifications: the verdict of a resource is reused while the
+parts of its configuration item relevant to the rule are unchanged.
+
+A rule on IAM entities (e.g. IAM_ROLE_NO_POLICY_FULL_STAR) calls the IAM APIs for every change of a role, even
+when only its tags changed. RuleRuntime.evaluate_incrementally() fingerprints the configuration fields the rule
+depends on (e.g. the inline and attached policies of the role) and returns the cached verdict when the fingerprint
+of the new configuration item is the same, without calling the rule.
+
+A cached verdict is invalidated, i.e. evaluated again, when:
+
+  - the fingerprint of the relevant fields, resource name or ARN of the configuration item changed
+  - the rule parameters changed (their hash is kept along with the verdict)
+  - it is older than RULE_RUNTIME_VERDICT_CACHE_TTL seconds (default 86400): the verdict may also depend on what
+    the configuration item does not hold, e.g. a new default version of an attached managed policy
+  - the resource is deleted, or invalidate_verdict() is called
+  - VERDICT_CACHE_FORMAT is increased with a change of the cached data
+
+The backend is selected by RULE_RUNTIME_VERDICT_CACHE, the mode being disabled without it:
+
+  memory                     the Lambda container, lost on a cold start
+  /tmp/verdicts, file:///..  one JSON file per resource in a directory
+  dynamodb://table-name      a DynamoDB table (or any service with its GetItem, PutItem and DeleteItem API),
+                             whose partition key is the CacheKey string, read with the dynamodb client of get_client().
+                             ExpiresAt can be set as the TTL attribute of the table.
+
+The hit rate is printed at the end of the invocations that used it.
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+import botocore.exceptions
+
+VERDICT_CACHE_VARIABLE = 'RULE_RUNTIME_VERDICT_CACHE'
+VERDICT_CACHE_TTL_VARIABLE = 'RULE_RUNTIME_VERDICT_CACHE_TTL'
+DEFAULT_VERDICT_CACHE_TTL_SECONDS = 86400
+
+# Increased when the fingerprints or the cached verdicts change, so that the entries of a previous version miss.
+VERDICT_CACHE_FORMAT = 1
+
+# The fields of the configuration item fingerprinted along with the configuration fields of the rule.
+FINGERPRINT_ITEM_FIELDS = ('resourceType', 'resourceId', 'resourceName', 'ARN')
+
+# The memory backend of the Lambda container, built on first use.
+MEMORY_BACKEND = None
+VERDICT_CACHE_STATS = {'hits': 0, 'misses': 0, 'invalidations': 0}
+VERDICT_CACHE_STATS_LOCK = threading.Lock()
+
+def get_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def get_configuration_fingerprint(configuration_item, configuration_fields):
+    """Return the hash of the fields of the configuration item a rule depends on.
+
+    Keyword arguments:
+    configuration_item -- the configurationItem dictionary in the invokingEvent
+    configuration_fields -- the fields of its configuration, e.g. ('rolePolicyList', 'attachedManagedPolicies')
+    """
+    configuration = configuration_item.get('configuration') or {}
+    return get_hash({
+        'Format': VERDICT_CACHE_FORMAT,
+        'Item': {field: configuration_item.get(field) for field in FINGERPRINT_ITEM_FIELDS},
+        'Configuration': {field: configuration.get(field) for field in configuration_fields}})
+
+def get_cache_key(event, configuration_item):
+    # One entry per rule and resource, the fingerprint and the parameters are compared on a hit.
+    return get_hash([event.get('accountId'), event.get('configRuleName'), configuration_item['resourceType'], configuration_item['resourceId']])
+
+class MemoryVerdictBackend():
+    """The verdicts kept in the Lambda container."""
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class FileVerdictBackend():
+    """The verdicts in a directory, one JSON file per resource.
+
+    Keyword arguments:
+    directory -- the directory of the files, created on the first write
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.get_path(key), encoding='utf-8') as entry_file:
+                return json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        # The file is replaced atomically, a concurrent reader sees either verdict.
+        path = self.get_path(key)
+        temporary_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+        os.makedirs(self.directory, exist_ok=True)
+        with open(temporary_path, 'w', encoding='utf-8') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temporary_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except (IOError, OSError):
+            pass
+
+class DynamoDBVerdictBackend():
+    """The verdicts in a DynamoDB table whose partition key is the CacheKey string.
+
+    Keyword arguments:
+    dynamodb_client -- the DynamoDB boto client
+    table_name -- the name of the table
+    """
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def get(self, key):
+        item = self.dynamodb_client.get_item(TableName=self.table_name, Key={'CacheKey': {'S': key}}).get('Item')
+        if not item:
+            return None
+        return json.loads(item['Entry']['S'])
+
+    def put(self, key, entry):
+        self.dynamodb_client.put_item(TableName=self.table_name, Item={
+            'CacheKey': {'S': key}, 'Entry': {'S': json.dumps(entry)}, 'ExpiresAt': {'N': str(int(entry['ExpiresAt']))}})
+
+    def delete(self, key):
+        self.dynamodb_client.delete_item(TableName=self.table_name, Key={'CacheKey': {'S': key}})
+
+def get_verdict_cache_backend(get_client, event):
+    """Return the backend selected by RULE_RUNTIME_VERDICT_CACHE, None when the incremental mode is disabled.
+
+    Keyword arguments:
+    get_client -- the get_client() of the runtime, called for the dynamodb client
+    event -- the event variable given in the lambda handler
+    """
+    global MEMORY_BACKEND
+    location = os.environ.get(VERDICT_CACHE_VARIABLE, '').strip()
+    if not location:
+        return None
+    if location == 'memory':
+        if MEMORY_BACKEND is None:
+            MEMORY_BACKEND = MemoryVerdictBackend()
+        return MEMORY_BACKEND
+    if location.startswith('dynamodb://'):
+        return DynamoDBVerdictBackend(get_client('dynamodb', event), location[len('dynamodb://'):])
+    if location.startswith('file://'):
+        location = location[len('file://'):]
+    return FileVerdictBackend(location)
+
+def reset_verdict_cache():
+    """Forget the verdicts of the memory backend and the counters (i.e. back to a cold start)."""
+    global MEMORY_BACKEND
+    MEMORY_BACKEND = None
+    pop_verdict_cache_stats()
+
+def count(stat):
+    with VERDICT_CACHE_STATS_LOCK:
+        VERDICT_CACHE_STATS[stat] += 1
+
+def pop_verdict_cache_stats():
+    """Return the counters since the last call, and reset them."""
+    with VERDICT_CACHE_STATS_LOCK:
+        stats = dict(VERDICT_CACHE_STATS)
+        for key in VERDICT_CACHE_STATS:
+            VERDICT_CACHE_STATS[key] = 0
+    return stats
+
+def get_verdict(compliance_result):
+    """Return the (compliance type, annotation) of the value returned for a configuration item, None when it cannot be
+    rebuilt from the configuration item (e.g. a list of evaluations)."""
+    if isinstance(compliance_result, str):
+        return compliance_result, None
+    if isinstance(compliance_result, dict) and 'ComplianceType' in compliance_result:
+        return compliance_result['ComplianceType'], compliance_result.get('Annotation')
+    return None
+
+def get_cached_verdict(backend, key, fingerprint, parameters_hash):
+    entry = backend.get(key)
+    if entry is None:
+        return None
+    if entry.get('Fingerprint') != fingerprint or entry.get('Parameters') != parameters_hash or entry.get('ExpiresAt', 0) <= time.time():
+        return None
+    return entry['ComplianceType'], entry.get('Annotation')
+
+def evaluate_incrementally(backend, event, configuration_item, configuration_fields, rule_parameters, evaluate, build_evaluation_from_config_item):
+    """Return the cached verdict of the configuration item as an evaluation when its relevant fields are unchanged,
+    otherwise the result of evaluate(), which is cached.
+
+    An error of the backend is printed and the configuration item is evaluated.
+
+    Keyword arguments:
+    backend -- the backend of get_verdict_cache_backend(), None to call evaluate()
+    event -- the event variable given in the lambda handler
+    configuration_item -- the configurationItem dictionary in the invokingEvent
+    configuration_fields -- the fields of the configuration the verdict depends on
+    rule_parameters -- the valid rule parameters, part of the cached verdict
+    evaluate -- the function evaluating the configuration item, returning a compliance type or an evaluation
+    build_evaluation_from_config_item -- the function building the evaluation of a cached verdict
+    """
+    if backend is None:
+        return evaluate()
+    key = get_cache_key(event, configuration_item)
+    fingerprint = get_configuration_fingerprint(configuration_item, configuration_fields)
+    parameters_hash = get_hash(rule_parameters)
+    try:
+        verdict = get_cached_verdict(backend, key, fingerprint, parameters_hash)
+    except (botocore.exceptions.ClientError, IOError, OSError, KeyError, ValueError) as ex:
+        print('Unable to read the verdict cache: {}'.format(ex))
+        verdict = None
+    if verdict is not None:
+        count('hits')
+        return build_evaluation_from_config_item(configuration_item, verdict[0], annotation=verdict[1])
+
+    count('misses')
+    compliance_result = evaluate()
+    verdict = get_verdict(compliance_result)
+    if verdict is not None:
+        ttl = int(os.environ.get(VERDICT_CACHE_TTL_VARIABLE, DEFAULT_VERDICT_CACHE_TTL_SECONDS))
+        entry = {'Fingerprint': fingerprint, 'Parameters': parameters_hash, 'ComplianceType': verdict[0], 'ExpiresAt': time.time() + ttl}
+        if verdict[1] is not None:
+            entry['Annotation'] = verdict[1]
+        try:
+            backend.put(key, entry)
+        except (botocore.exceptions.ClientError, IOError, OSError, TypeError, ValueError) as ex:
+            print('Unable to write the verdict cache: {}'.format(ex))
+    return compliance_result
+
+def invalidate_verdict(backend, event, configuration_item):
+    """Forget the cached verdict of the resource of the configuration item, e.g. when it is deleted."""
+    if backend is None:
+        return
+    try:
+        backend.delete(get_cache_key(event, configuration_item))
+        count('invalidations')
+    except (botocore.exceptions.ClientError, IOError, OSError) as ex:
+        print('Unable to invalidate the verdict cache: {}'.format(ex))
+
+def log_verdict_cache_report():
+    """Print the hit rate of the verdicts since the last report, if the cache was used."""
+    stats = pop_verdict_cache_stats()
+    lookups = stats['hits'] + stats['misses']
+    if not lookups and not stats['invalidations']:
+        return
+    print('verdict cache: {lookups} lookups, {hits} hits, {misses} misses ({hit_rate:.1f}% hit rate), {invalidations} invalidated'.format(
+        lookups=lookups, hit_rate=100.0 * stats['hits'] / lookups if lookups else 0.0, **stats))